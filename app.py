@@ -1,19 +1,81 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for
-from flask_jwt_extended import JWTManager, jwt_required, get_jwt_identity
+from flask import Flask, render_template, request, jsonify, redirect, url_for, Response, stream_with_context, g, make_response
+from flask_jwt_extended import JWTManager, jwt_required, get_jwt_identity, get_jwt, create_access_token
 from flask_cors import CORS
 from config import Config
-from database import init_db, get_db_connection
+from database import init_db, get_db_connection, open_body, read_body, domain_version_key, bump_domain_version
+from mail_shards import get_mail_connection
 from auth import Auth
+from passwords import PasswordServiceBusy
+from routing import routing_index, bump_routing_version, ROUTING_VERSION_KEY
+from http_cache import version_cache, response_cache, make_etag, USERS_VERSION_KEY
+from events import event_bus, EventBusFull
+from metrics import registry, HTTP_REQUEST_SECONDS, HTTP_RESPONSES
+from health import health
+from mail_parser import message_cache, message_parts, message_part, iter_chunks
 import json
+import logging
+import itertools
+import time
+import base64
+from functools import wraps
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.config.from_object(Config)
 CORS(app)
 jwt = JWTManager(app)
 
+# Escopo dos tokens de /api/events (ver events_token)
+EVENTS_SCOPE = 'events'
+
+@jwt.token_verification_loader
+def verify_token_scope(jwt_header, jwt_data):
+    # O token de eventos só abre o stream, e o stream só aceita esse token:
+    # o token de acesso nunca vai na URL
+    return (jwt_data.get('scope') == EVENTS_SCOPE) == (request.endpoint == 'email_events')
+
+@jwt.token_verification_failed_loader
+def token_scope_refused(jwt_header, jwt_data):
+    return jsonify({'error': 'Token não vale para esta rota'}), 403
+
 # Inicializar banco de dados
 init_db()
 
+# Métricas por rota
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        endpoint = request.endpoint or 'unknown'
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint, request.method)
+        HTTP_RESPONSES.inc(endpoint, request.method, str(response.status_code))
+    return response
+
+@app.route('/metrics')
+def metrics():
+    """Métricas de todos os processos no formato do Prometheus"""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/healthz')
+def healthz():
+    """O processo está respondendo (liveness)"""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+def readyz():
+    """Banco e listeners do processo prontos para receber tráfego (readiness)"""
+    ready, checks = health.check()
+    return jsonify({
+        'status': 'ready' if ready else 'unavailable',
+        'checks': checks
+    }), 200 if ready else 503
+
 # Rotas de autenticação
 @app.route('/api/login', methods=['POST'])
 def login():
@@ -24,15 +86,21 @@ def login():
     if not username or not password:
         return jsonify({'error': 'Usuário e senha são obrigatórios'}), 400
     
-    print(f"Tentativa de login: username={username}, password={'*' * len(password)}")
+    logger.debug(f"Tentativa de login: username={username}")
     
-    auth_result = Auth.authenticate(username, password)
+    try:
+        auth_result = Auth.authenticate(username, password)
+    except PasswordServiceBusy:
+        # Muitas verificações de senha pendentes: recusar sem enfileirar
+        response = jsonify({'error': 'Servidor ocupado, tente novamente'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
     
     if auth_result:
-        print(f"Login bem-sucedido para: {username}")
+        logger.debug(f"Login bem-sucedido para: {username}")
         return jsonify(auth_result)
     
-    print(f"Falha no login para: {username}")
+    logger.debug(f"Falha no login para: {username}")
     return jsonify({'error': 'Credenciais inválidas'}), 401
 
 @app.route('/api/refresh', methods=['POST'])
@@ -40,44 +108,185 @@ def login():
 def refresh():
     return jsonify(Auth.refresh_token())
 
+def day_bounds(day):
+    """Converte 'AAAA-MM-DD' no intervalo [dia, dia seguinte) de received_at"""
+    try:
+        start = datetime.strptime(day, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+    return start.isoformat(), (start + timedelta(days=1)).isoformat()
+
+def encode_cursor(values):
+    """Cursor opaco de paginação a partir da chave da última linha"""
+    raw = json.dumps(list(values), separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor, *types):
+    """
+    Chave da última linha da página anterior (None na primeira página).
+    `types` é o formato esperado da chave, um tipo por posição; um cursor
+    com outro formato levanta ValueError (400 na API).
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError('cursor inválido')
+    if not isinstance(values, list) or len(values) != len(types):
+        raise ValueError('cursor inválido')
+    for value, expected in zip(values, types):
+        # bool é subclasse de int, mas não é uma chave válida
+        if not isinstance(value, expected) or isinstance(value, bool):
+            raise ValueError('cursor inválido')
+    return values
+
+def page_limit(default):
+    """Tamanho da página pedido em ?limit=, limitado a API_MAX_PAGE_SIZE"""
+    limit = int(request.args.get('limit', default))
+    if limit < 1:
+        raise ValueError('limit inválido')
+    return min(limit, Config.API_MAX_PAGE_SIZE)
+
+def stream_page(query, params, limit, key, conn=None):
+    """
+    Executa a consulta (que deve pedir limit + 1 linhas) e devolve
+    {"items": [...], "next_cursor": ...}. Páginas de até API_BUFFERED_PAGE
+    bytes vão com Content-Length; as maiores são transmitidas à medida que
+    as linhas são lidas, sem montar a lista inteira em memória.
+    `conn` (devolvida ao pool no fim) é por padrão do banco principal.
+    """
+    if conn is None:
+        conn = get_db_connection()
+    cursor = conn.execute(query, tuple(params))
+    
+    def generate():
+        try:
+            # Agrupar as linhas em blocos de API_STREAM_CHUNK bytes: um write
+            # por linha gera dezenas de segmentos TCP pequenos por resposta
+            chunk = ['{"items": [']
+            size = 0
+            last = None
+            next_cursor = None
+            for count, row in enumerate(cursor):
+                if count == limit:
+                    next_cursor = encode_cursor(key(last))
+                    break
+                item = app.json.dumps(dict(row))
+                chunk.append(',' + item if count else item)
+                size += len(item)
+                if size >= Config.API_STREAM_CHUNK:
+                    yield ''.join(chunk)
+                    chunk = []
+                    size = 0
+                last = row
+            chunk.append('], "next_cursor": ' + json.dumps(next_cursor) + '}')
+            yield ''.join(chunk)
+        finally:
+            conn.close()
+    
+    # Sem Content-Length o servidor HTTP/1.0 só sinaliza o fim fechando a
+    # conexão, o que custa ~10ms por resposta: até API_BUFFERED_PAGE bytes a
+    # página é montada aqui e sai completa; só as maiores são transmitidas
+    blocks = generate()
+    buffered = []
+    size = 0
+    for block in blocks:
+        buffered.append(block)
+        size += len(block)
+        if size > Config.API_BUFFERED_PAGE:
+            return Response(stream_with_context(itertools.chain(buffered, blocks)),
+                            mimetype='application/json')
+    return Response(''.join(buffered), mimetype='application/json')
+
 # Middleware para verificar permissões
 def permission_required(permission_name):
     def decorator(f):
+        @wraps(f)
         @jwt_required()
         def decorated_function(*args, **kwargs):
             current_user = get_jwt_identity()
             
-            if not Auth.has_permission(current_user['id'], permission_name):
+            if not Auth.has_permission(current_user['id'], permission_name, get_jwt()):
                 return jsonify({'error': 'Permissão negada'}), 403
             
             return f(*args, **kwargs)
         return decorated_function
     return decorator
 
+def conditional(versions, daily=False):
+    """
+    Respostas condicionais: `versions(usuário)` dá as chaves de versão da
+    tabela meta de que a resposta depende. A chave (rota, escopo, query
+    string, versões) forma o ETag; um If-None-Match igual recebe 304 e um
+    corpo já serializado com a mesma chave sai do cache, ambos sem consultar
+    o banco (ver http_cache.py). Com daily=True a chave inclui o dia UTC.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            current_user = get_jwt_identity()
+            key = (request.endpoint, current_user.get('domain_id'), current_user.get('company_id'),
+                   current_user.get('is_super_admin'), request.query_string,
+                   version_cache.get(versions(current_user)))
+            if daily:
+                key += (datetime.utcnow().date().isoformat(),)
+            etag = make_etag(key)
+            
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+            else:
+                cached = response_cache.get(key)
+                if cached is not None:
+                    response = Response(cached[0], mimetype=cached[1])
+                else:
+                    response = make_response(f(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    # Páginas transmitidas (acima de API_BUFFERED_PAGE) não ficam em cache
+                    if not response.is_streamed:
+                        response_cache.put(key, response.get_data(), response.mimetype)
+            
+            response.set_etag(etag)
+            # O navegador guarda a resposta, mas revalida a cada consulta
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return decorated_function
+    return decorator
+
 # Rotas da API
 @app.route('/api/domains', methods=['GET'])
 @jwt_required()
+@conditional(lambda user: (ROUTING_VERSION_KEY,))
 def get_domains():
     current_user = get_jwt_identity()
-    conn = get_db_connection()
-    cursor = conn.cursor()
     
-    if current_user['is_super_admin']:
-        cursor.execute('''
-        SELECT d.*, c.name as company_name FROM domains d
-        LEFT JOIN companies c ON d.company_id = c.id
-        ''')
-    else:
-        cursor.execute('''
-        SELECT d.*, c.name as company_name FROM domains d
-        LEFT JOIN companies c ON d.company_id = c.id
-        WHERE d.id = ? OR c.id = ?
-        ''', (current_user['domain_id'], current_user['company_id']))
+    try:
+        after = decode_cursor(request.args.get('cursor'), int)
+        limit = page_limit(50)
+    except ValueError:
+        return jsonify({'error': 'Parâmetros de paginação inválidos'}), 400
     
-    domains = cursor.fetchall()
-    conn.close()
+    query = '''
+    SELECT d.*, c.name as company_name FROM domains d
+    LEFT JOIN companies c ON d.company_id = c.id
+    WHERE 1 = 1
+    '''
+    params = []
+    
+    if not current_user['is_super_admin']:
+        query += ' AND (d.id = ? OR c.id = ?)'
+        params.extend([current_user['domain_id'], current_user['company_id']])
+    
+    if after:
+        query += ' AND d.id > ?'
+        params.append(after[0])
     
-    return jsonify([dict(domain) for domain in domains])
+    query += ' ORDER BY d.id LIMIT ?'
+    params.append(limit + 1)
+    
+    return stream_page(query, params, limit, lambda row: (row['id'],))
 
 @app.route('/api/domains', methods=['POST'])
 @permission_required('manage_domain')
@@ -92,10 +301,14 @@ def create_domain():
         INSERT INTO domains (domain_name, company_id, ssl_enabled)
         VALUES (?, ?, ?)
         ''', (data['domain_name'], data.get('company_id'), data.get('ssl_enabled', False)))
+        domain_id = cursor.lastrowid
+        bump_routing_version(cursor)
+        bump_domain_version(cursor, domain_id)
         
         conn.commit()
-        domain_id = cursor.lastrowid
         conn.close()
+        routing_index.invalidate()
+        version_cache.invalidate()
         
         return jsonify({'message': 'Domínio criado com sucesso', 'id': domain_id}), 201
     except Exception as e:
@@ -104,29 +317,39 @@ def create_domain():
 
 @app.route('/api/users', methods=['GET'])
 @jwt_required()
+@conditional(lambda user: (ROUTING_VERSION_KEY, USERS_VERSION_KEY))
 def get_users():
     current_user = get_jwt_identity()
-    conn = get_db_connection()
-    cursor = conn.cursor()
     
-    if current_user['is_super_admin']:
-        cursor.execute('''
-        SELECT u.*, d.domain_name, c.name as company_name FROM users u
-        LEFT JOIN domains d ON u.domain_id = d.id
-        LEFT JOIN companies c ON u.company_id = c.id
-        ''')
-    else:
-        cursor.execute('''
-        SELECT u.*, d.domain_name, c.name as company_name FROM users u
-        LEFT JOIN domains d ON u.domain_id = d.id
-        LEFT JOIN companies c ON u.company_id = c.id
-        WHERE u.domain_id = ? OR u.company_id = ?
-        ''', (current_user['domain_id'], current_user['company_id']))
+    try:
+        after = decode_cursor(request.args.get('cursor'), int)
+        limit = page_limit(50)
+    except ValueError:
+        return jsonify({'error': 'Parâmetros de paginação inválidos'}), 400
     
-    users = cursor.fetchall()
-    conn.close()
+    # password_hash nunca sai da API
+    query = '''
+    SELECT u.id, u.username, u.email, u.full_name, u.company_id, u.domain_id,
+           u.is_domain_admin, u.is_super_admin, u.created_at, u.last_login, u.status,
+           d.domain_name, c.name as company_name FROM users u
+    LEFT JOIN domains d ON u.domain_id = d.id
+    LEFT JOIN companies c ON u.company_id = c.id
+    WHERE 1 = 1
+    '''
+    params = []
+    
+    if not current_user['is_super_admin']:
+        query += ' AND (u.domain_id = ? OR u.company_id = ?)'
+        params.extend([current_user['domain_id'], current_user['company_id']])
+    
+    if after:
+        query += ' AND u.id > ?'
+        params.append(after[0])
+    
+    query += ' ORDER BY u.id LIMIT ?'
+    params.append(limit + 1)
     
-    return jsonify([dict(user) for user in users])
+    return stream_page(query, params, limit, lambda row: (row['id'],))
 
 # Rotas do frontend
 @app.route('/')
@@ -162,34 +385,137 @@ def emails_page():
 def settings_page():
     return render_template('settings.html')
 
+# Colunas que as listagens de emails podem devolver (?fields=); o corpo só
+# é lido em /api/emails/<id>
+EMAIL_LIST_FIELDS = {
+    'id': 'e.id',
+    'sender': 'e.sender',
+    'recipient': 'e.recipient',
+    'subject': 'e.subject',
+    'received_at': 'e.received_at',
+    'status': 'e.status',
+    'size': 'e.size',
+    'preview': 'e.snippet',
+    'message_id': 'e.message_id',
+    'date_header': 'e.date_header',
+    'from_header': 'e.from_header',
+    'to_header': 'e.to_header',
+    'cc_header': 'e.cc_header',
+}
+EMAIL_LIST_DEFAULT = ('id', 'sender', 'recipient', 'subject', 'received_at', 'status', 'size', 'preview')
+
+def email_list_columns(fields=None):
+    """
+    Lista SELECT das colunas pedidas em ?fields= (ou da projeção padrão).
+    id e received_at sempre são incluídos, pois formam o cursor.
+    """
+    names = EMAIL_LIST_DEFAULT
+    if fields:
+        names = [name.strip() for name in fields.split(',') if name.strip()]
+        unknown = [name for name in names if name not in EMAIL_LIST_FIELDS]
+        if unknown:
+            raise ValueError(f"Campos inválidos: {', '.join(unknown)}")
+        names = ['id', 'received_at'] + [name for name in dict.fromkeys(names)
+                                         if name not in ('id', 'received_at')]
+    return ', '.join(f'{EMAIL_LIST_FIELDS[name]} AS {name}' for name in names)
+
 @app.route('/api/emails', methods=['GET'])
 @jwt_required()
+@conditional(lambda user: (domain_version_key(user.get('domain_id')),))
 def get_emails():
     """Obtém emails do usuário/domínio"""
     current_user = get_jwt_identity()
     
     date_filter = request.args.get('date')
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    try:
+        after = decode_cursor(request.args.get('cursor'), str, int)
+        limit = page_limit(100)
+    except ValueError:
+        return jsonify({'error': 'Parâmetros de paginação inválidos'}), 400
     
-    query = '''
-    SELECT e.* FROM emails e
+    try:
+        columns = email_list_columns(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Sem o corpo: as linhas saem do índice de listagem (migração 8)
+    query = f'''
+    SELECT {columns} FROM emails e
     WHERE e.domain_id = ?
     '''
     params = [current_user['domain_id']]
     
     if date_filter:
-        query += ' AND DATE(e.received_at) = ?'
-        params.append(date_filter)
+        day_range = day_bounds(date_filter)
+        if not day_range:
+            return jsonify({'error': 'Data inválida, use AAAA-MM-DD'}), 400
+        
+        # Intervalo em vez de DATE() para usar o índice (domain_id, received_at)
+        query += ' AND e.received_at >= ? AND e.received_at < ?'
+        params.extend(day_range)
+    
+    # Continuar depois do último (received_at, id) da página anterior
+    if after:
+        query += ' AND (e.received_at < ? OR (e.received_at = ? AND e.id < ?))'
+        params.extend([after[0], after[0], after[1]])
     
-    query += ' ORDER BY e.received_at DESC LIMIT 100'
+    query += ' ORDER BY e.received_at DESC, e.id DESC LIMIT ?'
+    params.append(limit + 1)
     
-    cursor.execute(query, tuple(params))
-    emails = cursor.fetchall()
+    return stream_page(query, params, limit, lambda row: (row['received_at'], row['id']),
+                       conn=get_mail_connection(current_user['domain_id']))
+
+@app.route('/api/emails/search', methods=['GET'])
+@jwt_required()
+def search_emails():
+    """Busca textual nos emails do domínio, ordenada por relevância"""
+    current_user = get_jwt_identity()
+    
+    terms = request.args.get('q', '').split()
+    if not terms:
+        return jsonify({'error': 'Informe o termo de busca em q'}), 400
+    
+    try:
+        after = decode_cursor(request.args.get('cursor'), int)
+        offset = after[0] if after else 0
+        if offset < 0:
+            raise ValueError('cursor inválido')
+        limit = page_limit(20)
+    except ValueError:
+        return jsonify({'error': 'Parâmetros de paginação inválidos'}), 400
+    
+    # Cada termo vira uma frase entre aspas (sem operadores do FTS5) e a
+    # busca fica restrita ao domínio do usuário
+    match = f'domain_tag:"d{int(current_user["domain_id"] or 0)}" AND ' + \
+        ' AND '.join('"' + term.replace('"', '""') + '"' for term in terms)
+    
+    conn = get_mail_connection(current_user['domain_id'])
+    cursor = conn.cursor()
+    
+    # Pesos do bm25: domain_tag, subject, sender, recipient, body_text
+    cursor.execute('''
+    SELECT e.id, e.sender, e.recipient, e.subject, e.received_at, e.status,
+           snippet(emails_fts, 4, '<mark>', '</mark>', '…', 16) AS snippet,
+           bm25(emails_fts, 0.0, 10.0, 3.0, 3.0, 1.0) AS score
+    FROM emails_fts
+    JOIN emails e ON e.id = emails_fts.rowid
+    WHERE emails_fts MATCH ?
+    ORDER BY score, e.id DESC
+    LIMIT ? OFFSET ?
+    ''', (match, limit + 1, offset))
+    results = cursor.fetchall()
     conn.close()
     
-    return jsonify([dict(email) for email in emails])
+    next_cursor = None
+    if len(results) > limit:
+        results = results[:limit]
+        next_cursor = encode_cursor([offset + limit])
+    
+    return jsonify({
+        'items': [dict(result) for result in results],
+        'next_cursor': next_cursor
+    })
 
 @app.route('/api/emails/<int:email_id>', methods=['GET'])
 @jwt_required()
@@ -197,23 +523,104 @@ def get_email(email_id):
     """Obtém um email específico"""
     current_user = get_jwt_identity()
     
-    conn = get_db_connection()
+    conn = get_mail_connection(current_user['domain_id'])
+    try:
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+        SELECT e.* FROM emails e
+        WHERE e.id = ? AND e.domain_id = ?
+        ''', (email_id, current_user['domain_id']))
+        
+        email = cursor.fetchone()
+        if not email:
+            return jsonify({'error': 'Email não encontrado'}), 404
+        
+        result = dict(email)
+        result['body'] = read_body(conn, email).decode('utf-8', errors='replace')
+        
+        # Árvore MIME analisada só quando pedida (?parts=1), com cache LRU
+        if request.args.get('parts'):
+            msg = parsed_message(conn, email)
+            result['parts'] = message_parts(msg) if msg is not None else []
+    finally:
+        conn.close()
+    
+    return jsonify(result)
+
+def parsed_message(conn, email):
+    """Mensagem MIME de um email recebido (None para os criados pelo painel)"""
+    if email['status'] != 'received':
+        return None
+    # Com DB_SHARDING os ids só são únicos dentro do domínio
+    return message_cache.get((email['domain_id'], email['id']), lambda: open_body(conn, email))
+
+@app.route('/api/emails/<int:email_id>/raw', methods=['GET'])
+@jwt_required()
+def get_email_raw(email_id):
+    """Fonte do email (RFC822 nos recebidos), transmitida em blocos do blob"""
+    current_user = get_jwt_identity()
+    
+    conn = get_mail_connection(current_user['domain_id'])
     cursor = conn.cursor()
     
     cursor.execute('''
-    SELECT e.* FROM emails e
+    SELECT e.id, e.body, e.body_hash, e.status FROM emails e
     WHERE e.id = ? AND e.domain_id = ?
     ''', (email_id, current_user['domain_id']))
     
     email = cursor.fetchone()
-    conn.close()
+    if not email:
+        conn.close()
+        return jsonify({'error': 'Email não encontrado'}), 404
     
-    if email:
-        return jsonify(dict(email))
-    return jsonify({'error': 'Email não encontrado'}), 404
+    body = open_body(conn, email)
+    
+    def release():
+        if not isinstance(body, bytes):
+            body.close()
+        conn.close()
+    
+    mimetype = 'message/rfc822' if email['status'] == 'received' else 'text/plain; charset=utf-8'
+    response = Response(iter_chunks(body), mimetype=mimetype)
+    response.headers['Content-Length'] = str(len(body))
+    response.call_on_close(release)
+    return response
+
+@app.route('/api/emails/<int:email_id>/parts/<int:index>', methods=['GET'])
+@jwt_required()
+def get_email_part(email_id, index):
+    """Conteúdo decodificado de uma parte (anexo, texto ou HTML) do email"""
+    current_user = get_jwt_identity()
+    
+    conn = get_mail_connection(current_user['domain_id'])
+    try:
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+        SELECT e.id, e.domain_id, e.body, e.body_hash, e.status FROM emails e
+        WHERE e.id = ? AND e.domain_id = ?
+        ''', (email_id, current_user['domain_id']))
+        
+        email = cursor.fetchone()
+        msg = parsed_message(conn, email) if email else None
+    finally:
+        conn.close()
+    
+    part = message_part(msg, index) if msg is not None else None
+    if part is None:
+        return jsonify({'error': 'Parte não encontrada'}), 404
+    
+    response = Response(part.get_payload(decode=True) or b'', mimetype=part.get_content_type())
+    filename = part.get_filename()
+    if filename:
+        response.headers.set('Content-Disposition', 'attachment', filename=filename)
+    return response
 
 @app.route('/api/stats', methods=['GET'])
 @jwt_required()
+@conditional(lambda user: (domain_version_key(user.get('domain_id')), ROUTING_VERSION_KEY, USERS_VERSION_KEY),
+             daily=True)
 def get_stats():
     """Obtém estatísticas do sistema"""
     current_user = get_jwt_identity()
@@ -221,14 +628,27 @@ def get_stats():
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    today = datetime.now().date()
-    
-    # Contar emails de hoje
+    # Resumo diário dos últimos STATS_SERIES_DAYS dias (datas UTC, como received_at)
+    today = datetime.utcnow().date()
+    first_day = today - timedelta(days=Config.STATS_SERIES_DAYS - 1)
     cursor.execute('''
-    SELECT COUNT(*) as count FROM emails 
-    WHERE domain_id = ? AND DATE(received_at) = ?
-    ''', (current_user['domain_id'], today))
-    emails_today = cursor.fetchone()['count']
+    SELECT day, received_count, received_bytes, sent_count, sent_bytes, active_users
+    FROM domain_daily_stats
+    WHERE domain_id = ? AND day >= ?
+    ORDER BY day
+    ''', (current_user['domain_id'], first_day.isoformat()))
+    days = {row['day']: dict(row) for row in cursor.fetchall()}
+    
+    series = []
+    for offset in range(Config.STATS_SERIES_DAYS):
+        day = (first_day + timedelta(days=offset)).isoformat()
+        series.append(days.get(day) or {
+            'day': day, 'received_count': 0, 'received_bytes': 0,
+            'sent_count': 0, 'sent_bytes': 0, 'active_users': 0
+        })
+    
+    # Emails de hoje
+    emails_today = series[-1]['received_count'] + series[-1]['sent_count']
     
     # Contar usuários ativos no domínio
     cursor.execute('''
@@ -245,14 +665,92 @@ def get_stats():
     ''', (current_user['domain_id'],))
     recent_logins = cursor.fetchall()
     
+    # Totais do painel, com a mesma visibilidade de /api/domains e /api/users
+    # (as listagens são paginadas e não servem de contagem)
+    if current_user['is_super_admin']:
+        cursor.execute('SELECT COUNT(*) FROM domains')
+        domain_count = cursor.fetchone()[0]
+        cursor.execute('SELECT COUNT(*) FROM users')
+        user_count = cursor.fetchone()[0]
+    else:
+        scope = (current_user['domain_id'], current_user['company_id'])
+        cursor.execute('''
+        SELECT COUNT(*) FROM domains d
+        LEFT JOIN companies c ON d.company_id = c.id
+        WHERE d.id = ? OR c.id = ?
+        ''', scope)
+        domain_count = cursor.fetchone()[0]
+        cursor.execute('SELECT COUNT(*) FROM users u WHERE u.domain_id = ? OR u.company_id = ?', scope)
+        user_count = cursor.fetchone()[0]
+    
     conn.close()
     
     return jsonify({
+        'domain_count': domain_count,
+        'user_count': user_count,
         'emails_today': emails_today,
+        'received_today': series[-1]['received_count'],
+        'sent_today': series[-1]['sent_count'],
         'active_users': active_users,
-        'recent_logins': [dict(login) for login in recent_logins]
+        'recent_logins': [dict(login) for login in recent_logins],
+        'series': series
     })
 
+@app.route('/api/events/token', methods=['POST'])
+@jwt_required()
+def events_token():
+    """
+    Token para abrir /api/events. O EventSource do navegador não envia
+    cabeçalhos e o token vai na URL, onde logs e proxies o registram: ele
+    expira em EVENTS_TOKEN_EXPIRES e não vale em nenhuma outra rota.
+    """
+    token = create_access_token(identity=get_jwt_identity(),
+                                expires_delta=Config.EVENTS_TOKEN_EXPIRES,
+                                additional_claims={'scope': EVENTS_SCOPE})
+    return jsonify({'token': token, 'expires_in': int(Config.EVENTS_TOKEN_EXPIRES.total_seconds())})
+
+@app.route('/api/events', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+def email_events():
+    """
+    Emails novos (e mudanças de status) do domínio em tempo real, como
+    Server-Sent Events. Aceita só o token de /api/events/token, em ?jwt=
+    (o EventSource não envia cabeçalhos) ou no Authorization. Um evento
+    `reset` avisa que eventos se perderam desde o Last-Event-ID e as
+    listagens devem ser recarregadas.
+    """
+    current_user = get_jwt_identity()
+    
+    last_id = request.headers.get('Last-Event-ID')
+    try:
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        last_id = None
+    
+    try:
+        subscription = event_bus.subscribe(current_user.get('domain_id'), last_id)
+    except EventBusFull:
+        response = jsonify({'error': 'Muitas conexões de eventos, tente novamente'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    
+    def generate():
+        yield f'retry: {Config.EVENTS_RETRY_MS}\n\n'
+        if subscription.reset:
+            yield 'event: reset\ndata: {}\n\n'
+        for event in subscription:
+            if event is None:
+                yield ': ping\n\n'
+            else:
+                yield f'id: {event[0]}\nevent: email\ndata: {event[1]}\n\n'
+    
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    # Também quando o gerador nem chega a começar (HEAD, cliente que desistiu)
+    response.call_on_close(lambda: event_bus.unsubscribe(subscription))
+    return response
+
 # Rota para verificar token (útil para debug)
 @app.route('/api/verify-token', methods=['GET'])
 @jwt_required()
@@ -266,4 +764,5 @@ def verify_token():
     })
 
 if __name__ == '__main__':
-    app.run(debug=True, port=8080)
\ No newline at end of file
+    # Servidor de desenvolvimento; em produção use web_server.py
+    app.run(host=Config.WEB_HOST, port=Config.WEB_PORT)
\ No newline at end of file
@@ -1,9 +1,108 @@
-from flask import jsonify
-from flask_jwt_extended import create_access_token, create_refresh_token, jwt_required, get_jwt_identity
-import bcrypt
-from database import get_db_connection
+from flask_jwt_extended import create_access_token, create_refresh_token, get_jwt_identity
+from database import get_db_connection, bump_version, get_version, record_daily_stats, bump_domain_version
+from http_cache import version_cache, bump_users_version
+from config import Config
+from passwords import password_service, PasswordServiceBusy
 from datetime import datetime
-import re
+import threading
+import time
+
+PERMISSIONS_VERSION_KEY = 'permissions'
+
+class PermissionCache:
+    """
+    Permissões efetivas dos usuários resolvidas em bitsets.
+
+    Cada permissão ocupa o bit de número igual ao seu id; o bitset de um
+    usuário une as permissões diretas e as dos seus grupos. Os bitsets ficam
+    em memória até o contador de versão `permissions` da tabela meta mudar
+    (verificado no máximo a cada PERMISSIONS_REFRESH_INTERVAL segundos).
+    """
+    
+    def __init__(self, refresh_interval=None):
+        self.refresh_interval = (Config.PERMISSIONS_REFRESH_INTERVAL
+                                 if refresh_interval is None else refresh_interval)
+        self._bits = {}
+        self._masks = {}
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+    
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < self.refresh_interval:
+            return
+        
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        version = get_version(cursor, PERMISSIONS_VERSION_KEY)
+        
+        if version != self._version:
+            cursor.execute('SELECT id, name FROM permissions')
+            bits = {row['name']: 1 << row['id'] for row in cursor.fetchall()}
+            with self._lock:
+                self._bits = bits
+                self._masks = {}
+                self._version = version
+        
+        conn.close()
+        self._checked_at = now
+    
+    def version(self):
+        """Versão atual das permissões"""
+        self._ensure_fresh()
+        return self._version
+    
+    def bit(self, permission_name):
+        """Bit da permissão ou None se ela não existir"""
+        self._ensure_fresh()
+        return self._bits.get(permission_name)
+    
+    def mask(self, user_id):
+        """Bitset das permissões efetivas do usuário"""
+        self._ensure_fresh()
+        
+        mask = self._masks.get(user_id)
+        if mask is not None:
+            return mask
+        
+        version = self._version
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+        SELECT permission_id FROM user_permissions WHERE user_id = ?
+        UNION
+        SELECT gp.permission_id FROM user_groups ug
+        JOIN group_permissions gp ON ug.group_id = gp.group_id
+        WHERE ug.user_id = ?
+        ''', (user_id, user_id))
+        
+        mask = 0
+        for row in cursor.fetchall():
+            mask |= 1 << row['permission_id']
+        conn.close()
+        
+        with self._lock:
+            if self._version == version:
+                self._masks[user_id] = mask
+        return mask
+    
+    def claims(self, user_id):
+        """Claims do access token com o bitset e a versão das permissões"""
+        return {'perms': self.mask(user_id), 'perms_v': self.version()}
+    
+    def invalidate(self):
+        """Descarta os bitsets; serão recalculados na próxima consulta"""
+        with self._lock:
+            self._version = None
+
+def bump_permissions_version(cursor):
+    """
+    Registra, na transação corrente, que permissões, grupos ou associações
+    mudaram. Deve ser chamado por todo código que altere permissions,
+    user_permissions, groups, user_groups ou group_permissions.
+    """
+    bump_version(cursor, PERMISSIONS_VERSION_KEY)
 
 class Auth:
     @staticmethod
@@ -47,28 +146,45 @@ class Auth:
         if user:
             logger.info(f"Usuário encontrado: {user['username']}, hash: {user['password_hash'][:20]}...")
             
-            # Verificar senha
+            # Verificar senha (no pool de processos do bcrypt)
             try:
-                # Converter bytes se necessário
                 password_hash = user['password_hash']
-                if isinstance(password_hash, str):
-                    password_hash = password_hash.encode('utf-8')
-                
-                password_check = password.encode('utf-8')
                 
-                if bcrypt.checkpw(password_check, password_hash):
+                if password_service.verify(password, password_hash):
+                    # Hashes gerados com um custo antigo são refeitos antes de
+                    # abrir a transação: o bcrypt não roda com o banco travado
+                    new_hash = None
+                    if password_service.needs_rehash(password_hash):
+                        try:
+                            new_hash = password_service.hash(password)
+                        except PasswordServiceBusy:
+                            pass
+                    
                     # Atualizar último login
                     conn = get_db_connection()
                     cursor = conn.cursor()
+                    # Em UTC, como o DATE('now') de record_daily_stats
+                    now = datetime.utcnow()
                     cursor.execute('UPDATE users SET last_login = ? WHERE id = ?', 
-                                 (datetime.now(), user['id']))
+                                 (now, user['id']))
+                    if new_hash is not None:
+                        cursor.execute('UPDATE users SET password_hash = ? WHERE id = ?',
+                                     (new_hash, user['id']))
+                    
+                    # Primeiro login do dia conta como usuário ativo no resumo
+                    if not user['last_login'] or str(user['last_login'])[:10] != now.date().isoformat():
+                        record_daily_stats(cursor, user['domain_id'], active_users=1)
+                    # last_login aparece em /api/users e /api/stats
+                    bump_users_version(cursor)
+                    bump_domain_version(cursor, user['domain_id'])
                     conn.commit()
                     conn.close()
+                    version_cache.invalidate()
                     
                     user_dict = dict(user)
                     user_dict.pop('password_hash', None)
                     
-                    # Criar tokens
+                    # Criar tokens (com o bitset de permissões efetivas)
                     access_token = create_access_token(identity={
                         'id': user['id'],
                         'username': user['username'],
@@ -77,7 +193,7 @@ class Auth:
                         'is_super_admin': bool(user['is_super_admin']),
                         'domain_id': user['domain_id'],
                         'company_id': user['company_id']
-                    })
+                    }, additional_claims=permission_cache.claims(user['id']))
                     
                     refresh_token = create_refresh_token(identity={
                         'id': user['id'],
@@ -91,6 +207,8 @@ class Auth:
                     }
                 else:
                     logger.warning("Senha incorreta")
+            except PasswordServiceBusy:
+                raise
             except Exception as e:
                 logger.error(f"Erro ao verificar senha: {str(e)}")
         
@@ -100,39 +218,27 @@ class Auth:
     @staticmethod
     def refresh_token():
         current_user = get_jwt_identity()
-        new_token = create_access_token(identity=current_user)
+        new_token = create_access_token(identity=current_user,
+                                        additional_claims=permission_cache.claims(current_user['id']))
         return {'access_token': new_token}
     
     @staticmethod
-    def has_permission(user_id, permission_name):
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Verificar permissões diretas do usuário
-        cursor.execute('''
-        SELECT COUNT(*) FROM user_permissions up
-        JOIN permissions p ON up.permission_id = p.id
-        WHERE up.user_id = ? AND p.name = ?
-        ''', (user_id, permission_name))
-        
-        direct_permission = cursor.fetchone()[0] > 0
-        
-        if direct_permission:
-            conn.close()
-            return True
-        
-        # Verificar permissões via grupos
-        cursor.execute('''
-        SELECT COUNT(*) FROM user_groups ug
-        JOIN group_permissions gp ON ug.group_id = gp.group_id
-        JOIN permissions p ON gp.permission_id = p.id
-        WHERE ug.user_id = ? AND p.name = ?
-        ''', (user_id, permission_name))
+    def has_permission(user_id, permission_name, claims=None):
+        """
+        Verifica se o usuário tem a permissão (direta ou via grupo).
+        Se `claims` do access token trouxer o bitset de permissões na versão
+        atual, ele é usado diretamente; senão, usa o cache em memória.
+        """
+        bit = permission_cache.bit(permission_name)
+        if bit is None:
+            return False
         
-        group_permission = cursor.fetchone()[0] > 0
-        conn.close()
+        if claims and claims.get('perms_v') == permission_cache.version():
+            mask = claims.get('perms', 0)
+        else:
+            mask = permission_cache.mask(user_id)
         
-        return group_permission
+        return bool(mask & bit)
     
     @staticmethod
     def is_domain_admin(user_id, domain_id=None):
@@ -153,6 +259,9 @@ class Auth:
         
         return False
 
+# Cache compartilhado pelo processo
+permission_cache = PermissionCache()
+
 # Configurar logger
 import logging
 logger = logging.getLogger(__name__)
\ No newline at end of file
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Benchmark da API do painel.
+
+Sobe o servidor de produção (web_server.py) em uma porta livre, sobre uma
+cópia de um banco pré-populado com --rows emails (10k, 100k, 1M...), e
+dispara requisições concorrentes contra /api/login, /api/emails,
+/api/stats e /api/users. A fase `poll` repete as consultas do dashboard
+com If-None-Match, como um navegador com as respostas em cache.
+
+    python -m bench.api --rows 100k --requests 2000 --concurrency 8
+
+O banco populado fica em cache em bench/.data/ e é recriado quando o schema
+muda. O resultado é gravado em bench/results/ (ou em --output).
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import subprocess
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.common import (ROOT, DATA_DIR, setup_environment, free_port, summarize,
+                          save_results, print_table)
+
+BENCH_USER = 'bench'
+BENCH_PASSWORD = 'bench123'
+DOMAINS = 4
+
+# Incrementar quando a forma dos dados gerados mudar
+SEED_VERSION = 1
+
+def parse_rows(value):
+    """Aceita 10000, 10k, 1M..."""
+    value = value.strip().lower()
+    factor = {'k': 1000, 'm': 1000000}.get(value[-1:], 1)
+    return int(float(value.rstrip('km')) * factor)
+
+def schema_version():
+    from database import MIGRATIONS
+    return MIGRATIONS[-1][0]
+
+def seed_dataset(path, rows):
+    """Popula um banco com `rows` emails usando as funções do próprio painel"""
+    from database import init_db, get_db_connection, insert_email
+    from mail_parser import parse_message
+    from passwords import hash_password
+    
+    init_db()
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    rng = random.Random(rows)
+    
+    password_hash = hash_password(BENCH_PASSWORD)
+    for d in range(DOMAINS):
+        cursor.execute('INSERT INTO domains (domain_name) VALUES (?)', (f'bench{d}.test',))
+    
+    users = max(10, rows // 100)
+    for u in range(users):
+        domain_id = u % DOMAINS + 1
+        username = BENCH_USER if u == 0 else f'user{u}'
+        cursor.execute('''
+        INSERT INTO users (username, email, password_hash, full_name, domain_id, is_domain_admin)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ''', (username, f'{username}@bench{domain_id - 1}.test', password_hash,
+              f'Usuário {u}', domain_id, int(u == 0)))
+    conn.commit()
+    
+    words = ('relatório fatura reunião projeto contrato servidor backup cliente '
+             'pedido entrega suporte senha acesso proposta orçamento').split()
+    for i in range(rows):
+        domain_id = i % DOMAINS + 1
+        user = rng.randrange(users // DOMAINS) * DOMAINS + domain_id - 1
+        recipient = f'{BENCH_USER if user == 0 else f"user{user}"}@bench{domain_id - 1}.test'
+        subject = ' '.join(rng.choice(words) for _ in range(4)).capitalize()
+        text = ' '.join(rng.choice(words) for _ in range(40))
+        if rng.random() < 0.8:
+            body = (f'From: remetente{i % 97}@externo.test\r\nTo: {recipient}\r\n'
+                    f'Subject: {subject}\r\n\r\n{text}\r\n')
+            insert_email(cursor, f'remetente{i % 97}@externo.test', recipient, subject,
+                         body, domain_id, 'received', text, parse_message(body.encode('utf-8')))
+        else:
+            insert_email(cursor, recipient, f'destino{i % 89}@externo.test', subject,
+                         text, domain_id, 'sent', text)
+        if i % 10000 == 9999:
+            conn.commit()
+            print(f'  {i + 1}/{rows} emails', flush=True)
+    conn.commit()
+    
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conn.close()
+
+def dataset_path(rows):
+    return os.path.join(DATA_DIR, f'api-{rows}-s{SEED_VERSION}-m{schema_version()}.db')
+
+def prepare_dataset(rows, workdir):
+    """Copia o banco em cache (criando-o se preciso) para o diretório da execução"""
+    cached = dataset_path(rows)
+    if not os.path.exists(cached):
+        os.makedirs(DATA_DIR, exist_ok=True)
+        print(f'Populando {rows} emails em {cached}...')
+        start = time.perf_counter()
+        # Semear em um processo separado: o pool de conexões aponta para DB_PATH
+        env = dict(os.environ, DB_PATH=cached + '.tmp')
+        subprocess.run([sys.executable, '-m', 'bench.api', '--seed-only', str(rows)],
+                       cwd=ROOT, env=env, check=True)
+        os.replace(cached + '.tmp', cached)
+        print(f'Banco populado em {time.perf_counter() - start:.1f}s')
+    target = os.environ['DB_PATH']
+    shutil.copyfile(cached, target)
+    return target
+
+def start_server(port, workers):
+    env = dict(os.environ, WEB_HOST='127.0.0.1', WEB_PORT=str(port), WEB_WORKERS=str(workers))
+    process = subprocess.Popen([sys.executable, 'web_server.py'], cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 60
+    while True:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/login')
+            conn.getresponse().read()
+            conn.close()
+            return process
+        except OSError:
+            if process.poll() is not None or time.time() > deadline:
+                process.kill()
+                raise RuntimeError('web_server.py não iniciou')
+            time.sleep(0.2)
+
+def request(port, method, path, token=None, body=None, headers=None):
+    """Faz uma requisição; retorna (status, corpo)"""
+    headers = dict(headers or {})
+    if token:
+        headers['Authorization'] = f'Bearer {token}'
+    if body is not None:
+        body = json.dumps(body)
+        headers['Content-Type'] = 'application/json'
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+def etag(port, path, token):
+    """ETag da resposta atual de `path`"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        conn.request('GET', path, headers={'Authorization': f'Bearer {token}'})
+        response = conn.getresponse()
+        response.read()
+        return response.getheader('ETag')
+    finally:
+        conn.close()
+
+def drive(port, requests, concurrency, make_request):
+    """
+    Executa `requests` chamadas de make_request(i) com `concurrency` threads.
+    make_request devolve (método, caminho, token, corpo[, cabeçalhos]); 304
+    conta como sucesso.
+    """
+    def one(i):
+        method, path, token, body, *headers = make_request(i)
+        start = time.perf_counter()
+        try:
+            status, _ = request(port, method, path, token, body, *headers)
+        except OSError:
+            status = None
+        return time.perf_counter() - start, status
+    
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        outcomes = list(executor.map(one, range(requests)))
+    elapsed = time.perf_counter() - start
+    
+    latencies = [latency for latency, status in outcomes if status in (200, 304)]
+    return summarize(latencies, elapsed, errors=len(outcomes) - len(latencies))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark da API do painel')
+    parser.add_argument('--rows', type=parse_rows, default=parse_rows('10k'), help='emails no banco (10k, 100k, 1M...)')
+    parser.add_argument('--requests', type=int, default=1000, help='requisições por rota')
+    parser.add_argument('--login-requests', type=int, default=50, help='requisições de /api/login (bcrypt)')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='workers do web_server.py')
+    parser.add_argument('--routes', default='login,emails,emails_paged,stats,users,poll')
+    parser.add_argument('--no-response-cache', action='store_true',
+                        help='desliga o cache de respostas do servidor (mede as consultas)')
+    parser.add_argument('--bcrypt-rounds', type=int, default=None, help='BCRYPT_ROUNDS (padrão do Config)')
+    parser.add_argument('--output', help='arquivo JSON do resultado')
+    parser.add_argument('--seed-only', type=parse_rows, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.seed_only:
+        if ROOT not in sys.path:
+            sys.path.insert(0, ROOT)
+        seed_dataset(os.environ['DB_PATH'], args.seed_only)
+        return
+    
+    workdir = setup_environment('api', BCRYPT_ROUNDS=args.bcrypt_rounds)
+    prepare_dataset(args.rows, workdir)
+    
+    if args.no_response_cache:
+        os.environ['RESPONSE_CACHE_ITEMS'] = '0'
+    
+    port = free_port()
+    server = start_server(port, args.workers)
+    routes = args.routes.split(',')
+    results = {}
+    try:
+        status, body = request(port, 'POST', '/api/login', body={'username': BENCH_USER, 'password': BENCH_PASSWORD})
+        if status != 200:
+            raise RuntimeError(f'Login do usuário de benchmark falhou: {status} {body[:200]}')
+        token = json.loads(body)['access_token']
+        
+        if 'login' in routes:
+            results['login'] = drive(port, args.login_requests, args.concurrency, lambda i: (
+                'POST', '/api/login', None, {'username': BENCH_USER, 'password': BENCH_PASSWORD}))
+        
+        if 'emails' in routes:
+            results['emails'] = drive(port, args.requests, args.concurrency, lambda i: (
+                'GET', '/api/emails?limit=50', token, None))
+        
+        if 'emails_paged' in routes:
+            # Cursores de páginas cada vez mais fundas, percorridas uma vez antes
+            cursors = []
+            path = '/api/emails?limit=50'
+            for _ in range(50):
+                status, body = request(port, 'GET', path, token)
+                next_cursor = json.loads(body).get('next_cursor') if status == 200 else None
+                if not next_cursor:
+                    break
+                cursors.append(next_cursor)
+                path = f'/api/emails?limit=50&cursor={next_cursor}'
+            if cursors:
+                results['emails_paged'] = drive(port, args.requests, args.concurrency, lambda i: (
+                    'GET', f'/api/emails?limit=50&cursor={cursors[i % len(cursors)]}', token, None))
+        
+        if 'stats' in routes:
+            results['stats'] = drive(port, args.requests, args.concurrency, lambda i: (
+                'GET', '/api/stats', token, None))
+        
+        if 'users' in routes:
+            results['users'] = drive(port, args.requests, args.concurrency, lambda i: (
+                'GET', '/api/users?limit=50', token, None))
+        
+        if 'poll' in routes:
+            # Consultas do dashboard revalidadas com o ETag da última resposta
+            paths = ['/api/domains', '/api/users?limit=50', '/api/stats', '/api/emails?limit=50']
+            etags = [etag(port, path, token) for path in paths]
+            results['poll'] = drive(port, args.requests, args.concurrency, lambda i: (
+                'GET', paths[i % len(paths)], token, None, {'If-None-Match': etags[i % len(paths)]}))
+    finally:
+        server.terminate()
+        server.wait(30)
+    
+    params = vars(args)
+    params.pop('seed_only')
+    print_table(results)
+    print(f'Resultado: {save_results(f"api-{args.rows}", params, results, args.output)}')
+    print(f'Banco descartável: {workdir}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Utilitários compartilhados pelos benchmarks.
+
+Os módulos do painel leem o Config na importação, então setup_environment()
+precisa ser chamado antes de importar qualquer um deles.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'bench', 'results')
+DATA_DIR = os.path.join(ROOT, 'bench', '.data')
+
+def setup_environment(prefix, db_path=None, **overrides):
+    """
+    Cria um diretório descartável e aponta DB_PATH e METRICS_DIR para ele.
+    Retorna o diretório. `overrides` viram variáveis de ambiente (ex.:
+    BCRYPT_ROUNDS=4) e valem apenas para este processo e seus filhos.
+    """
+    workdir = tempfile.mkdtemp(prefix=f'binpanel-{prefix}-')
+    os.environ['DB_PATH'] = db_path or os.path.join(workdir, 'bench.db')
+    os.environ['METRICS_DIR'] = os.path.join(workdir, 'metrics')
+    for key, value in overrides.items():
+        if value is not None:
+            os.environ[key] = str(value)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    return workdir
+
+def disk_usage(*paths):
+    """Bytes ocupados pelos arquivos em `paths` (os inexistentes contam 0)"""
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+def free_port():
+    """Porta TCP livre em 127.0.0.1"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def percentile(values, fraction):
+    """Percentil de uma lista já ordenada (método do vizinho mais próximo)"""
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, int(round(fraction * len(values))) - 1))
+    return values[index]
+
+def summarize(latencies, elapsed, errors=0, unit=1):
+    """
+    Resumo de uma fase: vazão e latências em milissegundos. `unit` é quantos
+    itens cada operação representa (ex.: destinatários por mensagem).
+    """
+    latencies = sorted(latencies)
+    ms = lambda value: round(value * 1000, 3) if value is not None else None
+    count = len(latencies)
+    return {
+        'operations': count,
+        'errors': errors,
+        'elapsed': round(elapsed, 3),
+        'throughput': round(count * unit / elapsed, 2) if elapsed > 0 else 0.0,
+        'p50_ms': ms(percentile(latencies, 0.50)),
+        'p90_ms': ms(percentile(latencies, 0.90)),
+        'p99_ms': ms(percentile(latencies, 0.99)),
+        'max_ms': ms(latencies[-1] if latencies else None),
+    }
+
+def git_revision():
+    """Commit atual (com '+' se a árvore tiver alterações)"""
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                               capture_output=True, text=True, check=True).stdout.strip()
+        return revision + ('+' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def save_results(name, params, results, output=None):
+    """Grava o resultado em JSON (bench/results/ por padrão) e retorna o caminho"""
+    revision = git_revision()
+    document = {
+        'benchmark': name,
+        'revision': revision,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'params': params,
+        'results': results,
+    }
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        output = os.path.join(RESULTS_DIR, f'{name}-{revision.rstrip("+")}-{stamp}.json')
+    with open(output, 'w') as f:
+        json.dump(document, f, indent=2)
+    return output
+
+def print_table(results):
+    """Imprime {fase: resumo} em colunas"""
+    header = f'{"fase":<24}{"ops":>9}{"erros":>7}{"ops/s":>11}{"p50 ms":>10}{"p99 ms":>10}{"max ms":>10}'
+    print(header)
+    print('-' * len(header))
+    for phase, summary in results.items():
+        fmt = lambda value: '-' if value is None else f'{value:.2f}'
+        print(f'{phase:<24}{summary["operations"]:>9}{summary["errors"]:>7}'
+              f'{summary["throughput"]:>11.1f}{fmt(summary["p50_ms"]):>10}'
+              f'{fmt(summary["p99_ms"]):>10}{fmt(summary["max_ms"]):>10}')
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Compara dois resultados de benchmark (ex.: antes e depois de um commit).
+
+    python -m bench.compare bench/results/api-10000-abc123-....json bench/results/api-10000-def456-....json
+"""
+import sys
+import json
+import argparse
+
+METRICS = ('throughput', 'p50_ms', 'p99_ms')
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+def change(before, after):
+    if before in (None, 0) or after is None:
+        return '-'
+    return f'{(after - before) / before * 100:+.1f}%'
+
+def main():
+    parser = argparse.ArgumentParser(description='Compara dois resultados de benchmark')
+    parser.add_argument('before')
+    parser.add_argument('after')
+    args = parser.parse_args()
+    
+    before, after = load(args.before), load(args.after)
+    if before['benchmark'] != after['benchmark']:
+        print(f'Aviso: benchmarks diferentes ({before["benchmark"]} x {after["benchmark"]})', file=sys.stderr)
+    ignored = ('output',)
+    params = lambda document: {k: v for k, v in document['params'].items() if k not in ignored}
+    if params(before) != params(after):
+        print('Aviso: parâmetros diferentes entre as execuções', file=sys.stderr)
+    
+    print(f'{before["revision"]} -> {after["revision"]}')
+    header = f'{"fase":<16}' + ''.join(f'{metric:>30}' for metric in METRICS)
+    print(header)
+    print('-' * len(header))
+    for phase in before['results']:
+        if phase not in after['results']:
+            continue
+        old, new = before['results'][phase], after['results'][phase]
+        cells = ''
+        for metric in METRICS:
+            cell = f'{old.get(metric)} -> {new.get(metric)} ({change(old.get(metric), new.get(metric))})'
+            cells += f'{cell:>30}'
+        print(f'{phase:<16}{cells}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Benchmark de recepção SMTP.
+
+Sobe o EmailHandler (ou os shards de smtp_shards.py com --shards) em uma
+porta livre de 127.0.0.1, com um banco descartável, e dispara mensagens a
+partir de processos clientes, cada um com uma sessão SMTP persistente.
+
+    python -m bench.smtp_ingest --clients 8 --messages 4000 --size 4096 --recipients 2
+
+Mede a latência de cada transação (MAIL FROM até a resposta do DATA, que
+só chega depois do commit) e a vazão em mensagens e destinatários por
+segundo. O resultado é gravado em bench/results/ (ou em --output).
+
+Cada cliente conecta de um IP próprio (127.0.1.N) e envia com um remetente
+próprio, como servidores distintos. Com --flood-clients, processos extras
+inundam o servidor a partir de 127.0.0.2 enquanto os clientes medem, para
+comparar a latência do tráfego normal com e sem os limites de
+smtp_admission.py (desligados com --no-admission).
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.common import (setup_environment, free_port, summarize, disk_usage, save_results,
+                          print_table)
+
+def build_message(index, size):
+    """Mensagem RFC822 com aproximadamente `size` bytes"""
+    headers = (
+        f'From: Bench <bench@sender.test>\r\n'
+        f'Subject: Mensagem de benchmark {index}\r\n'
+        f'Message-ID: <bench-{index}@sender.test>\r\n'
+        f'Content-Type: text/plain; charset=utf-8\r\n'
+        f'\r\n'
+    )
+    line = 'Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod.\r\n'
+    body = line * max(1, (size - len(headers)) // len(line))
+    return (headers + body).encode('utf-8')
+
+def client_address(client):
+    """IP de origem (loopback) do cliente normal `client`"""
+    return (f'127.0.1.{client % 250 + 1}', 0)
+
+def run_client(port, client, messages, size, recipients, addresses):
+    """Processo cliente: envia `messages` mensagens em uma única sessão"""
+    import smtplib
+    
+    latencies = []
+    errors = 0
+    sender = f'bench{client}@sender.test'
+    started = time.time()
+    server = smtplib.SMTP('127.0.0.1', port, source_address=client_address(client))
+    for i in range(messages):
+        offset = (client * messages + i) * recipients
+        rcpts = [addresses[(offset + j) % len(addresses)] for j in range(recipients)]
+        payload = build_message(f'{client}-{i}', size)
+        start = time.perf_counter()
+        try:
+            server.sendmail(sender, rcpts, payload)
+            latencies.append(time.perf_counter() - start)
+        except smtplib.SMTPServerDisconnected:
+            errors += 1
+            server = smtplib.SMTP('127.0.0.1', port, source_address=client_address(client))
+        except smtplib.SMTPException:
+            errors += 1
+    finished = time.time()
+    try:
+        server.quit()
+    except smtplib.SMTPException:
+        server.close()
+    return latencies, errors, started, finished
+
+def run_flooder(port, connections, size, addresses, stop_event, results):
+    """
+    Processo que inunda o servidor a partir de 127.0.0.2: `connections`
+    sessões enviando sem pausa, reconectando a cada recusa, até `stop_event`
+    """
+    import smtplib
+    
+    counts = {'accepted': 0, 'refused': 0, 'disconnected': 0}
+    lock = threading.Lock()
+    payload = build_message('flood', size)
+    
+    def count(key):
+        with lock:
+            counts[key] += 1
+    
+    def flood(index):
+        server = None
+        sent = 0
+        while not stop_event.is_set():
+            try:
+                if server is None:
+                    server = smtplib.SMTP('127.0.0.1', port, source_address=('127.0.0.2', 0))
+                rcpt = addresses[(index + sent) % len(addresses)]
+                server.sendmail('flood@sender.test', [rcpt], payload)
+                sent += 1
+                count('accepted')
+            except smtplib.SMTPConnectError:
+                # 421 no lugar da saudação
+                count('disconnected')
+                server = None
+            except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+                # Recusa na sessão; com 421 o smtplib já fechou a conexão
+                count('refused')
+                if server.sock is None:
+                    server = None
+            except OSError:
+                # Inclui SMTPServerDisconnected (SMTPException é um OSError)
+                count('disconnected')
+                server = None
+        if server is not None:
+            try:
+                server.close()
+            except OSError:
+                pass
+    
+    threads = [threading.Thread(target=flood, args=(i,)) for i in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put(counts)
+
+def seed(domains, users):
+    """Cria domínios e usuários destinatários; retorna os endereços"""
+    from database import init_db, get_db_connection
+    
+    init_db()
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    addresses = []
+    for d in range(domains):
+        cursor.execute('INSERT INTO domains (domain_name) VALUES (?)', (f'bench{d}.test',))
+        domain_id = cursor.lastrowid
+        for u in range(users // domains):
+            address = f'user{u}@bench{d}.test'
+            cursor.execute('''
+            INSERT INTO users (username, email, password_hash, domain_id)
+            VALUES (?, ?, ?, ?)
+            ''', (f'user{u}.bench{d}', address, 'x', domain_id))
+            addresses.append(address)
+    conn.commit()
+    conn.close()
+    return addresses
+
+def start_server(port, shards):
+    """Inicia o servidor SMTP; retorna a função que o encerra"""
+    if shards > 1:
+        from smtp_shards import ShardSupervisor
+        
+        supervisor = ShardSupervisor(shards, host='127.0.0.1', port=port)
+        thread = threading.Thread(target=supervisor.run, daemon=True)
+        thread.start()
+        # Aguardar os shards aceitarem conexões
+        import smtplib
+        deadline = time.time() + 30
+        while True:
+            try:
+                smtplib.SMTP('127.0.0.1', port, timeout=1).quit()
+                break
+            except OSError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.2)
+        
+        def stop():
+            supervisor.stop()
+            thread.join()
+        return stop
+    
+    from email_handler import EmailHandler
+    from smtp_admission import AdmissionController
+    from email_writer import EmailWriter
+    from routing import routing_index
+    
+    routing_index.load()
+    writer = EmailWriter()
+    writer.start()
+    controller = AdmissionController(EmailHandler(writer), hostname='127.0.0.1', port=port)
+    controller.start()
+    
+    def stop():
+        controller.stop()
+        writer.stop()
+    return stop
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de recepção SMTP')
+    parser.add_argument('--clients', type=int, default=8, help='processos clientes simultâneos')
+    parser.add_argument('--messages', type=int, default=2000, help='total de mensagens')
+    parser.add_argument('--size', type=int, default=2048, help='tamanho aproximado de cada mensagem (bytes)')
+    parser.add_argument('--recipients', type=int, default=1, help='destinatários por mensagem')
+    parser.add_argument('--domains', type=int, default=4)
+    parser.add_argument('--users', type=int, default=200, help='usuários destinatários (divididos entre os domínios)')
+    parser.add_argument('--shards', type=int, default=1, help='processos SMTP (SO_REUSEPORT)')
+    parser.add_argument('--db-synchronous', default=None, help='PRAGMA synchronous (padrão do Config)')
+    parser.add_argument('--flood-clients', type=int, default=0, help='processos que inundam o servidor durante a medição')
+    parser.add_argument('--flood-connections', type=int, default=16, help='sessões simultâneas por processo de inundação')
+    parser.add_argument('--no-admission', action='store_true', help='desliga os limites de conexões e de taxa')
+    parser.add_argument('--db-sharding', action='store_true', help='um banco de emails por domínio (DB_SHARDING)')
+    parser.add_argument('--writer-lanes', type=int, default=None, help='threads de gravação com --db-sharding')
+    parser.add_argument('--output', help='arquivo JSON do resultado')
+    args = parser.parse_args()
+    
+    overrides = {}
+    if args.no_admission:
+        overrides = {key: 0 for key in ('SMTP_MAX_CONNECTIONS', 'SMTP_MAX_CONNECTIONS_PER_IP',
+                                        'SMTP_PEER_RATE', 'SMTP_SENDER_RATE')}
+        overrides['SMTP_WRITER_MAX_PENDING'] = 10 ** 9
+    if args.db_sharding:
+        overrides['DB_SHARDING'] = 1
+        overrides['EMAIL_WRITER_LANES'] = args.writer_lanes
+    workdir = setup_environment('smtp', DB_SYNCHRONOUS=args.db_synchronous, **overrides)
+    
+    addresses = seed(args.domains, args.users)
+    port = free_port()
+    stop = start_server(port, args.shards)
+    
+    per_client = max(1, args.messages // args.clients)
+    context = multiprocessing.get_context('spawn')
+    flood_stop = context.Event()
+    flood_results = context.Queue()
+    flooders = [
+        context.Process(target=run_flooder, args=(port, args.flood_connections, args.size, addresses,
+                                                  flood_stop, flood_results))
+        for _ in range(args.flood_clients)
+    ]
+    try:
+        for flooder in flooders:
+            flooder.start()
+        if flooders:
+            # A inundação já em curso quando os clientes começam
+            time.sleep(2)
+        with context.Pool(args.clients) as pool:
+            outcomes = pool.starmap(run_client, [
+                (port, client, per_client, args.size, args.recipients, addresses)
+                for client in range(args.clients)
+            ])
+    finally:
+        flood_stop.set()
+        flood = {'accepted': 0, 'refused': 0, 'disconnected': 0}
+        for flooder in flooders:
+            for key, value in flood_results.get(timeout=60).items():
+                flood[key] += value
+        for flooder in flooders:
+            flooder.join()
+        stop()
+    
+    latencies = [latency for outcome in outcomes for latency in outcome[0]]
+    errors = sum(outcome[1] for outcome in outcomes)
+    elapsed = max(outcome[3] for outcome in outcomes) - min(outcome[2] for outcome in outcomes)
+    
+    from database import get_db_connection
+    from mail_shards import shard_router
+    connections = [get_db_connection()] + [shard_router.connection(domain_id)
+                                           for domain_id in shard_router.domains()]
+    stored = 0
+    for conn in connections:
+        stored += conn.execute('SELECT COUNT(*) FROM emails').fetchone()[0]
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        conn.close()
+    db_path = os.environ['DB_PATH']
+    shard_paths = [shard_router.path(domain_id) for domain_id in shard_router.domains()]
+    stored_bytes = disk_usage(db_path, db_path + '-wal', *shard_paths,
+                              *(path + '-wal' for path in shard_paths))
+    
+    results = {
+        'messages': summarize(latencies, elapsed, errors),
+        'recipients': summarize(latencies, elapsed, errors, unit=args.recipients),
+    }
+    results['messages']['stored_rows'] = stored
+    results['messages']['stored_bytes'] = stored_bytes
+    if flooders:
+        results['messages']['flood'] = flood
+    params = vars(args)
+    params['messages_per_client'] = per_client
+    
+    print_table(results)
+    expected = len(latencies) * args.recipients + (flood['accepted'] if flooders else 0)
+    print(f'Linhas gravadas: {stored} (esperado {expected})')
+    print(f'Bytes em disco: {stored_bytes}')
+    if flooders:
+        print(f'Inundação: {flood["accepted"]} aceitas, {flood["refused"]} recusadas, '
+              f'{flood["disconnected"]} conexões recusadas ou encerradas')
+    print(f'Resultado: {save_results("smtp_ingest", params, results, args.output)}')
+    print(f'Banco descartável: {workdir}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Benchmark de inicialização.
+
+Mede, em processos Python novos, o tempo do início do interpretador até
+cada ponto de partida do painel: init_db() em um banco novo e em um banco
+já preparado, importação do app (cada worker e cada reinício do servidor
+web), um comando do CLI, o SMTP escutando (start_email_server) e o
+runtime unificado com os dois listeners prontos.
+
+    python -m bench.startup --runs 10
+
+Cada fase roda --runs vezes; a latência é o tempo total do processo. A
+fase "interpreter" (python -c pass) é o piso. O resultado é gravado em
+bench/results/ (ou em --output) e pode ser comparado com bench.compare.
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.common import ROOT, setup_environment, free_port, summarize, save_results, print_table
+
+SMTP_READY = '''
+import os, threading
+from email_handler import start_email_server
+ready = threading.Event()
+threading.Thread(target=start_email_server, args=(ready,), daemon=True).start()
+ready.wait(30) or os._exit(1)
+os._exit(0)
+'''
+
+UNIFIED_READY = '''
+import os
+from runtime import UnifiedRuntime
+UnifiedRuntime(host='127.0.0.1', web_port={web_port}, smtp_host='127.0.0.1', smtp_port={smtp_port}).start()
+os._exit(0)
+'''
+
+def phases(workdir):
+    """{fase: função que devolve (comando, variáveis de ambiente extras)}"""
+    counter = iter(range(10 ** 6))
+    fresh_db = lambda: {'DB_PATH': os.path.join(workdir, f'cold-{next(counter)}.db')}
+    return {
+        'interpreter': lambda: ('pass', {}),
+        'init_db_cold': lambda: ('import database; database.init_db()', fresh_db()),
+        'init_db_warm': lambda: ('import database; database.init_db()', {}),
+        'import_app': lambda: ('import app', {}),
+        'cli': lambda: (['cli.py', 'blobs'], {}),
+        'smtp_ready': lambda: (SMTP_READY, {'SMTP_PORT': str(free_port())}),
+        'unified_ready': lambda: (UNIFIED_READY.format(web_port=free_port(), smtp_port=free_port()), {}),
+    }
+
+def run_once(command, extra_env):
+    """Tempo total (s) de um processo Python novo executando `command`"""
+    args = [sys.executable] + (command if isinstance(command, list) else ['-c', command])
+    env = dict(os.environ, PYTHONPATH=ROOT, **extra_env)
+    start = time.perf_counter()
+    completed = subprocess.run(args, cwd=ROOT, env=env, capture_output=True)
+    elapsed = time.perf_counter() - start
+    if completed.returncode != 0:
+        sys.stderr.write(completed.stderr.decode(errors='replace')[-2000:])
+        return None
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de inicialização')
+    parser.add_argument('--runs', type=int, default=10, help='execuções de cada fase')
+    parser.add_argument('--phases', help='fases separadas por vírgula (padrão: todas)')
+    parser.add_argument('--output', help='arquivo JSON do resultado')
+    args = parser.parse_args()
+
+    workdir = setup_environment('startup', SMTP_REFUSAL_DELAY=0)
+    available = phases(workdir)
+    selected = args.phases.split(',') if args.phases else list(available)
+
+    # Banco preparado para as fases "a quente"
+    from database import init_db
+    init_db()
+
+    results = {}
+    for name in selected:
+        latencies = []
+        errors = 0
+        for _ in range(args.runs):
+            elapsed = run_once(*available[name]())
+            if elapsed is None:
+                errors += 1
+            else:
+                latencies.append(elapsed)
+        results[name] = summarize(latencies, sum(latencies), errors)
+
+    print_table(results)
+    print(f'Resultado: {save_results("startup", vars(args), results, args.output)}')
+    print(f'Banco descartável: {workdir}')
+
+if __name__ == '__main__':
+    main()
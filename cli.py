@@ -1,11 +1,18 @@
+import os
+import sqlite3
 import click
-import bcrypt
-from database import get_db_connection
+from config import Config
+from database import init_db, get_db_connection, bump_domain_version
+from mail_shards import shard_router, get_mail_connection, migrate_domain, prune_control_mail
+from routing import bump_routing_version
+from passwords import hash_password
 
 @click.group()
 def cli():
     """Painel de Controle do Servidor - CLI"""
-    pass
+    # Banco no esquema atual antes de qualquer comando, como em run.py: as
+    # escritas incrementam versões na tabela meta (migração 1)
+    init_db()
 
 @cli.command()
 @click.option('--domain', required=True, help='Nome do domínio')
@@ -30,7 +37,7 @@ def create_domain(domain, company, admin_email, admin_password):
         domain_id = cursor.lastrowid
         
         # Criar usuário administrador
-        password_hash = bcrypt.hashpw(admin_password.encode('utf-8'), bcrypt.gensalt())
+        password_hash = hash_password(admin_password)
         
         cursor.execute('''
         INSERT INTO users (username, email, password_hash, full_name, 
@@ -39,6 +46,8 @@ def create_domain(domain, company, admin_email, admin_password):
         ''', (admin_email.split('@')[0], admin_email, password_hash, 
               f'Admin {company}', company_id, domain_id, 1))
         
+        bump_routing_version(cursor)
+        bump_domain_version(cursor, domain_id)
         conn.commit()
         
         click.echo(f'✅ Domínio {domain} criado com sucesso!')
@@ -76,7 +85,7 @@ def create_user(username, email, password, domain, full_name):
         company_id = domain_data['company_id']
         
         # Criar usuário
-        password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+        password_hash = hash_password(password)
         
         cursor.execute('''
         INSERT INTO users (username, email, password_hash, full_name, 
@@ -85,6 +94,8 @@ def create_user(username, email, password, domain, full_name):
         ''', (username, email, password_hash, full_name or username, 
               company_id, domain_id))
         
+        bump_routing_version(cursor)
+        bump_domain_version(cursor, domain_id)
         conn.commit()
         
         click.echo(f'✅ Usuário {username} criado com sucesso no domínio {domain}!')
@@ -133,6 +144,9 @@ def grant_permission(domain, user, permission):
         VALUES (?, ?)
         ''', (user_data['id'], permission_data['id']))
         
+        # auth importa o Flask: só carregado por este comando
+        from auth import bump_permissions_version
+        bump_permissions_version(cursor)
         conn.commit()
         
         click.echo(f'✅ Permissão {permission} concedida a {user} no domínio {domain}!')
@@ -171,5 +185,120 @@ def list_domains():
     
     conn.close()
 
+def mail_databases(domain_id=None):
+    """
+    (rótulo, conexão) de cada banco com emails: o principal e os shards
+    (DB_SHARDING), ou só o shard de `domain_id`. Feche cada conexão.
+    """
+    if domain_id is not None:
+        yield f'domínio {domain_id}', get_mail_connection(domain_id)
+        return
+    yield 'principal', get_db_connection()
+    for shard in shard_router.domains():
+        yield f'domínio {shard}', shard_router.connection(shard)
+
+@cli.command()
+@click.option('--rebuild', is_flag=True, help='Reconstruir o índice a partir da tabela emails')
+@click.option('--optimize', is_flag=True, help='Mesclar os segmentos do índice')
+@click.option('--domain-id', type=int, help='Apenas o banco de emails deste domínio (DB_SHARDING)')
+def search_index(rebuild, optimize, domain_id):
+    """Manutenção do índice de busca dos emails"""
+    
+    if not rebuild and not optimize:
+        click.echo('❌ Informe --rebuild e/ou --optimize')
+        return
+    
+    for label, conn in mail_databases(domain_id):
+        try:
+            if rebuild:
+                conn.execute("INSERT INTO emails_fts (emails_fts) VALUES ('rebuild')")
+                conn.commit()
+                click.echo(f'✅ Índice de busca reconstruído ({label})')
+            
+            if optimize:
+                conn.execute("INSERT INTO emails_fts (emails_fts) VALUES ('optimize')")
+                conn.commit()
+                click.echo(f'✅ Índice de busca otimizado ({label})')
+        
+        except Exception as e:
+            conn.rollback()
+            click.echo(f'❌ Erro ({label}): {str(e)}')
+        finally:
+            conn.close()
+
+@cli.command()
+def blobs():
+    """Espaço ocupado pelos corpos dos emails (deduplicados por conteúdo)"""
+    
+    stored = [0, 0]
+    emails = [0, 0]
+    for _, conn in mail_databases():
+        try:
+            for totals, query in ((stored, 'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs'),
+                                  (emails, '''
+                                  SELECT COUNT(*), COALESCE(SUM(size), 0) FROM emails
+                                  WHERE body_hash IS NOT NULL
+                                  ''')):
+                row = conn.execute(query).fetchone()
+                totals[0] += row[0]
+                totals[1] += row[1]
+        finally:
+            conn.close()
+    
+    click.echo(f"📦 Corpos gravados: {stored[0]} ({stored[1]} bytes)")
+    click.echo(f"   Emails: {emails[0]} ({emails[1]} bytes sem deduplicação)")
+
+@cli.command()
+@click.option('--migrate', is_flag=True, help='Mover para os shards os emails do banco principal')
+@click.option('--backup', 'backup_id', type=int, help='Copiar o banco de emails deste domínio')
+@click.option('--to', 'target', type=click.Path(), help='Arquivo de destino do --backup')
+def mail_shards(migrate, backup_id, target):
+    """Bancos de emails por domínio (DB_SHARDING)"""
+    
+    if not Config.DB_SHARDING:
+        click.echo('❌ DB_SHARDING não está ativo')
+        return
+    
+    conn = get_db_connection()
+    domains = {row['id']: row['domain_name'] for row in conn.execute('SELECT id, domain_name FROM domains')}
+    conn.close()
+    
+    if backup_id is not None:
+        if not target:
+            click.echo('❌ Informe o arquivo de destino em --to')
+            return
+        # API de backup do SQLite: cópia consistente sem parar a gravação
+        source = shard_router.connection(backup_id)
+        destination = sqlite3.connect(target)
+        try:
+            source.backup(destination)
+        finally:
+            destination.close()
+            source.close()
+        click.echo(f'✅ Emails de {domains.get(backup_id, backup_id)} copiados para {target}')
+        return
+    
+    if migrate:
+        total = 0
+        for domain_id, domain_name in domains.items():
+            copied = migrate_domain(domain_id)
+            total += copied
+            if copied:
+                click.echo(f'   {domain_name}: {copied} emails')
+        prune_control_mail()
+        click.echo(f'✅ {total} emails movidos para os shards')
+        return
+    
+    click.echo(f"🗄️  Shards em {shard_router.directory}:")
+    click.echo("-" * 60)
+    for domain_id in shard_router.domains():
+        path = shard_router.path(domain_id)
+        size = sum(os.path.getsize(p) for p in (path, path + '-wal') if os.path.exists(p))
+        shard = shard_router.connection(domain_id)
+        count = shard.execute('SELECT COUNT(*) FROM emails').fetchone()[0]
+        shard.close()
+        click.echo(f"🌐 {domains.get(domain_id, f'(domínio {domain_id} removido)')}: "
+                   f"{count} emails, {size} bytes")
+
 if __name__ == '__main__':
     cli()
\ No newline at end of file
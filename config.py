@@ -11,5 +11,140 @@ class Config:
     MAIL_SERVER = 'localhost'
     MAIL_PORT = 2525
     MAIL_USE_TLS = False
-    SMTP_PORT = 25
-    POSTMAIL_PORT = 2525
\ No newline at end of file
+    SMTP_PORT = int(os.environ.get('SMTP_PORT', 25))
+    POSTMAIL_PORT = 2525
+
+    # Banco de dados (SQLite)
+    DB_PATH = os.environ.get('DB_PATH') or 'server_panel.db'
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 16))
+    DB_JOURNAL_MODE = 'WAL'
+    # FULL mantém o commit durável mesmo em queda de energia; o group commit
+    # dos emails recebidos amortiza o custo do fsync
+    DB_SYNCHRONOUS = os.environ.get('DB_SYNCHRONOUS') or 'FULL'
+    DB_CACHE_SIZE = int(os.environ.get('DB_CACHE_SIZE', -16000))  # negativo = KiB
+    DB_MMAP_SIZE = int(os.environ.get('DB_MMAP_SIZE', 256 * 1024 * 1024))
+    DB_BUSY_TIMEOUT = int(os.environ.get('DB_BUSY_TIMEOUT', 5000))  # ms
+    DB_STATEMENT_CACHE = 256
+    
+    # Um banco de emails por domínio (mail_shards.py): a gravação de domínios
+    # diferentes não disputa o mesmo lock de escrita. Bancos existentes
+    # precisam de `cli.py mail-shards --migrate` ao ativar
+    DB_SHARDING = os.environ.get('DB_SHARDING', '').lower() in ('1', 'true', 'yes')
+    DB_SHARD_DIR = os.environ.get('DB_SHARD_DIR') or os.path.join(
+        os.path.dirname(os.path.abspath(DB_PATH)), 'shards')
+    DB_SHARD_MAX_OPEN = int(os.environ.get('DB_SHARD_MAX_OPEN', 64))  # pools de shards abertos (LRU)
+    DB_SHARD_POOL_SIZE = 4  # conexões ociosas por shard
+
+    # Gravação em lote (group commit) dos emails recebidos
+    EMAIL_WRITER_BATCH_SIZE = 256
+    EMAIL_WRITER_FLUSH_MS = 5
+    # Threads de gravação com DB_SHARDING; cada domínio fica sempre na mesma
+    EMAIL_WRITER_LANES = int(os.environ.get('EMAIL_WRITER_LANES', 4))
+
+    # Intervalo (s) entre verificações da versão do índice de roteamento
+    ROUTING_REFRESH_INTERVAL = 1.0
+
+    # Intervalo (s) entre verificações da versão das permissões em cache
+    PERMISSIONS_REFRESH_INTERVAL = 1.0
+
+    # Sessões SMTP persistentes usadas no envio em massa
+    BULK_SMTP_CONNECTIONS = 4
+    
+    # Fila persistente de envio (delivery.py)
+    DELIVERY_WORKERS = 4
+    DELIVERY_POLL_INTERVAL = 1.0  # s, atraso máximo para ver envios enfileirados por outro processo
+    DELIVERY_MAX_ATTEMPTS = 8
+    DELIVERY_RETRY_BASE = 60  # s, dobra a cada tentativa
+    DELIVERY_RETRY_MAX = 6 * 3600  # s
+    
+    # Tamanho máximo de página das listagens da API (?limit=)
+    API_MAX_PAGE_SIZE = 500
+    API_STREAM_CHUNK = 16 * 1024  # bytes por escrita nas respostas transmitidas
+    API_BUFFERED_PAGE = 256 * 1024  # páginas menores saem com Content-Length
+    
+    # Busca textual: limite de texto indexado por email (caracteres)
+    FTS_MAX_TEXT = 256 * 1024
+    
+    # Trecho do texto guardado com cada email (caracteres)
+    SNIPPET_LENGTH = 200
+    
+    # Mensagens com a árvore MIME analisada mantidas em memória (partes)
+    MIME_CACHE_ITEMS = 64
+    MIME_CACHE_BYTES = 32 * 1024 * 1024
+    
+    # Respostas da API com ETag (http_cache.py): intervalo (s) entre leituras
+    # dos contadores de versão e limites do cache de respostas por processo
+    RESPONSE_VERSION_INTERVAL = 1.0
+    RESPONSE_CACHE_ITEMS = int(os.environ.get('RESPONSE_CACHE_ITEMS', 1024))  # 0 = sem cache
+    RESPONSE_CACHE_BYTES = 32 * 1024 * 1024
+    
+    # Eventos em tempo real (/api/events, events.py)
+    EVENTS_POLL_INTERVAL = 0.02  # s, leitura dos eventos gravados por outros processos
+    EVENTS_BUFFER_SIZE = 256  # eventos pendentes por assinante
+    EVENTS_MAX_SUBSCRIBERS = int(os.environ.get('EVENTS_MAX_SUBSCRIBERS', 64))  # por processo
+    EVENTS_HEARTBEAT = 15.0  # s
+    EVENTS_RETRY_MS = 2000  # espera do navegador antes de reconectar
+    EVENTS_RETENTION = 10000  # eventos mantidos para reconexões (Last-Event-ID)
+    EVENTS_PRUNE_INTERVAL = 60.0  # s
+    EVENTS_TOKEN_EXPIRES = timedelta(seconds=60)  # token de /api/events, só para abrir o stream
+    
+    # Dias da série histórica devolvida por /api/stats
+    STATS_SERIES_DAYS = 30
+    
+    # Servidor web de produção (web_server.py)
+    WEB_HOST = os.environ.get('WEB_HOST', '0.0.0.0')
+    WEB_PORT = int(os.environ.get('WEB_PORT', 8080))
+    WEB_WORKERS = int(os.environ.get('WEB_WORKERS', 2 * (os.cpu_count() or 1)))
+    WEB_MAX_REQUESTS = 1000  # requisições por worker antes de reciclar
+    WEB_MAX_REQUESTS_JITTER = 100
+    WEB_GRACEFUL_TIMEOUT = 30  # s
+    WEB_BACKLOG = 128
+    
+    # split: SMTP em uma thread de run.py e o painel nos workers prefork de
+    # web_server.py. unified: tudo em um único processo (runtime.py), com
+    # caches, pool de conexões e métricas compartilhados
+    RUNTIME = os.environ.get('RUNTIME', 'split')
+    
+    # Senhas (bcrypt em pool de processos, passwords.py). Os limites valem
+    # por processo do painel: cada worker de web_server.py tem o seu pool,
+    # então os padrões dividem os núcleos entre os WEB_WORKERS workers
+    BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+    _PANEL_PROCESSES = 1 if RUNTIME == 'unified' else WEB_WORKERS
+    PASSWORD_WORKERS = int(os.environ.get('PASSWORD_WORKERS',
+                                          max(1, (os.cpu_count() or 1) // _PANEL_PROCESSES)))
+    PASSWORD_QUEUE_LIMIT = int(os.environ.get('PASSWORD_QUEUE_LIMIT', 4 * PASSWORD_WORKERS))
+    PASSWORD_TIMEOUT = 10  # s
+    
+    # Recepção SMTP (smtp_spool.py): mensagens acima do limite recebem 552;
+    # acima de SMTP_SPOOL_THRESHOLD o DATA vai para um arquivo temporário.
+    # Só os primeiros SMTP_PARSE_BYTES são analisados (cabeçalhos e texto)
+    SMTP_MAX_MESSAGE_SIZE = int(os.environ.get('SMTP_MAX_MESSAGE_SIZE', 25 * 1024 * 1024))
+    SMTP_SPOOL_THRESHOLD = 1024 * 1024
+    SMTP_SPOOL_DIR = os.environ.get('SMTP_SPOOL_DIR')  # None = diretório temporário do sistema
+    SMTP_PARSE_BYTES = 1024 * 1024
+    
+    # Controle de admissão da recepção SMTP (smtp_admission.py), por
+    # processo: conexões simultâneas, mensagens por segundo (token bucket)
+    # por IP e por remetente, e 421 com a fila do EmailWriter acima de
+    # SMTP_WRITER_MAX_PENDING gravações. 0 desliga cada limite
+    SMTP_MAX_CONNECTIONS = int(os.environ.get('SMTP_MAX_CONNECTIONS', 500))
+    SMTP_MAX_CONNECTIONS_PER_IP = int(os.environ.get('SMTP_MAX_CONNECTIONS_PER_IP', 20))
+    SMTP_PEER_RATE = float(os.environ.get('SMTP_PEER_RATE', 100))
+    SMTP_PEER_BURST = int(os.environ.get('SMTP_PEER_BURST', 500))
+    SMTP_SENDER_RATE = float(os.environ.get('SMTP_SENDER_RATE', 50))
+    SMTP_SENDER_BURST = int(os.environ.get('SMTP_SENDER_BURST', 250))
+    SMTP_WRITER_MAX_PENDING = int(os.environ.get('SMTP_WRITER_MAX_PENDING', 1000))
+    SMTP_ADMISSION_MAX_KEYS = 10000  # IPs e remetentes com balde em memória (LRU)
+    SMTP_REFUSAL_DELAY = float(os.environ.get('SMTP_REFUSAL_DELAY', 1.0))  # s, atraso de cada recusa (tarpit)
+    
+    # Recepção SMTP em vários processos (SO_REUSEPORT); 1 = um único processo
+    SMTP_SHARDS = int(os.environ.get('SMTP_SHARDS', 1))
+    SMTP_RESTART_DELAY = 1.0  # s, espera antes de reiniciar um shard
+    SMTP_GRACEFUL_TIMEOUT = 10  # s
+    SMTP_STARTUP_TIMEOUT = 30  # s, espera máxima de run.py pelo SMTP antes do painel
+    
+    # Métricas (metrics.py): snapshots por processo somados em /metrics,
+    # por padrão ao lado do banco (e não no diretório corrente)
+    METRICS_DIR = os.environ.get('METRICS_DIR') or os.path.join(
+        os.path.dirname(os.path.abspath(DB_PATH)), 'metrics')
+    METRICS_DUMP_INTERVAL = 5.0  # s
@@ -1,149 +1,942 @@
+import os
+import re
+import hashlib
 import sqlite3
-import bcrypt
-from datetime import datetime
+import threading
+import time
+import logging
+from config import Config
+from mail_parser import message_text, parse_message, snippet, HEADER_COLUMNS
+from metrics import DB_QUERY_SECONDS
 
-def init_db():
-    conn = sqlite3.connect('server_panel.db')
+logger = logging.getLogger(__name__)
+
+def sent_headers(sender, recipient, body, body_text=None):
+    """Colunas de cabeçalho de um email criado pelo painel (texto simples)"""
+    return {
+        'from_header': sender,
+        'to_header': recipient,
+        'size': len((body or '').encode('utf-8')),
+        'snippet': snippet(body_text if body_text is not None else body),
+    }
+
+def _backfill_email_headers(cursor):
+    """Preenche as colunas da migração 7 nos emails já gravados"""
+    conn = cursor.connection
+    assignments = ', '.join(f'{column} = ?' for column in HEADER_COLUMNS)
+    last_id = 0
+    while True:
+        rows = conn.execute('''
+        SELECT id, sender, recipient, body, status FROM emails
+        WHERE id > ? ORDER BY id LIMIT 500
+        ''', (last_id,)).fetchall()
+        if not rows:
+            return
+        for email_id, sender, recipient, body, status in rows:
+            if status == 'received':
+                headers = parse_message((body or '').encode('utf-8', errors='surrogateescape'))
+            else:
+                headers = sent_headers(sender, recipient, body)
+            cursor.execute(f'UPDATE emails SET {assignments} WHERE id = ?',
+                           [headers.get(column) for column in HEADER_COLUMNS] + [email_id])
+        last_id = rows[-1][0]
+
+def _move_bodies_to_blobs(cursor):
+    """Migração 9: move os corpos de emails.body para a tabela blobs"""
+    conn = cursor.connection
+    last_id = 0
+    while True:
+        rows = conn.execute('''
+        SELECT id, body FROM emails
+        WHERE id > ? AND body IS NOT NULL ORDER BY id LIMIT 500
+        ''', (last_id,)).fetchall()
+        if not rows:
+            return
+        for email_id, body in rows:
+            data = body if isinstance(body, bytes) else body.encode('utf-8', errors='surrogateescape')
+            cursor.execute('UPDATE emails SET body = NULL, body_hash = ? WHERE id = ?',
+                           (store_blob(cursor, data), email_id))
+        last_id = rows[-1][0]
+
+# Migrações do esquema, aplicadas em ordem por run_migrations(). A versão
+# aplicada fica gravada no próprio banco (PRAGMA user_version). Cada passo é
+# uma lista de comandos SQL ou funções que recebem o cursor.
+MIGRATIONS = [
+    (1, 'Esquema inicial', [
+        # Tabela de empresas
+        '''
+        CREATE TABLE IF NOT EXISTS companies (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            contact_email TEXT NOT NULL UNIQUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            status TEXT DEFAULT 'active'
+        )
+        ''',
+
+        # Tabela de domínios
+        '''
+        CREATE TABLE IF NOT EXISTS domains (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            domain_name TEXT NOT NULL UNIQUE,
+            company_id INTEGER,
+            ssl_enabled BOOLEAN DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (company_id) REFERENCES companies (id)
+        )
+        ''',
+
+        # Tabela de usuários
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL UNIQUE,
+            email TEXT NOT NULL UNIQUE,
+            password_hash TEXT NOT NULL,
+            full_name TEXT,
+            company_id INTEGER,
+            domain_id INTEGER,
+            is_domain_admin BOOLEAN DEFAULT 0,
+            is_super_admin BOOLEAN DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_login TIMESTAMP,
+            status TEXT DEFAULT 'active',
+            FOREIGN KEY (company_id) REFERENCES companies (id),
+            FOREIGN KEY (domain_id) REFERENCES domains (id)
+        )
+        ''',
+
+        # Tabela de grupos
+        '''
+        CREATE TABLE IF NOT EXISTS groups (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            company_id INTEGER,
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (company_id) REFERENCES companies (id)
+        )
+        ''',
+
+        # Tabela de permissões
+        '''
+        CREATE TABLE IF NOT EXISTS permissions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            description TEXT
+        )
+        ''',
+
+        # Tabela de associação usuário-grupo
+        '''
+        CREATE TABLE IF NOT EXISTS user_groups (
+            user_id INTEGER,
+            group_id INTEGER,
+            PRIMARY KEY (user_id, group_id),
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (group_id) REFERENCES groups (id)
+        )
+        ''',
+
+        # Tabela de associação grupo-permissão
+        '''
+        CREATE TABLE IF NOT EXISTS group_permissions (
+            group_id INTEGER,
+            permission_id INTEGER,
+            PRIMARY KEY (group_id, permission_id),
+            FOREIGN KEY (group_id) REFERENCES groups (id),
+            FOREIGN KEY (permission_id) REFERENCES permissions (id)
+        )
+        ''',
+
+        # Tabela de associação usuário-permissão direta
+        '''
+        CREATE TABLE IF NOT EXISTS user_permissions (
+            user_id INTEGER,
+            permission_id INTEGER,
+            PRIMARY KEY (user_id, permission_id),
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (permission_id) REFERENCES permissions (id)
+        )
+        ''',
+
+        # Tabela de emails
+        '''
+        CREATE TABLE IF NOT EXISTS emails (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sender TEXT NOT NULL,
+            recipient TEXT NOT NULL,
+            subject TEXT,
+            body TEXT,
+            domain_id INTEGER,
+            received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            status TEXT DEFAULT 'received',
+            FOREIGN KEY (domain_id) REFERENCES domains (id)
+        )
+        ''',
+
+        # Contadores de versão usados para invalidar caches em memória
+        '''
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+    ]),
+    (2, 'Índice de emails por domínio e data', [
+        # /api/emails, /api/emails/<id> e /api/stats filtram por domínio e
+        # ordenam/filtram por received_at
+        '''
+        CREATE INDEX IF NOT EXISTS idx_emails_domain_received
+        ON emails (domain_id, received_at)
+        ''',
+    ]),
+    (3, 'Índices de usuários e domínios', [
+        # /api/users, /api/stats (usuários ativos) e cli list_domains
+        '''
+        CREATE INDEX IF NOT EXISTS idx_users_domain_status
+        ON users (domain_id, status)
+        ''',
+
+        # /api/users (filtro por empresa)
+        '''
+        CREATE INDEX IF NOT EXISTS idx_users_company
+        ON users (company_id)
+        ''',
+
+        # /api/stats (últimos logins) sem consultar a tabela
+        '''
+        CREATE INDEX IF NOT EXISTS idx_users_domain_last_login
+        ON users (domain_id, last_login, username)
+        ''',
+
+        # /api/domains (filtro por empresa)
+        '''
+        CREATE INDEX IF NOT EXISTS idx_domains_company
+        ON domains (company_id)
+        ''',
+    ]),
+    (4, 'Fila persistente de envio', [
+        # Mensagens aguardando entrega ao relay. state: queued, sending,
+        # sent, deferred ou bounced; next_attempt_at em segundos desde epoch
+        '''
+        CREATE TABLE IF NOT EXISTS outbound_queue (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email_id INTEGER,
+            domain_id INTEGER,
+            from_email TEXT NOT NULL,
+            to_email TEXT NOT NULL,
+            subject TEXT,
+            body TEXT,
+            html_body TEXT,
+            state TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP,
+            FOREIGN KEY (email_id) REFERENCES emails (id),
+            FOREIGN KEY (domain_id) REFERENCES domains (id)
+        )
+        ''',
+
+        # Busca das mensagens vencidas pelos workers
+        '''
+        CREATE INDEX IF NOT EXISTS idx_outbound_queue_due
+        ON outbound_queue (state, next_attempt_at)
+        ''',
+    ]),
+    (5, 'Busca textual (FTS5) dos emails', [
+        # Fonte do índice externo: o texto do corpo vem de mail_text(),
+        # registrada em cada conexão do pool. domain_tag ('d<domain_id>')
+        # restringe a busca ao domínio dentro do próprio MATCH
+        '''
+        CREATE VIEW IF NOT EXISTS emails_fts_source AS
+        SELECT id, 'd' || domain_id AS domain_tag, subject, sender, recipient,
+               mail_text(body, status) AS body_text
+        FROM emails
+        ''',
+
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS emails_fts USING fts5(
+            domain_tag, subject, sender, recipient, body_text,
+            content='emails_fts_source',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        ''',
+
+        # Indexar os emails já existentes
+        "INSERT INTO emails_fts (emails_fts) VALUES ('rebuild')",
+    ]),
+    (6, 'Resumo diário por domínio', [
+        # Contadores mantidos incrementalmente na gravação de emails e nos
+        # logins; day é a data UTC (a mesma de received_at)
+        '''
+        CREATE TABLE IF NOT EXISTS domain_daily_stats (
+            domain_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            received_count INTEGER NOT NULL DEFAULT 0,
+            received_bytes INTEGER NOT NULL DEFAULT 0,
+            sent_count INTEGER NOT NULL DEFAULT 0,
+            sent_bytes INTEGER NOT NULL DEFAULT 0,
+            active_users INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (domain_id, day),
+            FOREIGN KEY (domain_id) REFERENCES domains (id)
+        ) WITHOUT ROWID
+        ''',
+
+        # Preencher com o histórico já gravado
+        '''
+        INSERT INTO domain_daily_stats (domain_id, day, received_count, received_bytes,
+                                        sent_count, sent_bytes)
+        SELECT domain_id, DATE(received_at),
+               SUM(status = 'received'),
+               SUM(CASE WHEN status = 'received' THEN LENGTH(body) ELSE 0 END),
+               SUM(status = 'sent'),
+               SUM(CASE WHEN status = 'sent' THEN LENGTH(body) ELSE 0 END)
+        FROM emails
+        WHERE domain_id IS NOT NULL
+        GROUP BY domain_id, DATE(received_at)
+        ''',
+
+        '''
+        INSERT INTO domain_daily_stats (domain_id, day, active_users)
+        SELECT domain_id, DATE(last_login), COUNT(*)
+        FROM users
+        WHERE domain_id IS NOT NULL AND last_login IS NOT NULL
+        GROUP BY domain_id, DATE(last_login)
+        ON CONFLICT (domain_id, day) DO UPDATE SET active_users = excluded.active_users
+        ''',
+    ]),
+    (7, 'Cabeçalhos e trecho do texto dos emails', [
+        # Extraídos uma vez na recepção; as leituras não precisam mais
+        # analisar a fonte RFC822 guardada em body
+        'ALTER TABLE emails ADD COLUMN message_id TEXT',
+        'ALTER TABLE emails ADD COLUMN date_header TIMESTAMP',
+        'ALTER TABLE emails ADD COLUMN from_header TEXT',
+        'ALTER TABLE emails ADD COLUMN to_header TEXT',
+        'ALTER TABLE emails ADD COLUMN cc_header TEXT',
+        'ALTER TABLE emails ADD COLUMN size INTEGER',
+        'ALTER TABLE emails ADD COLUMN snippet TEXT',
+        'CREATE INDEX IF NOT EXISTS idx_emails_message_id ON emails (message_id)',
+        _backfill_email_headers,
+    ]),
+    (8, 'Índice de cobertura da listagem de emails', [
+        # /api/emails lê a página inteira do índice, sem passar pelas
+        # páginas de overflow de body (size e snippet ficam depois dele na
+        # linha). Substitui idx_emails_domain_received, que é seu prefixo.
+        '''
+        CREATE INDEX IF NOT EXISTS idx_emails_list
+        ON emails (domain_id, received_at, id, sender, recipient, subject, status, size, snippet)
+        ''',
+        'DROP INDEX IF EXISTS idx_emails_domain_received',
+    ]),
+    (9, 'Corpos dos emails endereçados por conteúdo', [
+        # Cada corpo é gravado uma vez em blobs, identificado pelo SHA-256;
+        # emails.body_hash o referencia e body fica NULL. Uma mensagem para
+        # 50 destinatários ocupa um blob, não 50 cópias. O espaço liberado
+        # em emails só volta ao disco com VACUUM.
+        'ALTER TABLE emails ADD COLUMN body_hash TEXT',
+        '''
+        CREATE TABLE IF NOT EXISTS blobs (
+            id INTEGER PRIMARY KEY,
+            hash TEXT NOT NULL UNIQUE,
+            size INTEGER NOT NULL,
+            data BLOB NOT NULL
+        )
+        ''',
+        _move_bodies_to_blobs,
+        # A fonte da busca passa a ler o corpo do blob
+        'DROP VIEW IF EXISTS emails_fts_source',
+        '''
+        CREATE VIEW emails_fts_source AS
+        SELECT e.id, 'd' || e.domain_id AS domain_tag, e.subject, e.sender, e.recipient,
+               mail_text(COALESCE(e.body, b.data), e.status) AS body_text
+        FROM emails e
+        LEFT JOIN blobs b ON b.hash = e.body_hash
+        ''',
+    ]),
+    (10, 'Eventos de email para /api/events', [
+        # Transporte entre o processo SMTP e os workers do painel (ver
+        # events.py). Os ids servem de Last-Event-ID e não podem ser
+        # reaproveitados: prune_events sempre mantém o evento mais recente,
+        # então o rowid só cresce, sem o custo do AUTOINCREMENT. Sem índice
+        # por domínio: a retomada lê só a janela de EVENTS_RETENTION eventos
+        '''
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY,
+            domain_id INTEGER NOT NULL,
+            data TEXT NOT NULL
+        )
+        ''',
+    ]),
+]
+
+# Esquema dos bancos de emails por domínio (mail_shards.py), com versão
+# própria. Cada shard guarda emails, corpos e busca de um único domínio, nas
+# mesmas tabelas e colunas do banco principal: as consultas não mudam
+MAIL_MIGRATIONS = [
+    (1, 'Emails do domínio', [
+        # Colunas na ordem do banco principal (migrações 1, 7 e 9), para a
+        # cópia com INSERT ... SELECT * de cli.py mail_shards --migrate
+        '''
+        CREATE TABLE IF NOT EXISTS emails (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sender TEXT NOT NULL,
+            recipient TEXT NOT NULL,
+            subject TEXT,
+            body TEXT,
+            domain_id INTEGER,
+            received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            status TEXT DEFAULT 'received',
+            message_id TEXT,
+            date_header TIMESTAMP,
+            from_header TEXT,
+            to_header TEXT,
+            cc_header TEXT,
+            size INTEGER,
+            snippet TEXT,
+            body_hash TEXT
+        )
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_emails_list
+        ON emails (domain_id, received_at, id, sender, recipient, subject, status, size, snippet)
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_emails_message_id ON emails (message_id)',
+        '''
+        CREATE TABLE IF NOT EXISTS blobs (
+            id INTEGER PRIMARY KEY,
+            hash TEXT NOT NULL UNIQUE,
+            size INTEGER NOT NULL,
+            data BLOB NOT NULL
+        )
+        ''',
+        '''
+        CREATE VIEW IF NOT EXISTS emails_fts_source AS
+        SELECT e.id, 'd' || e.domain_id AS domain_tag, e.subject, e.sender, e.recipient,
+               mail_text(COALESCE(e.body, b.data), e.status) AS body_text
+        FROM emails e
+        LEFT JOIN blobs b ON b.hash = e.body_hash
+        ''',
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS emails_fts USING fts5(
+            domain_tag, subject, sender, recipient, body_text,
+            content='emails_fts_source',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        ''',
+    ]),
+]
+
+def run_migrations(conn, migrations=None):
+    """
+    Aplica as migrações pendentes, cada uma em uma transação. `migrations`
+    é MIGRATIONS (banco principal, o padrão) ou MAIL_MIGRATIONS (shards).
+    """
     cursor = conn.cursor()
     
-    # Tabela de empresas
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS companies (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        contact_email TEXT NOT NULL UNIQUE,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        status TEXT DEFAULT 'active'
-    )
-    ''')
-    
-    # Tabela de domínios
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS domains (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        domain_name TEXT NOT NULL UNIQUE,
-        company_id INTEGER,
-        ssl_enabled BOOLEAN DEFAULT 0,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (company_id) REFERENCES companies (id)
-    )
-    ''')
-    
-    # Tabela de usuários
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT NOT NULL UNIQUE,
-        email TEXT NOT NULL UNIQUE,
-        password_hash TEXT NOT NULL,
-        full_name TEXT,
-        company_id INTEGER,
-        domain_id INTEGER,
-        is_domain_admin BOOLEAN DEFAULT 0,
-        is_super_admin BOOLEAN DEFAULT 0,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        last_login TIMESTAMP,
-        status TEXT DEFAULT 'active',
-        FOREIGN KEY (company_id) REFERENCES companies (id),
-        FOREIGN KEY (domain_id) REFERENCES domains (id)
-    )
-    ''')
-    
-    # Tabela de grupos
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS groups (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        company_id INTEGER,
-        description TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (company_id) REFERENCES companies (id)
-    )
-    ''')
-    
-    # Tabela de permissões
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS permissions (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL UNIQUE,
-        description TEXT
-    )
-    ''')
-    
-    # Tabela de associação usuário-grupo
+    # Banco já atualizado (partida a quente): uma leitura, sem lock de escrita
+    cursor.execute('PRAGMA user_version')
+    current = cursor.fetchone()[0]
+    
+    for version, description, steps in migrations or MIGRATIONS:
+        if current >= version:
+            continue
+        
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            # Outro processo pode ter aplicado a migração enquanto esperávamos
+            cursor.execute('PRAGMA user_version')
+            current = cursor.fetchone()[0]
+            if current >= version:
+                conn.rollback()
+                continue
+            
+            for step in steps:
+                if callable(step):
+                    step(cursor)
+                else:
+                    cursor.execute(step)
+            
+            cursor.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+            current = version
+        except Exception:
+            conn.rollback()
+            raise
+        
+        logger.info(f"Migração {version} aplicada: {description}")
+
+# Versão dos dados iniciais (permissões padrão e super admin); incremente
+# ao mudar DEFAULT_PERMISSIONS para que init_db() os grave de novo
+SEED_VERSION = 1
+SEED_VERSION_KEY = 'seed'
+
+DEFAULT_PERMISSIONS = [
+    ('manage_domain', 'Gerenciar configurações do domínio'),
+    ('manage_users', 'Gerenciar usuários do domínio'),
+    ('manage_groups', 'Gerenciar grupos do domínio'),
+    ('view_emails', 'Visualizar emails do domínio'),
+    ('send_emails', 'Enviar emails pelo domínio'),
+    ('manage_permissions', 'Gerenciar permissões'),
+]
+
+# Hash bcrypt (custo 12) da senha padrão "admin123": o banco novo não paga
+# o bcrypt na inicialização. O login regrava o hash se BCRYPT_ROUNDS for maior.
+DEFAULT_ADMIN_PASSWORD_HASH = b'$2b$12$j2kSKb2/Dv40xxlaoU7lUeoz5gdKr0Y9ycmnuyAjhJGm93XviMjk2'
+
+def init_db():
+    """
+    Aplica as migrações e grava os dados iniciais. Com o esquema e os dados
+    na versão atual (o caso comum: workers, CLI, reinícios), custa duas
+    leituras e nenhuma escrita.
+    """
+    conn = get_db_connection()
+    try:
+        run_migrations(conn)
+        
+        cursor = conn.cursor()
+        if get_version(cursor, SEED_VERSION_KEY) >= SEED_VERSION:
+            return
+        
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.executemany('INSERT OR IGNORE INTO permissions (name, description) VALUES (?, ?)', DEFAULT_PERMISSIONS)
+        
+        # Criar usuário super admin se não existir
+        cursor.execute("SELECT 1 FROM users WHERE is_super_admin = 1")
+        if not cursor.fetchone():
+            cursor.execute('''
+            INSERT INTO users (username, email, password_hash, full_name, is_super_admin)
+            VALUES (?, ?, ?, ?, ?)
+            ''', ('superadmin', 'admin@system.local', DEFAULT_ADMIN_PASSWORD_HASH, 'Super Administrador', 1))
+        
+        cursor.execute('''
+        INSERT INTO meta (key, value) VALUES (?, ?)
+        ON CONFLICT (key) DO UPDATE SET value = excluded.value
+        ''', (SEED_VERSION_KEY, SEED_VERSION))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+_VERB = re.compile(r'\s*(\w+)')
+_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE)\s+(\w+)', re.IGNORECASE)
+_statement_labels = {}
+
+def statement_label(sql):
+    """Rótulo curto da consulta para as métricas, ex.: 'SELECT emails'"""
+    label = _statement_labels.get(sql)
+    if label is None:
+        verb = _VERB.match(sql)
+        table = _TABLE.search(sql)
+        label = verb.group(1).upper() if verb else 'OTHER'
+        if table:
+            label = f'{label} {table.group(1).lower()}'
+        # As consultas são fixas no código; o limite só protege contra SQL dinâmico
+        if len(_statement_labels) < 1024:
+            _statement_labels[sql] = label
+    return label
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor que mede o execute() de cada consulta (db_query_seconds)"""
+    
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - start, statement_label(sql))
+    
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - start, statement_label(sql))
+
+class PooledConnection:
+    """
+    Conexão emprestada do pool. Se comporta como sqlite3.Connection, mas
+    close() devolve a conexão ao pool em vez de fechá-la. Os cursores são
+    TimedCursor, para que toda consulta entre nas métricas.
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+    
+    def cursor(self, factory=TimedCursor):
+        if self._conn is None:
+            raise sqlite3.ProgrammingError('Cannot operate on a closed database.')
+        return self._conn.cursor(factory)
+    
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def close(self):
+        if self._conn is not None:
+            self._pool.release(self._conn)
+            self._conn = None
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise sqlite3.ProgrammingError('Cannot operate on a closed database.')
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._conn.__exit__(exc_type, exc_value, traceback)
+
+class ConnectionPool:
+    """
+    Pool de conexões SQLite.
+
+    As conexões são abertas uma única vez (WAL, PRAGMAs do Config e cache de
+    statements) e reaproveitadas entre threads: cada conexão só é usada por
+    uma thread por vez. Até `size` conexões ociosas ficam guardadas; as
+    excedentes são fechadas ao serem devolvidas.
+    """
+
+    def __init__(self, path=None, size=None):
+        self.path = path or Config.DB_PATH
+        self.size = size or Config.DB_POOL_SIZE
+        self._idle = []
+        self._lock = threading.Lock()
+        self._stats = {
+            'opened': 0,
+            'closed': 0,
+            'acquired': 0,
+            'reused': 0,
+            'in_use': 0,
+            'peak_in_use': 0,
+        }
+
+    def _open(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=Config.DB_BUSY_TIMEOUT / 1000.0,
+            check_same_thread=False,
+            cached_statements=Config.DB_STATEMENT_CACHE
+        )
+        conn.row_factory = sqlite3.Row
+        conn.create_function('mail_text', 2, message_text, deterministic=True)
+        conn.execute(f'PRAGMA journal_mode = {Config.DB_JOURNAL_MODE}')
+        conn.execute(f'PRAGMA synchronous = {Config.DB_SYNCHRONOUS}')
+        conn.execute(f'PRAGMA cache_size = {int(Config.DB_CACHE_SIZE)}')
+        conn.execute(f'PRAGMA mmap_size = {int(Config.DB_MMAP_SIZE)}')
+        conn.execute(f'PRAGMA busy_timeout = {int(Config.DB_BUSY_TIMEOUT)}')
+        return conn
+
+    def acquire(self):
+        """Empresta uma conexão do pool (abre uma nova se não houver ociosa)"""
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+            self._stats['acquired'] += 1
+            self._stats['in_use'] += 1
+            self._stats['peak_in_use'] = max(self._stats['peak_in_use'], self._stats['in_use'])
+            if conn is not None:
+                self._stats['reused'] += 1
+
+        if conn is None:
+            try:
+                conn = self._open()
+            except Exception:
+                with self._lock:
+                    self._stats['in_use'] -= 1
+                raise
+            with self._lock:
+                self._stats['opened'] += 1
+
+        return PooledConnection(self, conn)
+
+    def release(self, conn):
+        """Devolve uma conexão; transações não confirmadas são desfeitas"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+
+        with self._lock:
+            self._stats['in_use'] -= 1
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+            self._stats['closed'] += 1
+        conn.close()
+
+    def _discard(self, conn):
+        with self._lock:
+            self._stats['in_use'] -= 1
+            self._stats['closed'] += 1
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def retire(self):
+        """Fecha as conexões ociosas; as emprestadas são fechadas ao voltar"""
+        with self._lock:
+            self.size = 0
+        self.close_all()
+    
+    def close_all(self):
+        """Fecha as conexões ociosas"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._stats['closed'] += len(idle)
+        for conn in idle:
+            conn.close()
+
+    def stats(self):
+        """Contadores de uso do pool"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['idle'] = len(self._idle)
+        stats['size'] = self.size
+        return stats
+
+_pool = ConnectionPool()
+_inherited_pools = []
+
+def _reset_pool_after_fork():
+    """
+    Processos filhos (workers web) não podem usar conexões abertas pelo pai.
+    O pool herdado é apenas guardado, nunca fechado: fechar as conexões no
+    filho liberaria os locks POSIX do SQLite que pertencem ao pai.
+    """
+    global _pool
+    _inherited_pools.append(_pool)
+    _pool = ConnectionPool(_pool.path, _pool.size)
+
+os.register_at_fork(after_in_child=_reset_pool_after_fork)
+
+def get_db_connection():
+    """Empresta uma conexão do pool; chame close() para devolvê-la"""
+    return _pool.acquire()
+
+def get_pool_stats():
+    """Contadores de uso do pool de conexões"""
+    return _pool.stats()
+
+def bump_version(cursor, key):
+    """Incrementa o contador de versão `key` (na transação corrente)"""
     cursor.execute('''
-    CREATE TABLE IF NOT EXISTS user_groups (
-        user_id INTEGER,
-        group_id INTEGER,
-        PRIMARY KEY (user_id, group_id),
-        FOREIGN KEY (user_id) REFERENCES users (id),
-        FOREIGN KEY (group_id) REFERENCES groups (id)
-    )
-    ''')
-    
-    # Tabela de associação grupo-permissão
+    INSERT INTO meta (key, value) VALUES (?, 1)
+    ON CONFLICT(key) DO UPDATE SET value = value + 1
+    ''', (key,))
+
+def get_version(cursor, key):
+    """Lê o contador de versão `key` (0 se nunca foi incrementado)"""
+    cursor.execute('SELECT value FROM meta WHERE key = ?', (key,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+def domain_version_key(domain_id):
+    """Chave na tabela meta da versão dos dados de um domínio"""
+    return f'domain:{domain_id}'
+
+def bump_domain_version(cursor, domain_id):
+    """
+    Registra, na transação corrente, que emails, resumo diário ou usuários
+    do domínio mudaram (invalida as respostas em cache, ver http_cache.py)
+    """
+    if domain_id is None:
+        return
+    bump_version(cursor, domain_version_key(domain_id))
+
+def blob_digest(data):
+    """Hash (SHA-256) que identifica um corpo na tabela blobs"""
+    return hashlib.sha256(data).hexdigest()
+
+def store_blob(cursor, data, digest=None):
+    """
+    Grava o corpo `data` na tabela blobs se o conteúdo ainda não existir (na
+    transação corrente). Retorna o hash.
+    `data` são bytes ou um MessageSpool (smtp_spool.py), copiado em blocos
+    para o blob sem passar a mensagem inteira pela memória; nesse caso o
+    hash vem do próprio spool.
+    """
+    if digest is None:
+        digest = data.digest if not isinstance(data, bytes) else blob_digest(data)
+    # Sem contador de referências na linha: um UPDATE reescreveria o
+    # registro inteiro, corpo incluído, a cada destinatário
+    cursor.execute('SELECT 1 FROM blobs WHERE hash = ?', (digest,))
+    if cursor.fetchone() is not None:
+        return digest
+    
+    # A leitura não segura o lock de escrita: outro processo (shards do
+    # SMTP, workers de envio, painel) pode gravar o mesmo corpo antes do
+    # INSERT. O conflito é ignorado em vez de desfazer o lote inteiro
+    conn = cursor.connection
+    if isinstance(data, bytes) or not hasattr(conn, 'blobopen'):
+        value = data if isinstance(data, bytes) else data.getvalue()
+        cursor.execute('''
+        INSERT INTO blobs (hash, size, data) VALUES (?, ?, ?)
+        ON CONFLICT (hash) DO NOTHING
+        ''', (digest, len(value), value))
+        return digest
+    
     cursor.execute('''
-    CREATE TABLE IF NOT EXISTS group_permissions (
-        group_id INTEGER,
-        permission_id INTEGER,
-        PRIMARY KEY (group_id, permission_id),
-        FOREIGN KEY (group_id) REFERENCES groups (id),
-        FOREIGN KEY (permission_id) REFERENCES permissions (id)
-    )
-    ''')
-    
-    # Tabela de associação usuário-permissão direta
+    INSERT INTO blobs (hash, size, data) VALUES (?, ?, zeroblob(?))
+    ON CONFLICT (hash) DO NOTHING
+    ''', (digest, len(data), len(data)))
+    if cursor.rowcount == 0:
+        return digest
+    with conn.blobopen('blobs', 'data', cursor.lastrowid) as blob:
+        for chunk in data.chunks():
+            blob.write(chunk)
+    return digest
+
+def insert_email(cursor, sender, recipient, subject, body, domain_id, status, body_text=None,
+                 headers=None, body_hash=None, control=None):
+    """
+    Grava um email, o adiciona ao índice de busca, atualiza o resumo diário
+    do domínio e incrementa a versão dele (na transação corrente).
+    Com DB_SHARDING, `cursor` é do banco de emails do domínio e `control`
+    do banco principal (resumo diário e versão, ver mail_shards.py); sem
+    `control`, tudo vai para `cursor`.
+    O corpo (str, bytes ou MessageSpool) vai para a tabela blobs (ver
+    store_blob); body_hash é o hash já calculado do corpo, para não
+    recalculá-lo a cada destinatário.
+    body_text é o texto já extraído do corpo; se omitido, é extraído aqui.
+    headers traz as colunas de HEADER_COLUMNS (ver parse_message); se
+    omitido, são derivadas do remetente, do destinatário e do corpo.
+    Retorna o id do email.
+    """
+    if body_text is None:
+        body_text = message_text(body, status)
+    if headers is None:
+        headers = sent_headers(sender, recipient, body, body_text)
+    if isinstance(body, str):
+        body = body.encode('utf-8', errors='surrogateescape')
+    if body is not None:
+        body_hash = store_blob(cursor, body, body_hash)
+    else:
+        # Sem corpo não há blob: o email não pode referenciar um hash
+        body_hash = None
+    
     cursor.execute('''
-    CREATE TABLE IF NOT EXISTS user_permissions (
-        user_id INTEGER,
-        permission_id INTEGER,
-        PRIMARY KEY (user_id, permission_id),
-        FOREIGN KEY (user_id) REFERENCES users (id),
-        FOREIGN KEY (permission_id) REFERENCES permissions (id)
-    )
-    ''')
-    
-    # Tabela de emails
+    INSERT INTO emails (sender, recipient, subject, body_hash, domain_id, status, message_id,
+                        date_header, from_header, to_header, cc_header, size, snippet)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (sender, recipient, subject, body_hash, domain_id, status,
+          *(headers.get(column) for column in HEADER_COLUMNS)))
+    email_id = cursor.lastrowid
+    
     cursor.execute('''
-    CREATE TABLE IF NOT EXISTS emails (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        sender TEXT NOT NULL,
-        recipient TEXT NOT NULL,
-        subject TEXT,
-        body TEXT,
-        domain_id INTEGER,
-        received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        status TEXT DEFAULT 'received',
-        FOREIGN KEY (domain_id) REFERENCES domains (id)
-    )
-    ''')
-    
-    # Inserir permissões padrão
-    default_permissions = [
-        ('manage_domain', 'Gerenciar configurações do domínio'),
-        ('manage_users', 'Gerenciar usuários do domínio'),
-        ('manage_groups', 'Gerenciar grupos do domínio'),
-        ('view_emails', 'Visualizar emails do domínio'),
-        ('send_emails', 'Enviar emails pelo domínio'),
-        ('manage_permissions', 'Gerenciar permissões'),
-    ]
-    
-    cursor.executemany('INSERT OR IGNORE INTO permissions (name, description) VALUES (?, ?)', default_permissions)
-    
-    # Criar usuário super admin se não existir
-    cursor.execute("SELECT * FROM users WHERE is_super_admin = 1")
-    if not cursor.fetchone():
-        password = "admin123"
-        password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    INSERT INTO emails_fts (rowid, domain_tag, subject, sender, recipient, body_text)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ''', (email_id, f'd{domain_id}', subject, sender, recipient, body_text))
+    
+    if control is None:
+        control = cursor
+    size = headers.get('size') or 0
+    if status == 'received':
+        record_daily_stats(control, domain_id, received=1, received_bytes=size)
+    elif status == 'sent':
+        record_daily_stats(control, domain_id, sent=1, sent_bytes=size)
+    
+    bump_domain_version(control, domain_id)
+    return email_id
+
+def insert_emails(cursor, sender, recipients, subject, body, domain_id, status, body_text=None,
+                  control=None):
+    """
+    Grava em lote o mesmo email (criado pelo painel, texto simples) para
+    vários destinatários, na transação corrente: o corpo vai uma vez para a
+    tabela blobs, o índice de busca recebe todas as linhas em um único
+    executemany e o resumo diário e a versão do domínio são atualizados uma
+    vez. `cursor` e `control` como em insert_email. Retorna os ids, na ordem
+    de `recipients`.
+    """
+    if not recipients:
+        return []
+    if body_text is None:
+        body_text = message_text(body, status)
+    body_hash = None
+    if body is not None:
+        body_hash = store_blob(cursor, body.encode('utf-8', errors='surrogateescape'))
+    
+    # Um INSERT por linha (statement em cache) para obter cada id
+    ids = []
+    total_size = 0
+    for recipient in recipients:
+        headers = sent_headers(sender, recipient, body, body_text)
         cursor.execute('''
-        INSERT INTO users (username, email, password_hash, full_name, is_super_admin)
-        VALUES (?, ?, ?, ?, ?)
-        ''', ('superadmin', 'admin@system.local', password_hash, 'Super Administrador', 1))
+        INSERT INTO emails (sender, recipient, subject, body_hash, domain_id, status, message_id,
+                            date_header, from_header, to_header, cc_header, size, snippet)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (sender, recipient, subject, body_hash, domain_id, status,
+              *(headers.get(column) for column in HEADER_COLUMNS)))
+        ids.append(cursor.lastrowid)
+        total_size += headers['size']
+    
+    cursor.executemany('''
+    INSERT INTO emails_fts (rowid, domain_tag, subject, sender, recipient, body_text)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ''', [(email_id, f'd{domain_id}', subject, sender, recipient, body_text)
+          for email_id, recipient in zip(ids, recipients)])
     
-    conn.commit()
-    conn.close()
+    if control is None:
+        control = cursor
+    if status == 'received':
+        record_daily_stats(control, domain_id, received=len(ids), received_bytes=total_size)
+    elif status == 'sent':
+        record_daily_stats(control, domain_id, sent=len(ids), sent_bytes=total_size)
+    
+    bump_domain_version(control, domain_id)
+    return ids
 
-def get_db_connection():
-    conn = sqlite3.connect('server_panel.db')
-    conn.row_factory = sqlite3.Row
-    return conn
\ No newline at end of file
+def open_body(conn, email):
+    """
+    Corpo de um email (linha com body e body_hash) para leitura em blocos: um
+    sqlite3.Blob, lido do mmap do banco sem carregar o valor inteiro, ou
+    bytes (emails anteriores à migração 9 e Python < 3.11). Feche o Blob
+    antes de devolver a conexão.
+    """
+    if email['body_hash'] is None:
+        return (email['body'] or '').encode('utf-8', errors='surrogateescape')
+    row = conn.execute('SELECT id FROM blobs WHERE hash = ?', (email['body_hash'],)).fetchone()
+    if row is None:
+        return b''
+    if hasattr(conn, 'blobopen'):
+        return conn.blobopen('blobs', 'data', row[0], readonly=True)
+    return conn.execute('SELECT data FROM blobs WHERE id = ?', (row[0],)).fetchone()[0]
+
+def read_body(conn, email):
+    """Corpo completo de um email (bytes)"""
+    body = open_body(conn, email)
+    if isinstance(body, bytes):
+        return body
+    with body:
+        return body.read()
+
+def record_daily_stats(cursor, domain_id, received=0, received_bytes=0, sent=0, sent_bytes=0,
+                       active_users=0):
+    """Soma contadores ao resumo do domínio no dia UTC corrente"""
+    if domain_id is None:
+        return
+    cursor.execute('''
+    INSERT INTO domain_daily_stats (domain_id, day, received_count, received_bytes,
+                                    sent_count, sent_bytes, active_users)
+    VALUES (?, DATE('now'), ?, ?, ?, ?, ?)
+    ON CONFLICT (domain_id, day) DO UPDATE SET
+        received_count = received_count + excluded.received_count,
+        received_bytes = received_bytes + excluded.received_bytes,
+        sent_count = sent_count + excluded.sent_count,
+        sent_bytes = sent_bytes + excluded.sent_bytes,
+        active_users = active_users + excluded.active_users
+    ''', (domain_id, received, received_bytes, sent, sent_bytes, active_users))
@@ -0,0 +1,196 @@
+import smtplib
+import threading
+import time
+import logging
+from config import Config
+from database import get_db_connection, record_daily_stats, bump_domain_version
+from mail_shards import MailTransaction
+from email_sender import EmailSender
+from events import event_bus, publish_email
+from metrics import SMTP_SEND_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Acorda os workers deste processo quando algo é enfileirado
+_wakeup = threading.Event()
+
+def wake_workers():
+    """
+    Sinaliza aos workers deste processo que há mensagens novas na fila. Só
+    vale dentro do processo (runtime unificado, CLI): com RUNTIME=split os
+    workers rodam em run.py e uma mensagem enfileirada por um worker web é
+    vista na próxima leitura da fila, em até DELIVERY_POLL_INTERVAL segundos.
+    """
+    _wakeup.set()
+
+class DeliveryWorkerPool:
+    """
+    Workers que drenam a fila persistente outbound_queue.
+    
+    Cada worker reserva uma mensagem vencida, entrega ao relay e grava o
+    resultado na fila e no status do email (sent, deferred ou bounced).
+    Falhas temporárias são reagendadas com backoff exponencial; respostas
+    5xx do relay ou o limite de tentativas resultam em bounce.
+    
+    Com a fila vazia, cada worker a relê a cada DELIVERY_POLL_INTERVAL
+    segundos, ou antes se wake_workers() for chamada no mesmo processo.
+    """
+    
+    def __init__(self, workers=None, sender=None):
+        self.workers = workers or Config.DELIVERY_WORKERS
+        self.sender = sender or EmailSender()
+        self._threads = []
+        self._stopping = threading.Event()
+    
+    def start(self):
+        """Recupera mensagens presas em 'sending' e inicia os workers"""
+        conn = get_db_connection()
+        conn.execute('''
+        UPDATE outbound_queue SET state = 'deferred', updated_at = CURRENT_TIMESTAMP
+        WHERE state = 'sending'
+        ''')
+        conn.commit()
+        conn.close()
+        
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, daemon=True, name=f"Delivery-{i}")
+            thread.start()
+            self._threads.append(thread)
+        
+        logger.info(f"📤 {self.workers} workers de envio iniciados")
+    
+    def alive(self):
+        """Quantidade de workers em execução"""
+        return sum(thread.is_alive() for thread in self._threads)
+    
+    def stop(self, timeout=None):
+        """Para os workers depois da entrega em andamento"""
+        self._stopping.set()
+        _wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+    
+    def _claim(self):
+        """Reserva a próxima mensagem vencida (ou None)"""
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+            UPDATE outbound_queue
+            SET state = 'sending', attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE id = (
+                SELECT id FROM outbound_queue
+                WHERE state IN ('queued', 'deferred') AND next_attempt_at <= ?
+                ORDER BY next_attempt_at
+                LIMIT 1
+            )
+            RETURNING *
+            ''', (time.time(),))
+            job = cursor.fetchone()
+            conn.commit()
+            return job
+        finally:
+            conn.close()
+    
+    def _finish(self, job, state, error=None):
+        """Grava o resultado da tentativa na fila e no email"""
+        next_attempt_at = job['next_attempt_at']
+        if state == 'deferred':
+            delay = Config.DELIVERY_RETRY_BASE * (2 ** (job['attempts'] - 1))
+            next_attempt_at = time.time() + min(delay, Config.DELIVERY_RETRY_MAX)
+        
+        with MailTransaction() as transaction:
+            # O shard antes do banco principal (ver MailTransaction)
+            transaction.mail(job['domain_id']).execute('UPDATE emails SET status = ? WHERE id = ?',
+                                                       (state, job['email_id']))
+            cursor = transaction.control
+            cursor.execute('''
+            UPDATE outbound_queue
+            SET state = ?, next_attempt_at = ?, last_error = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+            ''', (state, next_attempt_at, error, job['id']))
+            if state == 'sent':
+                record_daily_stats(cursor, job['domain_id'], sent=1,
+                                   sent_bytes=len((job['body'] or '').encode('utf-8')))
+            bump_domain_version(cursor, job['domain_id'])
+            publish_email(cursor, job['email_id'], job['domain_id'], job['from_email'],
+                          job['subject'], state)
+            transaction.commit()
+        event_bus.notify()
+    
+    def _deliver(self, server, job):
+        """Entrega uma mensagem; retorna (estado, erro)"""
+        msg = self.sender._build_message(job['from_email'], job['to_email'], job['subject'],
+                                         job['body'] or '', job['html_body'])
+        try:
+            server.send_message(msg)
+            return 'sent', None
+        except smtplib.SMTPRecipientsRefused as e:
+            codes = [code for code, _ in e.recipients.values()]
+            permanent = all(500 <= code < 600 for code in codes)
+            return ('bounced' if permanent else 'deferred'), str(e.recipients)
+        except smtplib.SMTPResponseException as e:
+            return ('bounced' if 500 <= e.smtp_code < 600 else 'deferred'), f"{e.smtp_code} {e.smtp_error!r}"
+    
+    def _run(self):
+        server = None
+        
+        while not self._stopping.is_set():
+            try:
+                job = self._claim()
+            except Exception as e:
+                logger.error(f"Erro ao ler a fila de envio: {str(e)}")
+                job = None
+            
+            if job is None:
+                # Fila vazia: liberar a conexão com o relay e aguardar
+                if server is not None:
+                    _close(server)
+                    server = None
+                _wakeup.wait(Config.DELIVERY_POLL_INTERVAL)
+                _wakeup.clear()
+                continue
+            
+            for _ in range(2):
+                fresh = server is None
+                start = time.perf_counter()
+                try:
+                    if server is None:
+                        server = smtplib.SMTP(self.sender.host, self.sender.port)
+                    state, error = self._deliver(server, job)
+                    SMTP_SEND_SECONDS.observe(time.perf_counter() - start, 'queue', 'ok' if state == 'sent' else 'error')
+                    break
+                except (smtplib.SMTPException, OSError) as e:
+                    # Relay indisponível ou conexão perdida
+                    if server is not None:
+                        _close(server)
+                        server = None
+                    state, error = 'deferred', str(e)
+                    SMTP_SEND_SECONDS.observe(time.perf_counter() - start, 'queue', 'error')
+                    # Conexão reaproveitada fechada pelo relay: tentar com uma nova
+                    if fresh or not isinstance(e, smtplib.SMTPServerDisconnected):
+                        break
+            
+            if state == 'deferred' and job['attempts'] >= Config.DELIVERY_MAX_ATTEMPTS:
+                state = 'bounced'
+            
+            try:
+                self._finish(job, state, error)
+            except Exception as e:
+                logger.error(f"Erro ao atualizar a fila de envio ({job['id']}): {str(e)}")
+                continue
+            
+            if state == 'sent':
+                logger.info(f"Email {job['id']} enviado de {job['from_email']} para {job['to_email']}")
+            else:
+                logger.warning(f"Email {job['id']} para {job['to_email']}: {state} ({error})")
+        
+        if server is not None:
+            _close(server)
+
+def _close(server):
+    try:
+        server.quit()
+    except (smtplib.SMTPException, OSError):
+        server.close()
@@ -1,100 +1,171 @@
 import asyncio
-from aiosmtpd.controller import Controller
+import threading
+import time
 from aiosmtpd.smtp import Envelope, Session
-from email.parser import BytesParser
-from email.policy import default
-from database import get_db_connection
+from routing import routing_index
+from email_writer import EmailWriter
+from database import blob_digest
+from smtp_spool import MessageSpool
+from smtp_admission import AdmissionControl, AdmissionController
+from mail_parser import parse_message, HEADER_COLUMNS
+from metrics import registry, SMTP_RCPT_SECONDS, SMTP_DATA_SECONDS, SMTP_MESSAGE_BYTES, SMTP_RECIPIENTS
 import logging
-from typing import Optional, List
+from typing import Optional
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class ReusePortController(AdmissionController):
+    """
+    Controller que abre o socket com SO_REUSEPORT: vários processos escutam
+    a mesma porta e o kernel distribui as conexões entre eles.
+    """
+    
+    def _create_server(self):
+        return self.loop.create_server(
+            self._factory_invoker,
+            host=self.hostname,
+            port=self.port,
+            ssl=self.ssl_context,
+            reuse_port=True,
+        )
+
 class EmailHandler:
     """Handler personalizado para processar emails"""
     
+    def __init__(self, writer: Optional[EmailWriter] = None):
+        self.writer = writer or EmailWriter()
+        # Limites de conexões e de taxa (ver smtp_admission.py)
+        self.admission = AdmissionControl(self.writer)
+        # Contadores (atualizados apenas pelo event loop do Controller)
+        self.stats = {
+            'messages': 0,
+            'recipients': 0,
+            'rejected': 0,
+            'bytes': 0,
+            'errors': 0,
+        }
+        # Mensagens entre o fim do DATA e a resposta (aguardando o commit)
+        self.in_flight = 0
+    
+    async def handle_MAIL(self, server, session, envelope: Envelope, address: str, mail_options) -> str:
+        """Aplica os limites de taxa por IP e por remetente"""
+        peer = session.peer[0] if isinstance(session.peer, tuple) else session.peer
+        refusal = self.admission.admit_message(peer, address)
+        if refusal is not None:
+            # Resposta atrasada: quem insiste não gira em torno do MAIL FROM
+            await asyncio.sleep(self.admission.refusal_delay)
+            if refusal.startswith('421') and server.transport is not None:
+                # 421 encerra a sessão (RFC 5321 3.8), depois da resposta
+                server.loop.call_soon(server.transport.close)
+            return refusal
+        
+        envelope.mail_from = address
+        envelope.mail_options.extend(mail_options)
+        return '250 OK'
+    
     async def handle_RCPT(self, server, session, envelope: Envelope, address: str, rcpt_options) -> str:
         """Valida destinatários"""
+        start = time.perf_counter()
+        result = self._accept_recipient(envelope, address)
+        SMTP_RCPT_SECONDS.observe(time.perf_counter() - start, result[:3])
+        return result
+    
+    def _accept_recipient(self, envelope: Envelope, address: str) -> str:
         try:
             if '@' not in address:
                 return '550 Endereço inválido'
             
             domain = address.split('@')[-1].lower()
             
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT id FROM domains WHERE domain_name = ?', (domain,))
-            domain_data = cursor.fetchone()
-            conn.close()
-            
-            if domain_data:
-                if not hasattr(envelope, 'rcpt_tos'):
-                    envelope.rcpt_tos = []
-                envelope.rcpt_tos.append(address)
-                logger.info(f"Email aceito para: {address}")
-                return '250 OK'
-            else:
+            if routing_index.lookup_domain(domain) is None:
                 logger.warning(f"Domínio não encontrado: {domain}")
+                self.stats['rejected'] += 1
                 return '550 Domínio não encontrado'
+            
+            if routing_index.lookup_user(address) is None:
+                logger.warning(f"Usuário não encontrado: {address}")
+                self.stats['rejected'] += 1
+                return '550 Usuário não encontrado'
+            
+            if not hasattr(envelope, 'rcpt_tos'):
+                envelope.rcpt_tos = []
+            envelope.rcpt_tos.append(address)
+            logger.info(f"Email aceito para: {address}")
+            return '250 OK'
         except Exception as e:
             logger.error(f"Erro em handle_RCPT: {str(e)}")
             return '451 Erro temporário no servidor'
     
     async def handle_DATA(self, server, session: Session, envelope: Envelope) -> str:
         """Processa dados do email"""
+        start = time.perf_counter()
+        self.in_flight += 1
         try:
-            email_content = envelope.content.decode('utf-8', errors='ignore')
-            msg = BytesParser(policy=default).parsebytes(envelope.content)
+            result = await self._store_message(envelope)
+        finally:
+            self.in_flight -= 1
+        SMTP_DATA_SECONDS.observe(time.perf_counter() - start, result[:3])
+        SMTP_MESSAGE_BYTES.observe(len(envelope.content))
+        return result
+    
+    async def _store_message(self, envelope: Envelope) -> str:
+        try:
+            # Uma única análise da mensagem: assunto, texto para a busca e
+            # colunas de cabeçalho (Message-ID, Date, From, To, Cc, trecho).
+            # Com SpoolingSMTP ela já foi feita durante o DATA
+            content = envelope.content
+            if isinstance(content, MessageSpool):
+                parsed = content.parsed()
+                body_hash = content.digest
+            else:
+                parsed = parse_message(content)
+                body_hash = blob_digest(content)
+            headers = {column: parsed[column] for column in HEADER_COLUMNS}
             
             sender = envelope.mail_from
             recipients = getattr(envelope, 'rcpt_tos', [])
+            subject = parsed['subject'] if parsed['subject'] is not None else '(sem assunto)'
+            body_text = parsed['text']
             
             logger.info(f"Email recebido de: {sender} para: {recipients}")
             
+            rows = []
+            
             for recipient in recipients:
-                try:
-                    if '@' not in recipient:
-                        continue
-                    
-                    username, domain = recipient.split('@')
-                    
-                    conn = get_db_connection()
-                    cursor = conn.cursor()
-                    
-                    # Buscar domínio
-                    cursor.execute('SELECT id FROM domains WHERE domain_name = ?', (domain,))
-                    domain_data = cursor.fetchone()
-                    
-                    if domain_data:
-                        domain_id = domain_data['id']
-                        
-                        # Buscar usuário pelo email
-                        cursor.execute('SELECT id FROM users WHERE email = ?', (recipient,))
-                        user_data = cursor.fetchone()
-                        
-                        if user_data:
-                            # Salvar email no banco
-                            cursor.execute('''
-                            INSERT INTO emails (sender, recipient, subject, body, domain_id, status)
-                            VALUES (?, ?, ?, ?, ?, ?)
-                            ''', (sender, recipient, msg.get('subject', '(sem assunto)'), 
-                                  email_content, domain_id, 'received'))
-                            
-                            conn.commit()
-                            logger.info(f"Email salvo para {recipient}")
-                        else:
-                            logger.warning(f"Usuário não encontrado: {recipient}")
-                    
-                    conn.close()
-                    
-                except Exception as e:
-                    logger.error(f"Erro ao processar destinatário {recipient}: {str(e)}")
+                if '@' not in recipient:
+                    continue
+                
+                domain = recipient.split('@')[-1]
+                domain_id = routing_index.lookup_domain(domain)
+                
+                # Destinatários já foram validados no RCPT; o índice pode ter
+                # mudado desde então
+                if domain_id is None or routing_index.lookup_user(recipient) is None:
+                    logger.warning(f"Usuário não encontrado: {recipient}")
                     continue
+                
+                # O corpo é gravado uma única vez (tabela blobs); as demais
+                # linhas só referenciam o hash
+                rows.append((sender, recipient, subject, content,
+                             domain_id, 'received', body_text, headers, body_hash))
+            
+            # Salvar emails no banco: todos os destinatários na mesma transação
+            # (o writer agrupa commits de várias sessões)
+            if rows:
+                await self.writer.write(rows)
+                logger.info(f"Email salvo para {len(rows)} destinatário(s)")
+            
+            self.stats['messages'] += 1
+            self.stats['recipients'] += len(rows)
+            SMTP_RECIPIENTS.inc(amount=len(rows))
+            self.stats['bytes'] += len(content)
             
             return '250 Message accepted for delivery'
             
         except Exception as e:
+            self.stats['errors'] += 1
             logger.error(f"Erro em handle_DATA: {str(e)}")
             return '451 Erro temporário no processamento'
     
@@ -102,28 +173,45 @@ class EmailHandler:
         """Implementação do método abstrato - não usado no nosso caso"""
         return '250 OK'
 
-def start_email_server():
-    """Inicia servidor SMTP"""
-    from aiosmtpd.controller import Controller
+def start_email_server(ready=None):
+    """
+    Inicia servidor SMTP. `ready` (threading.Event) é sinalizado quando a
+    porta já aceita conexões.
+    """
+    from config import Config
+    
+    # Métricas deste processo (e, com shards, as do supervisor)
+    registry.start_dumper('smtp')
+    
+    # Vários processos na mesma porta (ver smtp_shards.py)
+    if Config.SMTP_SHARDS > 1:
+        from smtp_shards import ShardSupervisor
+        ShardSupervisor(Config.SMTP_SHARDS).run(ready)
+        return
+    
+    routing_index.load()
     
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+    writer = EmailWriter()
+    writer.start()
     
-    handler = EmailHandler()
+    handler = EmailHandler(writer)
     
-    controller = Controller(
+    # O Controller roda o próprio event loop em uma thread
+    controller = AdmissionController(
         handler, 
         hostname='0.0.0.0', 
-        port=25,
-        loop=loop
+        port=Config.SMTP_PORT
     )
     
     try:
+        # start() só retorna com o socket escutando
         controller.start()
-        logger.info(f"✅ Servidor de email iniciado na porta 25")
+        logger.info(f"✅ Servidor de email iniciado na porta {Config.SMTP_PORT}")
+        if ready is not None:
+            ready.set()
         
-        # Manter o loop rodando
-        loop.run_forever()
+        # Manter a thread viva enquanto o servidor roda
+        threading.Event().wait()
         
     except KeyboardInterrupt:
         logger.info("Parando servidor de email...")
@@ -131,4 +219,5 @@ def start_email_server():
         logger.error(f"Erro no servidor de email: {str(e)}")
     finally:
         controller.stop()
-        loop.close()
\ No newline at end of file
+        writer.stop()
+        registry.stop_dumper()
@@ -1,7 +1,13 @@
 import smtplib
+import time
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from database import get_db_connection
+from config import Config
+from database import get_db_connection, insert_email, insert_emails
+from mail_shards import MailTransaction
+from events import event_bus, publish_email
+from metrics import SMTP_SEND_SECONDS
 import logging
 
 logger = logging.getLogger(__name__)
@@ -10,60 +16,80 @@ class EmailSender:
     def __init__(self):
         self.host = 'localhost'
         self.port = 2525  # Porta do PostMail
+        self.bulk_connections = Config.BULK_SMTP_CONNECTIONS
+    
+    def _authorize_sender(self, from_email):
+        """Retorna o id do domínio do remetente ou None se não autorizado"""
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        # Extrair domínio do remetente
+        sender_domain = from_email.split('@')[-1]
+        
+        cursor.execute('''
+        SELECT d.id, u.id as user_id 
+        FROM domains d
+        LEFT JOIN users u ON u.email = ? AND u.domain_id = d.id
+        WHERE d.domain_name = ?
+        ''', (from_email, sender_domain))
+        
+        domain_data = cursor.fetchone()
+        conn.close()
+        
+        if not domain_data:
+            logger.error(f"Domínio não autorizado: {sender_domain}")
+            return None
+        
+        return domain_data['id']
+    
+    def _build_message(self, from_email, to_email, subject, body, html_body=None):
+        """Monta a mensagem MIME (sem o cabeçalho To se to_email for None)"""
+        msg = MIMEMultipart('alternative')
+        msg['From'] = from_email
+        if to_email is not None:
+            msg['To'] = to_email
+        msg['Subject'] = subject
+        
+        # Adicionar corpo texto
+        msg.attach(MIMEText(body, 'plain'))
+        
+        # Adicionar corpo HTML se fornecido
+        if html_body:
+            msg.attach(MIMEText(html_body, 'html'))
+        
+        return msg
     
     def send_email(self, from_email, to_email, subject, body, html_body=None):
         """Envia email via PostMail"""
         try:
             # Verificar se o remetente tem permissão
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            # Extrair domínio do remetente
-            sender_domain = from_email.split('@')[-1]
-            
-            cursor.execute('''
-            SELECT d.id, u.id as user_id 
-            FROM domains d
-            LEFT JOIN users u ON u.email = ? AND u.domain_id = d.id
-            WHERE d.domain_name = ?
-            ''', (from_email, sender_domain))
-            
-            domain_data = cursor.fetchone()
-            conn.close()
-            
-            if not domain_data:
-                logger.error(f"Domínio não autorizado: {sender_domain}")
+            domain_id = self._authorize_sender(from_email)
+            if domain_id is None:
                 return False
             
             # Criar mensagem
-            msg = MIMEMultipart('alternative')
-            msg['From'] = from_email
-            msg['To'] = to_email
-            msg['Subject'] = subject
-            
-            # Adicionar corpo texto
-            msg.attach(MIMEText(body, 'plain'))
-            
-            # Adicionar corpo HTML se fornecido
-            if html_body:
-                msg.attach(MIMEText(html_body, 'html'))
+            msg = self._build_message(from_email, to_email, subject, body, html_body)
             
             # Enviar via PostMail
-            with smtplib.SMTP(self.host, self.port) as server:
-                # server.starttls()  # Descomente se usar TLS
-                server.send_message(msg)
+            start = time.perf_counter()
+            try:
+                with smtplib.SMTP(self.host, self.port) as server:
+                    # server.starttls()  # Descomente se usar TLS
+                    server.send_message(msg)
+            except Exception:
+                SMTP_SEND_SECONDS.observe(time.perf_counter() - start, 'direct', 'error')
+                raise
+            SMTP_SEND_SECONDS.observe(time.perf_counter() - start, 'direct', 'ok')
             
             logger.info(f"Email enviado de {from_email} para {to_email}")
             
             # Registrar no banco
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
-            INSERT INTO emails (sender, recipient, subject, body, domain_id, status)
-            VALUES (?, ?, ?, ?, ?, ?)
-            ''', (from_email, to_email, subject, body, domain_data['id'], 'sent'))
-            conn.commit()
-            conn.close()
+            with MailTransaction() as transaction:
+                email_id = insert_email(transaction.mail(domain_id), from_email, to_email, subject,
+                                        body, domain_id, 'sent', control=transaction.control)
+                publish_email(transaction.control, email_id, domain_id, from_email, subject, 'sent')
+                transaction.commit()
+            event_bus.notify()
             
             return True
             
@@ -71,11 +97,138 @@ class EmailSender:
             logger.error(f"Erro ao enviar email: {str(e)}")
             return False
     
-    def send_bulk_emails(self, from_email, recipients, subject, body, html_body=None):
-        """Envia email para múltiplos destinatários"""
+    def queue_email(self, from_email, to_email, subject, body, html_body=None):
+        """
+        Enfileira um email na fila persistente; a entrega é feita pelos
+        workers de delivery.py, na hora se estiverem neste processo ou em até
+        DELIVERY_POLL_INTERVAL segundos se não (ver wake_workers). Retorna o
+        id na fila ou None se o remetente não for autorizado.
+        """
+        domain_id = self._authorize_sender(from_email)
+        if domain_id is None:
+            return None
+        
+        with MailTransaction() as transaction:
+            cursor = transaction.control
+            email_id = insert_email(transaction.mail(domain_id), from_email, to_email, subject,
+                                    body, domain_id, 'queued', control=cursor)
+            publish_email(cursor, email_id, domain_id, from_email, subject, 'queued')
+            
+            cursor.execute('''
+            INSERT INTO outbound_queue (email_id, domain_id, from_email, to_email,
+                                        subject, body, html_body, next_attempt_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (email_id, domain_id, from_email, to_email, subject, body, html_body, time.time()))
+            queue_id = cursor.lastrowid
+            
+            transaction.commit()
+        event_bus.notify()
+        
+        # Importar aqui para evitar importação circular
+        from delivery import wake_workers
+        wake_workers()
+        
+        return queue_id
+    
+    def _deliver_batch(self, from_email, recipients, payload):
+        """
+        Entrega a mensagem para cada destinatário usando uma única conexão
+        SMTP persistente (uma transação MAIL FROM/RCPT/DATA por mensagem).
+        Retorna [(destinatário, sucesso, erro)].
+        """
         results = []
+        server = None
+        
         for recipient in recipients:
-            success = self.send_email(from_email, recipient, subject, body, html_body)
-            results.append({'recipient': recipient, 'success': success})
+            if '\r' in recipient or '\n' in recipient:
+                results.append((recipient, False, 'Destinatário inválido'))
+                continue
+            
+            message = f'To: {recipient}\r\n'.encode('utf-8') + payload
+            
+            # Uma nova tentativa com conexão nova se o relay derrubar a sessão
+            start = time.perf_counter()
+            for attempt in range(2):
+                try:
+                    if server is None:
+                        server = smtplib.SMTP(self.host, self.port)
+                    server.sendmail(from_email, [recipient], message)
+                    results.append((recipient, True, None))
+                    break
+                except smtplib.SMTPServerDisconnected as e:
+                    server = None
+                    if attempt:
+                        results.append((recipient, False, str(e)))
+                except Exception as e:
+                    # sendmail já envia RSET após uma recusa
+                    results.append((recipient, False, str(e)))
+                    break
+            SMTP_SEND_SECONDS.observe(time.perf_counter() - start, 'bulk', 'ok' if results[-1][1] else 'error')
+        
+        if server is not None:
+            try:
+                server.quit()
+            except smtplib.SMTPException:
+                server.close()
+        
+        return results
+    
+    def send_bulk_emails(self, from_email, recipients, subject, body, html_body=None):
+        """
+        Envia email para múltiplos destinatários.
+        
+        O remetente é autorizado uma vez, a mensagem é montada uma vez e a
+        entrega é feita por até BULK_SMTP_CONNECTIONS sessões SMTP
+        persistentes em paralelo. Os envios bem-sucedidos são registrados (e
+        indexados para busca) em lote, em uma única transação (insert_emails).
+        
+        Retorna, como antes, uma lista com um item {'recipient', 'success'}
+        (e 'error' nas falhas) por posição de `recipients`, na mesma ordem:
+        um destinatário repetido recebe uma mensagem por ocorrência.
+        """
+        start = time.perf_counter()
+        recipients = list(recipients)
+        
+        domain_id = self._authorize_sender(from_email)
+        if domain_id is None:
+            return [{'recipient': r, 'success': False} for r in recipients]
+        
+        # Serializar uma vez; o cabeçalho To é acrescentado por destinatário
+        payload = self._build_message(from_email, None, subject, body, html_body).as_bytes()
+        payload = payload.replace(b'\r\n', b'\n').replace(b'\n', b'\r\n')
+        
+        workers = max(1, min(self.bulk_connections, len(recipients)))
+        # Lotes de posições: cada resultado volta para a posição do destinatário
+        batches = [list(range(i, len(recipients), workers)) for i in range(workers)]
+        
+        results = [None] * len(recipients)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            deliveries = executor.map(
+                lambda batch: self._deliver_batch(from_email, [recipients[i] for i in batch], payload),
+                batches)
+            for batch, batch_results in zip(batches, deliveries):
+                for index, (recipient, success, error) in zip(batch, batch_results):
+                    result = {'recipient': recipient, 'success': success}
+                    if error:
+                        result['error'] = error
+                        logger.error(f"Erro ao enviar email para {recipient}: {error}")
+                    results[index] = result
+        
+        sent = [result['recipient'] for result in results if result['success']]
+        
+        # Registrar todos os envios no banco em lote, em uma única transação
+        if sent:
+            with MailTransaction() as transaction:
+                email_ids = insert_emails(transaction.mail(domain_id), from_email, sent, subject, body,
+                                          domain_id, 'sent', control=transaction.control)
+                for email_id in email_ids:
+                    publish_email(transaction.control, email_id, domain_id, from_email, subject, 'sent')
+                transaction.commit()
+            event_bus.notify()
+        
+        elapsed = time.perf_counter() - start
+        throughput = len(sent) / elapsed if elapsed > 0 else 0.0
+        logger.info(f"Envio em massa de {from_email}: {len(sent)}/{len(recipients)} em {elapsed:.2f}s "
+                    f"({throughput:.1f} msg/s)")
         
-        return results
\ No newline at end of file
+        return results
@@ -0,0 +1,148 @@
+import asyncio
+import queue
+import threading
+import time
+import logging
+from config import Config
+from database import get_db_connection, insert_email
+from mail_shards import MailTransaction
+from events import event_bus, publish_email, prune_events
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+class EmailWriter:
+    """
+    Estágio de escrita dos emails recebidos.
+
+    Uma thread dedicada consome as linhas enviadas pelas sessões SMTP e as
+    grava em lote (group commit): um único COMMIT a cada N linhas ou M
+    milissegundos. O coroutine que chamou write() só é liberado depois que
+    o lote que contém suas linhas foi efetivado no disco. Cada email gera
+    um evento para /api/events no mesmo lote (ver events.py).
+
+    Com DB_SHARDING são EMAIL_WRITER_LANES threads, cada uma com sua fila:
+    um domínio é sempre gravado pela mesma (domain_id % lanes), e lanes
+    diferentes gravam em shards diferentes em paralelo.
+    """
+
+    def __init__(self, batch_size=None, flush_interval_ms=None, lanes=None):
+        self.batch_size = batch_size or Config.EMAIL_WRITER_BATCH_SIZE
+        self.flush_interval = (flush_interval_ms or Config.EMAIL_WRITER_FLUSH_MS) / 1000.0
+        self.lanes = lanes or (Config.EMAIL_WRITER_LANES if Config.DB_SHARDING else 1)
+        self._queues = [queue.Queue() for _ in range(self.lanes)]
+        self._threads = []
+        self._pruned_at = time.monotonic()
+
+    def start(self):
+        """Inicia as threads de escrita"""
+        if self._threads:
+            return
+        for lane, lane_queue in enumerate(self._queues):
+            name = "EmailWriter" if self.lanes == 1 else f"EmailWriter-{lane}"
+            thread = threading.Thread(target=self._run, args=(lane_queue,), daemon=True, name=name)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """Grava o que estiver pendente e encerra as threads"""
+        if not self._threads:
+            return
+        for lane_queue in self._queues:
+            lane_queue.put(_STOP)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    @property
+    def pending(self):
+        """Quantidade aproximada de gravações aguardando as threads"""
+        return sum(lane_queue.qsize() for lane_queue in self._queues)
+
+    async def write(self, rows):
+        """
+        Enfileira linhas (sender, recipient, subject, body, domain_id, status,
+        body_text, headers, body_hash) e aguarda o commit do lote. As linhas
+        de uma chamada vão sempre no mesmo lote (com shards, na lane do
+        domínio da primeira linha). Retorna a quantidade de linhas gravadas.
+        """
+        if not rows:
+            return 0
+        if not self._threads:
+            self.start()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queues[(rows[0][4] or 0) % self.lanes].put((rows, loop, future))
+        return await future
+
+    def _run(self, lane_queue):
+        conn = get_db_connection()
+        try:
+            while True:
+                item = lane_queue.get()
+                if item is _STOP:
+                    break
+
+                # Acumular pedidos até completar o lote ou estourar o prazo
+                batch = [item]
+                count = len(item[0])
+                deadline = time.monotonic() + self.flush_interval
+                stopping = False
+
+                while count < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = lane_queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+                    count += len(item[0])
+
+                self._flush(conn, batch)
+
+                if stopping:
+                    break
+        finally:
+            conn.close()
+
+    def _flush(self, conn, batch):
+        """Grava um lote em uma única transação e libera quem estava esperando"""
+        transaction = MailTransaction(conn, defer_control=True)
+        try:
+            # Com shards, um domínio por vez e em ordem crescente (ver MailTransaction)
+            rows = sorted((row for rows, _, _ in batch for row in rows), key=lambda row: row[4] or 0)
+            for row in rows:
+                sender, _, subject, _, domain_id, status = row[:6]
+                email_id = insert_email(transaction.mail(domain_id), *row,
+                                        control=transaction.control)
+                publish_email(transaction.control, email_id, domain_id, sender, subject, status)
+            if time.monotonic() - self._pruned_at >= Config.EVENTS_PRUNE_INTERVAL:
+                self._pruned_at = time.monotonic()
+                prune_events(transaction.control)
+            transaction.commit()
+        except Exception as e:
+            transaction.rollback()
+            logger.error(f"Erro ao gravar lote de emails: {str(e)}")
+            for _, loop, future in batch:
+                loop.call_soon_threadsafe(_set_exception, future, e)
+            return
+        finally:
+            transaction.close()
+
+        event_bus.notify()
+        for rows, loop, future in batch:
+            loop.call_soon_threadsafe(_set_result, future, len(rows))
+
+def _set_result(future, result):
+    if not future.done():
+        future.set_result(result)
+
+def _set_exception(future, error):
+    if not future.done():
+        future.set_exception(error)
@@ -0,0 +1,207 @@
+import json
+import threading
+import logging
+from collections import deque
+from config import Config
+from database import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+class EventBusFull(Exception):
+    """O processo já atende EVENTS_MAX_SUBSCRIBERS inscrições"""
+
+class Subscription:
+    """
+    Eventos pendentes de um assinante (um stream de /api/events), limitados
+    a `size`. Um assinante lento que estoura o limite é encerrado: o
+    navegador reconecta com Last-Event-ID e recupera o que faltou na tabela
+    events.
+    """
+
+    def __init__(self, domain_id, size, heartbeat):
+        self.domain_id = domain_id
+        self.size = size
+        self.heartbeat = heartbeat
+        self.reset = False  # eventos perdidos antes da inscrição (ver EventBus.subscribe)
+        self.overflowed = False
+        self.closed = False
+        self._events = deque()
+        self._cond = threading.Condition()
+
+    def put(self, event):
+        with self._cond:
+            if len(self._events) >= self.size:
+                self.overflowed = True
+            else:
+                self._events.append(event)
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
+    def __iter__(self):
+        """
+        Eventos (id, dados JSON) na ordem; None a cada `heartbeat` segundos
+        sem eventos. Termina quando a inscrição é fechada ou estoura.
+        """
+        while True:
+            with self._cond:
+                if not self._events and not (self.closed or self.overflowed):
+                    self._cond.wait(self.heartbeat)
+                if self.closed or self.overflowed:
+                    return
+                event = self._events.popleft() if self._events else None
+            yield event
+
+class EventBus:
+    """
+    Publicação/assinatura de eventos de email dentro do processo.
+
+    Os eventos são gravados na tabela events na mesma transação do email
+    (publish_email), o que também os leva aos outros processos: o SMTP e o
+    painel rodam separados. Uma thread lê as linhas novas a cada
+    EVENTS_POLL_INTERVAL segundos, ou logo após notify() quando a escrita
+    foi feita neste processo, e as entrega aos assinantes do domínio.
+    A thread só é criada na primeira inscrição (depois do fork dos workers).
+    """
+
+    def __init__(self, poll_interval=None, buffer_size=None, max_subscribers=None, heartbeat=None):
+        self.poll_interval = poll_interval or Config.EVENTS_POLL_INTERVAL
+        self.buffer_size = buffer_size or Config.EVENTS_BUFFER_SIZE
+        self.max_subscribers = max_subscribers or Config.EVENTS_MAX_SUBSCRIBERS
+        self.heartbeat = heartbeat or Config.EVENTS_HEARTBEAT
+        self._subscribers = set()
+        self._last_id = None
+        self._thread = None
+        self._stopping = threading.Event()
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+
+    def subscribe(self, domain_id, after=None):
+        """
+        Inscreve um assinante nos eventos do domínio. Com `after` (o último
+        id recebido), os eventos seguintes ainda na tabela são entregues
+        primeiro; se parte deles já foi descartada, a inscrição sai com
+        reset=True e o cliente deve recarregar as listagens.
+        """
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                raise EventBusFull()
+            self._start()
+
+            subscription = Subscription(domain_id, self.buffer_size, self.heartbeat)
+            if after is not None and after < self._last_id:
+                # Sob o lock: a thread só entrega os ids depois de _last_id
+                conn = get_db_connection()
+                try:
+                    first = conn.execute('SELECT MIN(id) FROM events').fetchone()[0]
+                    rows = conn.execute('''
+                    SELECT id, data FROM events
+                    WHERE domain_id = ? AND id > ? AND id <= ?
+                    ORDER BY id LIMIT ?
+                    ''', (domain_id, after, self._last_id, self.buffer_size)).fetchall()
+                finally:
+                    conn.close()
+                if first is None or after < first - 1 or len(rows) == self.buffer_size:
+                    subscription.reset = True
+                else:
+                    for row in rows:
+                        subscription.put((row['id'], row['data']))
+
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+        subscription.close()
+
+    def notify(self):
+        """Acorda a thread de leitura (após o commit de um evento neste processo)"""
+        self._wakeup.set()
+
+    def close(self, timeout=None):
+        """Encerra todos os streams e a thread de leitura"""
+        self._stopping.set()
+        self._wakeup.set()
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self._subscribers.clear()
+        for subscription in subscribers:
+            subscription.close()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        conn = get_db_connection()
+        self._last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM events').fetchone()[0]
+        conn.close()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="EventBus")
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            if self._stopping.is_set():
+                break
+            try:
+                self._dispatch()
+            except Exception as e:
+                logger.error(f"Erro ao ler eventos: {str(e)}")
+
+    def _dispatch(self):
+        conn = get_db_connection()
+        try:
+            rows = conn.execute('''
+            SELECT id, domain_id, data FROM events WHERE id > ? ORDER BY id LIMIT 1000
+            ''', (self._last_id,)).fetchall()
+        finally:
+            conn.close()
+        if not rows:
+            return
+
+        with self._lock:
+            for row in rows:
+                if row['id'] <= self._last_id:
+                    continue
+                for subscription in self._subscribers:
+                    if subscription.domain_id == row['domain_id']:
+                        subscription.put((row['id'], row['data']))
+                self._last_id = row['id']
+
+        if len(rows) == 1000:
+            self._wakeup.set()
+
+# Barramento compartilhado pelo processo
+event_bus = EventBus()
+
+def publish_email(cursor, email_id, domain_id, sender, subject, status):
+    """
+    Registra, na transação corrente, o evento de um email novo ou com novo
+    status. Chame event_bus.notify() depois do commit.
+    """
+    if domain_id is None:
+        return
+    cursor.execute('INSERT INTO events (domain_id, data) VALUES (?, ?)', (domain_id, json.dumps({
+        'id': email_id,
+        'domain_id': domain_id,
+        'sender': sender,
+        'subject': subject,
+        'status': status,
+    })))
+
+def prune_events(cursor):
+    """
+    Descarta os eventos mais antigos, mantendo os últimos EVENTS_RETENTION
+    (ao menos um: o rowid do mais recente garante que ids não se repitam)
+    """
+    cursor.execute('''
+    DELETE FROM events WHERE id <= (SELECT MAX(id) FROM events) - ?
+    ''', (max(Config.EVENTS_RETENTION, 1),))
@@ -0,0 +1,53 @@
+import threading
+from database import get_db_connection, get_pool_stats
+
+class HealthRegistry:
+    """
+    Verificações de prontidão (/readyz) dos componentes do processo. Cada
+    componente registra uma função que devolve (pronto, detalhes); o banco
+    principal é sempre verificado. Durante o encerramento (`draining`) o
+    processo deixa de estar pronto, para o balanceador parar de enviar
+    tráfego antes de os listeners fecharem.
+    """
+
+    def __init__(self):
+        self.draining = False
+        self._checks = {}
+        self._lock = threading.Lock()
+        self.register('database', _check_database)
+
+    def register(self, name, check):
+        with self._lock:
+            self._checks[name] = check
+
+    def unregister(self, name):
+        with self._lock:
+            self._checks.pop(name, None)
+
+    def check(self):
+        """(pronto, {componente: detalhes}) de todos os componentes"""
+        with self._lock:
+            checks = list(self._checks.items())
+
+        ready = not self.draining
+        results = {}
+        for name, check in checks:
+            try:
+                ok, details = check()
+            except Exception as e:
+                ok, details = False, {'error': str(e)}
+            results[name] = dict(details or {}, ready=ok)
+            ready = ready and ok
+        return ready, results
+
+def _check_database():
+    conn = get_db_connection()
+    try:
+        conn.execute('SELECT 1').fetchone()
+    finally:
+        conn.close()
+    # Uso do pool de conexões deste processo (reused = conexões reaproveitadas)
+    return True, {'pool': get_pool_stats()}
+
+# Registro compartilhado pelo processo
+health = HealthRegistry()
@@ -0,0 +1,103 @@
+import threading
+import time
+import hashlib
+from collections import OrderedDict
+from config import Config
+from database import get_db_connection, bump_version
+
+# Dados dos usuários que não afetam o roteamento (último login, ver
+# /api/users); criações incrementam a versão `routing` (routing.py)
+USERS_VERSION_KEY = 'users'
+
+class VersionCache:
+    """
+    Cópia em memória dos contadores de versão da tabela meta, usada para
+    montar os ETags das respostas da API sem consultar o banco a cada
+    requisição.
+
+    A cópia é relida no máximo a cada RESPONSE_VERSION_INTERVAL segundos:
+    escritas feitas em outros processos (SMTP, CLI, outros workers) podem
+    levar esse tempo para invalidar as respostas deste processo.
+    """
+
+    def __init__(self, refresh_interval=None):
+        self.refresh_interval = (Config.RESPONSE_VERSION_INTERVAL
+                                 if refresh_interval is None else refresh_interval)
+        self._versions = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if self._versions is not None and now - self._checked_at < self.refresh_interval:
+            return
+
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT key, value FROM meta')
+        versions = {row['key']: row['value'] for row in cursor.fetchall()}
+        conn.close()
+
+        with self._lock:
+            self._versions = versions
+            self._checked_at = now
+
+    def get(self, keys):
+        """Versões atuais das chaves `keys` (0 para as nunca incrementadas)"""
+        self._ensure_fresh()
+        versions = self._versions
+        return tuple(versions.get(key, 0) for key in keys)
+
+    def invalidate(self):
+        """Descarta a cópia; será relida na próxima consulta"""
+        with self._lock:
+            self._versions = None
+
+class ResponseCache:
+    """
+    LRU de corpos de resposta já serializados, indexado por (rota, escopo,
+    versões). Uma escrita muda a versão e, com ela, a chave: entradas
+    antigas nunca são servidas e saem pela ordem de uso. Limitado em
+    quantidade e no tamanho somado dos corpos.
+    """
+
+    def __init__(self, max_items=None, max_bytes=None):
+        self.max_items = Config.RESPONSE_CACHE_ITEMS if max_items is None else max_items
+        self.max_bytes = Config.RESPONSE_CACHE_BYTES if max_bytes is None else max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """(corpo, mimetype) de `key` ou None"""
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                return None
+            self._items.move_to_end(key)
+            return entry
+
+    def put(self, key, body, mimetype):
+        if not self.max_items or len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[0])
+            self._items[key] = (body, mimetype)
+            self._bytes += len(body)
+            while len(self._items) > self.max_items or self._bytes > self.max_bytes:
+                _, (evicted, _) = self._items.popitem(last=False)
+                self._bytes -= len(evicted)
+
+def make_etag(key):
+    """Valor (sem aspas) do ETag de uma chave (rota, escopo, versões)"""
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:24]
+
+# Caches compartilhados pelo processo
+version_cache = VersionCache()
+response_cache = ResponseCache()
+
+def bump_users_version(cursor):
+    """Registra, na transação corrente, que dados de usuários mudaram (último login)"""
+    bump_version(cursor, USERS_VERSION_KEY)
@@ -0,0 +1,212 @@
+import re
+import html
+import threading
+from collections import OrderedDict
+from datetime import timezone
+from config import Config
+
+# O pacote email é importado dentro das funções, no primeiro uso: processos
+# que só importam database (CLI, workers que não abrem mensagens) sobem
+# sem ele. Depois disso cada import é só uma consulta a sys.modules.
+
+_TAGS = re.compile(r'<[^>]+>')
+_SPACES = re.compile(r'\s+')
+
+# Colunas de emails preenchidas a partir dos cabeçalhos (migração 7)
+HEADER_COLUMNS = ('message_id', 'date_header', 'from_header', 'to_header', 'cc_header', 'size', 'snippet')
+
+def header_text(value):
+    """Cabeçalho decodificado (RFC 2047) e sem quebras de linha"""
+    if value is None:
+        return None
+    from email.header import decode_header, make_header
+    try:
+        value = str(make_header(decode_header(str(value))))
+    except (LookupError, ValueError, UnicodeError):
+        value = str(value)
+    return _SPACES.sub(' ', value).strip()
+
+def header_date(value):
+    """Data do cabeçalho Date em UTC ('AAAA-MM-DD HH:MM:SS', como received_at)"""
+    if not value:
+        return None
+    from email.utils import parsedate_to_datetime
+    try:
+        date = parsedate_to_datetime(str(value))
+    except (TypeError, ValueError, IndexError):
+        return None
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return date.strftime('%Y-%m-%d %H:%M:%S')
+
+def _part_text(part):
+    payload = part.get_payload(decode=True)
+    if not payload:
+        return ''
+    charset = part.get_content_charset() or 'utf-8'
+    try:
+        return payload.decode(charset, errors='replace')
+    except LookupError:
+        return payload.decode('utf-8', errors='replace')
+
+def extract_text(msg):
+    """Texto legível de uma mensagem (parte text/plain ou text/html sem tags)"""
+    html_part = None
+    for part in msg.walk():
+        if part.is_multipart() or part.get('Content-Disposition', '').lower().startswith('attachment'):
+            continue
+        content_type = part.get_content_type()
+        if content_type == 'text/plain':
+            text = _part_text(part)
+            break
+        if content_type == 'text/html' and html_part is None:
+            html_part = part
+    else:
+        if html_part is None:
+            return ''
+        text = html.unescape(_TAGS.sub(' ', _part_text(html_part)))
+    return _SPACES.sub(' ', text).strip()[:Config.FTS_MAX_TEXT]
+
+def snippet(text):
+    """Trecho inicial do texto para as listagens"""
+    return text[:Config.SNIPPET_LENGTH] if text else ''
+
+def iter_chunks(data, size=64 * 1024):
+    """Percorre bytes ou um sqlite3.Blob em blocos, sem ler tudo de uma vez"""
+    for offset in range(0, len(data), size):
+        yield data[offset:offset + size]
+
+def parse_bytes(data, policy=None):
+    """
+    Analisa bytes ou um sqlite3.Blob (policy compat32 por padrão); o Blob é
+    lido em blocos pelo BytesFeedParser, sem uma cópia intermediária do
+    corpo inteiro.
+    """
+    from email.parser import BytesParser, BytesFeedParser
+    if policy is None:
+        from email.policy import compat32 as policy
+    if isinstance(data, bytes):
+        return BytesParser(policy=policy).parsebytes(data)
+    parser = BytesFeedParser(policy=policy)
+    for chunk in iter_chunks(data):
+        parser.feed(chunk)
+    return parser.close()
+
+def parse_message(data):
+    """
+    Analisa a fonte RFC822 uma única vez (policy compat32, bem mais barata
+    que a default) e devolve o assunto, o texto indexável e as colunas de
+    HEADER_COLUMNS.
+    """
+    return message_fields(parse_bytes(data), len(data))
+
+def message_fields(msg, size):
+    """Campos de parse_message() de uma mensagem já analisada (compat32)"""
+    text = extract_text(msg)
+    return {
+        'subject': header_text(msg['Subject']),
+        'text': text,
+        'message_id': header_text(msg['Message-ID']),
+        'date_header': header_date(msg['Date']),
+        'from_header': header_text(msg['From']),
+        'to_header': header_text(msg['To']),
+        'cc_header': header_text(msg['Cc']),
+        'size': size,
+        'snippet': snippet(text),
+    }
+
+def message_text(body, status='received'):
+    """
+    Texto indexável do corpo de um email (str ou bytes): fonte RFC822 para
+    emails recebidos, texto simples para os enviados pelo painel.
+    """
+    if not body:
+        return ''
+    if status != 'received':
+        if isinstance(body, bytes):
+            # Até 4 bytes UTF-8 por caractere
+            body = body[:Config.FTS_MAX_TEXT * 4].decode('utf-8', errors='replace')
+        return body[:Config.FTS_MAX_TEXT]
+    if isinstance(body, str):
+        from email.parser import Parser
+        from email.policy import compat32
+        msg = Parser(policy=compat32).parsestr(body)
+    else:
+        msg = parse_bytes(body)
+    return extract_text(msg)
+
+class MessageCache:
+    """
+    LRU de mensagens já analisadas (árvore MIME completa), usado apenas
+    quando a API pede as partes de um email. Limitado em quantidade e no
+    tamanho somado das fontes.
+    """
+    
+    def __init__(self, max_items=None, max_bytes=None):
+        self.max_items = max_items or Config.MIME_CACHE_ITEMS
+        self.max_bytes = max_bytes or Config.MIME_CACHE_BYTES
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+    
+    def get(self, key, source):
+        """
+        Mensagem analisada de `key`; `source()` fornece a fonte se faltar
+        (str, bytes ou um sqlite3.Blob, que é fechado após a análise)
+        """
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None:
+                self._items.move_to_end(key)
+                return entry[0]
+        
+        from email.policy import default
+        data = source()
+        if isinstance(data, str):
+            data = data.encode('utf-8', errors='surrogateescape')
+        try:
+            length = len(data)
+            msg = parse_bytes(data, policy=default)
+        finally:
+            if not isinstance(data, bytes):
+                data.close()
+        
+        with self._lock:
+            if key not in self._items and length <= self.max_bytes:
+                self._items[key] = (msg, length)
+                self._bytes += length
+                while len(self._items) > self.max_items or self._bytes > self.max_bytes:
+                    _, (_, size) = self._items.popitem(last=False)
+                    self._bytes -= size
+        return msg
+    
+    def invalidate(self, key):
+        with self._lock:
+            entry = self._items.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+
+def message_parts(msg):
+    """Descrição das partes folha de uma mensagem (sem o conteúdo)"""
+    parts = []
+    for index, part in enumerate(part for part in msg.walk() if not part.is_multipart()):
+        payload = part.get_payload(decode=True) or b''
+        parts.append({
+            'index': index,
+            'content_type': part.get_content_type(),
+            'charset': part.get_content_charset(),
+            'filename': part.get_filename(),
+            'disposition': part.get_content_disposition(),
+            'size': len(payload),
+        })
+    return parts
+
+def message_part(msg, index):
+    """Parte folha `index` (ou None)"""
+    for position, part in enumerate(part for part in msg.walk() if not part.is_multipart()):
+        if position == index:
+            return part
+    return None
+
+# Cache compartilhado pelo processo
+message_cache = MessageCache()
@@ -0,0 +1,248 @@
+import os
+import re
+import threading
+import logging
+from collections import OrderedDict
+from config import Config
+from database import ConnectionPool, MAIL_MIGRATIONS, run_migrations, get_db_connection
+
+logger = logging.getLogger(__name__)
+
+_SHARD_FILE = re.compile(r'^domain_(\d+)\.db$')
+
+class ShardRouter:
+    """
+    Bancos de emails por domínio (DB_SHARDING): emails, corpos (blobs) e o
+    índice de busca de cada domínio ficam em DB_SHARD_DIR/domain_<id>.db;
+    empresas, domínios, usuários, permissões, resumo diário, eventos e fila
+    de envio continuam no banco principal.
+
+    Cada shard tem seu próprio pool de conexões, aberto na primeira vez que
+    o domínio é acessado. No máximo DB_SHARD_MAX_OPEN pools ficam abertos;
+    o menos usado é aposentado quando outro precisa abrir.
+    """
+
+    def __init__(self, directory=None, max_open=None):
+        self.directory = directory or Config.DB_SHARD_DIR
+        self.max_open = max_open or Config.DB_SHARD_MAX_OPEN
+        self._pools = OrderedDict()  # domain_id -> ConnectionPool
+        self._migrated = set()  # caminhos com o esquema já verificado neste processo
+        self._inherited = []
+        self._lock = threading.Lock()
+
+    def path(self, domain_id):
+        """Arquivo do banco de emails do domínio"""
+        return os.path.join(self.directory, f'domain_{int(domain_id)}.db')
+
+    def pool(self, domain_id):
+        """Pool de conexões do shard do domínio (aberto sob demanda)"""
+        with self._lock:
+            pool = self._pools.get(domain_id)
+            if pool is not None:
+                self._pools.move_to_end(domain_id)
+                return pool
+
+            path = self.path(domain_id)
+            pool = ConnectionPool(path, Config.DB_SHARD_POOL_SIZE)
+            if path not in self._migrated:
+                os.makedirs(self.directory, exist_ok=True)
+                conn = pool.acquire()
+                try:
+                    run_migrations(conn, MAIL_MIGRATIONS)
+                finally:
+                    conn.close()
+                self._migrated.add(path)
+
+            self._pools[domain_id] = pool
+            if len(self._pools) > self.max_open:
+                _, evicted = self._pools.popitem(last=False)
+                evicted.retire()
+            return pool
+
+    def connection(self, domain_id):
+        """Empresta uma conexão do shard do domínio; close() a devolve"""
+        return self.pool(domain_id).acquire()
+
+    def domains(self):
+        """Ids dos domínios que já têm banco de emails, em ordem"""
+        if not os.path.isdir(self.directory):
+            return []
+        matches = (_SHARD_FILE.match(name) for name in os.listdir(self.directory))
+        return sorted(int(match.group(1)) for match in matches if match)
+
+    def close_all(self):
+        """Fecha as conexões ociosas de todos os shards abertos"""
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools.clear()
+        for pool in pools:
+            pool.retire()
+
+    def stats(self):
+        """Shards abertos e o uso somado dos pools"""
+        with self._lock:
+            pools = list(self._pools.values())
+        in_use = sum(pool.stats()['in_use'] for pool in pools)
+        return {'open': len(pools), 'max_open': self.max_open, 'in_use': in_use}
+
+    def _after_fork(self):
+        # Como em database._reset_pool_after_fork: os pools herdados são
+        # guardados, nunca fechados, para não soltar os locks do pai
+        self._inherited.extend(self._pools.values())
+        self._pools = OrderedDict()
+        self._lock = threading.Lock()
+
+# Shards compartilhados pelo processo
+shard_router = ShardRouter()
+os.register_at_fork(after_in_child=shard_router._after_fork)
+
+def is_sharded(domain_id):
+    """True se os emails do domínio ficam em um shard próprio"""
+    return Config.DB_SHARDING and domain_id is not None
+
+def get_mail_connection(domain_id):
+    """
+    Conexão do banco que guarda os emails do domínio: o shard com
+    DB_SHARDING, senão o banco principal. Chame close() para devolvê-la.
+    """
+    if not is_sharded(domain_id):
+        return get_db_connection()
+    return shard_router.connection(domain_id)
+
+class DeferredCursor:
+    """Acumula comandos (execute) para executá-los depois, em replay()"""
+
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, sql, parameters=()):
+        self.statements.append((sql, parameters))
+        return self
+
+    def replay(self, cursor):
+        for sql, parameters in self.statements:
+            cursor.execute(sql, parameters)
+        self.statements = []
+
+class MailTransaction:
+    """
+    Gravação de emails que pode tocar vários bancos: `control` é o cursor
+    do banco principal (resumo diário, versões, eventos, fila de envio) e
+    mail(domain_id) o do banco de emails do domínio.
+
+    Sem DB_SHARDING, mail() devolve o próprio `control` e tudo é uma única
+    transação. Com shards, commit() efetiva primeiro os shards e depois o
+    banco principal: uma falha entre os dois pode deixar emails gravados
+    sem o evento e os contadores, nunca o contrário.
+
+    Para não haver espera circular entre processos, grave sempre nos shards
+    antes do banco principal e nos shards em ordem crescente de domain_id.
+    Com `defer_control` (lotes com vários domínios), os comandos de
+    `control` só são executados no commit(), depois dos shards: o lock de
+    escrita do banco principal fica preso só por essa transação curta.
+    """
+
+    def __init__(self, conn=None, defer_control=False):
+        self._owned = conn is None
+        self._conn = get_db_connection() if conn is None else conn
+        self.control = self._conn.cursor()
+        if defer_control and Config.DB_SHARDING:
+            self.control = DeferredCursor()
+        self._shards = {}  # domain_id -> (conexão, cursor)
+
+    def mail(self, domain_id):
+        """Cursor para os emails do domínio"""
+        if not is_sharded(domain_id):
+            return self.control
+        entry = self._shards.get(domain_id)
+        if entry is None:
+            conn = shard_router.connection(domain_id)
+            entry = self._shards[domain_id] = (conn, conn.cursor())
+        return entry[1]
+
+    def commit(self):
+        for conn, _ in self._shards.values():
+            conn.commit()
+        if isinstance(self.control, DeferredCursor):
+            self.control.replay(self._conn.cursor())
+        self._conn.commit()
+
+    def rollback(self):
+        for conn, _ in self._shards.values():
+            conn.rollback()
+        if isinstance(self.control, DeferredCursor):
+            self.control.statements = []
+        self._conn.rollback()
+
+    def close(self):
+        """Devolve as conexões (o que não foi efetivado é desfeito)"""
+        for conn, _ in self._shards.values():
+            conn.close()
+        self._shards = {}
+        if self._owned:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def migrate_domain(domain_id):
+    """
+    Copia os emails do domínio do banco principal para o shard e os remove
+    do principal (cli.py mail-shards --migrate). Os ids são preservados: a
+    fila de envio e os eventos os referenciam. Pode ser repetida, a cópia
+    ignora os emails que já estão no shard. Retorna a quantidade copiada.
+    Depois de migrar os domínios, chame prune_control_mail().
+    """
+    conn = shard_router.connection(domain_id)
+    try:
+        conn.execute('ATTACH DATABASE ? AS control', (os.path.abspath(Config.DB_PATH),))
+        try:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            # Mesma ordem de colunas nos dois esquemas (ver MAIL_MIGRATIONS)
+            cursor.execute('''
+            INSERT OR IGNORE INTO emails SELECT * FROM control.emails WHERE domain_id = ?
+            ''', (domain_id,))
+            copied = cursor.rowcount
+            cursor.execute('''
+            INSERT OR IGNORE INTO blobs (hash, size, data)
+            SELECT b.hash, b.size, b.data FROM control.blobs b
+            WHERE b.hash IN (SELECT body_hash FROM control.emails WHERE domain_id = ?)
+            ''', (domain_id,))
+            cursor.execute("INSERT INTO emails_fts (emails_fts) VALUES ('rebuild')")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.execute('DETACH DATABASE control')
+    finally:
+        conn.close()
+
+    control = get_db_connection()
+    try:
+        control.execute('DELETE FROM emails WHERE domain_id = ?', (domain_id,))
+        control.commit()
+    finally:
+        control.close()
+    return copied
+
+def prune_control_mail():
+    """
+    Descarta do banco principal os corpos sem email e reconstrói o índice de
+    busca dele, depois de migrate_domain(). O espaço só volta ao disco com
+    VACUUM.
+    """
+    conn = get_db_connection()
+    try:
+        conn.execute('''
+        DELETE FROM blobs
+        WHERE hash NOT IN (SELECT body_hash FROM emails WHERE body_hash IS NOT NULL)
+        ''')
+        conn.execute("INSERT INTO emails_fts (emails_fts) VALUES ('rebuild')")
+        conn.commit()
+    finally:
+        conn.close()
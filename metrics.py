@@ -0,0 +1,282 @@
+import os
+import json
+import time
+import bisect
+import threading
+import logging
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Limites (em segundos) dos histogramas de latência
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Limites (em bytes) do histograma de tamanho das mensagens
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+class Counter:
+    """Contador monotônico com rótulos"""
+    
+    kind = 'counter'
+    
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+    
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+    
+    def snapshot(self):
+        with self._lock:
+            return [[list(labels), value] for labels, value in self._values.items()]
+
+class Histogram:
+    """Histograma com limites fixos (acumulados só na exportação)"""
+    
+    kind = 'histogram'
+    
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                # contagens por faixa (+Inf no fim), soma
+                series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+    
+    def time(self, *labels):
+        """Context manager que observa a duração do bloco"""
+        return _Timer(self, labels)
+    
+    def snapshot(self):
+        with self._lock:
+            return [[list(labels), [list(counts), total]] for labels, (counts, total) in self._values.items()]
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+    
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+class Registry:
+    """
+    Métricas do processo.
+    
+    Os valores ficam em memória; cada processo (worker web, servidor SMTP,
+    shards) grava periodicamente um snapshot em METRICS_DIR e /metrics
+    soma os snapshots de todos os processos vivos ao do processo atual.
+    """
+    
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._dumper = None
+    
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+    
+    def counter(self, name, help, labels=()):
+        return self._register(Counter(name, help, labels))
+    
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help, labels, buckets))
+    
+    def snapshot(self):
+        """Estado atual serializável em JSON"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        snapshot = {}
+        for metric in metrics:
+            entry = {
+                'type': metric.kind,
+                'help': metric.help,
+                'labels': list(metric.labels),
+                'values': metric.snapshot()
+            }
+            if metric.kind == 'histogram':
+                entry['buckets'] = list(metric.buckets)
+            snapshot[metric.name] = entry
+        return snapshot
+    
+    def dump(self, path=None):
+        """Grava o snapshot (troca atômica do arquivo)"""
+        path = path or self.dump_path()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'pid': os.getpid(), 'time': time.time(), 'metrics': self.snapshot()}, f)
+        os.replace(tmp, path)
+    
+    def dump_path(self, role=None):
+        return os.path.join(Config.METRICS_DIR, f'{role or "process"}-{os.getpid()}.json')
+    
+    def start_dumper(self, role):
+        """Grava o snapshot em METRICS_DIR a cada METRICS_DUMP_INTERVAL"""
+        if self._dumper is not None and self._dumper[0] == os.getpid():
+            return
+        path = self.dump_path(role)
+        stopping = threading.Event()
+        
+        def run():
+            while not stopping.wait(Config.METRICS_DUMP_INTERVAL):
+                try:
+                    self.dump(path)
+                except OSError as e:
+                    logger.error(f"Erro ao gravar métricas em {path}: {str(e)}")
+        
+        thread = threading.Thread(target=run, daemon=True, name="MetricsDumper")
+        thread.start()
+        self._dumper = (os.getpid(), path, stopping)
+    
+    def stop_dumper(self):
+        """Para o dumper deste processo e remove o snapshot dele"""
+        if self._dumper is None or self._dumper[0] != os.getpid():
+            return
+        _, path, stopping = self._dumper
+        self._dumper = None
+        stopping.set()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    
+    def _load_dumps(self):
+        """Snapshots gravados pelos outros processos vivos"""
+        try:
+            names = os.listdir(Config.METRICS_DIR)
+        except FileNotFoundError:
+            return []
+        
+        snapshots = []
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(Config.METRICS_DIR, name)
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            pid = data.get('pid')
+            if pid == os.getpid():
+                continue
+            if not _alive(pid):
+                # Processo encerrado: o arquivo não é mais atualizado
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            snapshots.append(data['metrics'])
+        return snapshots
+    
+    def render(self, include_dumps=True):
+        """Métricas no formato texto do Prometheus"""
+        merged = self.snapshot()
+        if include_dumps:
+            for snapshot in self._load_dumps():
+                _merge(merged, snapshot)
+        
+        lines = []
+        for name in sorted(merged):
+            entry = merged[name]
+            lines.append(f'# HELP {name} {entry["help"]}')
+            lines.append(f'# TYPE {name} {entry["type"]}')
+            labels = entry['labels']
+            for values, value in entry['values']:
+                base = list(zip(labels, values))
+                if entry['type'] == 'counter':
+                    lines.append(f'{name}{_labels(base)} {value}')
+                    continue
+                counts, total = value
+                cumulative = 0
+                for bound, count in zip(entry['buckets'] + ['+Inf'], counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_labels(base + [("le", bound)])} {cumulative}')
+                lines.append(f'{name}_sum{_labels(base)} {total}')
+                lines.append(f'{name}_count{_labels(base)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+def _alive(pid):
+    if not isinstance(pid, int):
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _merge(target, snapshot):
+    """Soma `snapshot` em `target` (mesmo formato de Registry.snapshot)"""
+    for name, entry in snapshot.items():
+        current = target.get(name)
+        if current is None:
+            target[name] = entry
+            continue
+        if current['type'] != entry['type'] or current.get('buckets') != entry.get('buckets'):
+            continue
+        values = {tuple(labels): value for labels, value in current['values']}
+        for labels, value in entry['values']:
+            key = tuple(labels)
+            if key not in values:
+                values[key] = value
+            elif entry['type'] == 'counter':
+                values[key] = values[key] + value
+            else:
+                counts, total = values[key]
+                values[key] = [[a + b for a, b in zip(counts, value[0])], total + value[1]]
+        current['values'] = [[list(labels), value] for labels, value in values.items()]
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    escaped = []
+    for key, value in pairs:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{key}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+# Registro compartilhado pelo processo
+registry = Registry()
+
+# Métricas usadas pelos módulos do painel
+SMTP_RCPT_SECONDS = registry.histogram('smtp_rcpt_seconds', 'Duração do RCPT TO', ['code'])
+SMTP_DATA_SECONDS = registry.histogram('smtp_data_seconds', 'Duração do DATA (inclui a gravação)', ['code'])
+SMTP_REFUSED = registry.counter('smtp_refused_total', 'Conexões e mensagens recusadas pelo controle de admissão', ['reason'])
+SMTP_RECIPIENTS = registry.counter('smtp_recipients_total', 'Destinatários gravados pelo EmailHandler')
+SMTP_SHARD_RESTARTS = registry.counter('smtp_shard_restarts_total', 'Shards SMTP reiniciados pelo supervisor')
+SMTP_MESSAGE_BYTES = registry.histogram('smtp_message_bytes', 'Tamanho das mensagens recebidas', buckets=SIZE_BUCKETS)
+HTTP_REQUEST_SECONDS = registry.histogram('http_request_seconds', 'Duração das requisições HTTP', ['endpoint', 'method'])
+HTTP_RESPONSES = registry.counter('http_responses_total', 'Respostas HTTP por status', ['endpoint', 'method', 'status'])
+DB_QUERY_SECONDS = registry.histogram('db_query_seconds', 'Duração do execute() das consultas SQLite', ['statement'])
+PASSWORD_SECONDS = registry.histogram('password_seconds', 'Duração das operações bcrypt', ['operation'])
+PASSWORD_REJECTED = registry.counter('password_rejected_total', 'Verificações recusadas com a fila cheia')
+SMTP_SEND_SECONDS = registry.histogram('smtp_send_seconds', 'Duração dos envios ao relay', ['mode', 'outcome'])
@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+import logging
+from collections import deque
+from config import Config
+from metrics import PASSWORD_SECONDS, PASSWORD_REJECTED
+
+logger = logging.getLogger(__name__)
+
+class PasswordServiceBusy(Exception):
+    """A fila de verificação de senhas está cheia"""
+
+def _to_bytes(value):
+    return value.encode('utf-8') if isinstance(value, str) else value
+
+# bcrypt e o pool de processos são importados no primeiro uso: o painel,
+# o SMTP e o CLI sobem sem eles (ver bench/startup.py)
+
+def hash_password(password, rounds=None):
+    """Gera o hash bcrypt da senha no processo atual (CLI)"""
+    import bcrypt
+    return bcrypt.hashpw(_to_bytes(password), bcrypt.gensalt(rounds or Config.BCRYPT_ROUNDS))
+
+def check_password(password, password_hash):
+    """Compara a senha com o hash bcrypt no processo atual"""
+    import bcrypt
+    return bcrypt.checkpw(_to_bytes(password), _to_bytes(password_hash))
+
+def hash_rounds(password_hash):
+    """Custo (log2 das rodadas) de um hash bcrypt, ex.: $2b$12$... -> 12"""
+    try:
+        return int(_to_bytes(password_hash).split(b'$')[2])
+    except (IndexError, ValueError):
+        return 0
+
+class PasswordService:
+    """
+    Verificação e geração de hashes bcrypt em um pool de processos.
+    
+    O bcrypt é propositalmente caro; rodá-lo nas threads do Flask faz uma
+    rajada de logins travar as demais rotas. Aqui ele roda em até
+    PASSWORD_WORKERS processos, com no máximo PASSWORD_QUEUE_LIMIT pedidos
+    pendentes: acima disso o pedido falha na hora com PasswordServiceBusy.
+    Os dois limites são por processo; com os workers prefork de
+    web_server.py o total é WEB_WORKERS vezes cada um.
+    """
+    
+    def __init__(self, workers=None, queue_limit=None):
+        self.workers = workers or Config.PASSWORD_WORKERS
+        self.queue_limit = queue_limit or Config.PASSWORD_QUEUE_LIMIT
+        self._executor = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._latencies = deque(maxlen=1024)
+        self._stats = {
+            'verifications': 0,
+            'failures': 0,
+            'hashes': 0,
+            'rejected': 0,
+            'seconds_total': 0.0,
+            'seconds_max': 0.0,
+        }
+    
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                from concurrent.futures import ProcessPoolExecutor
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+    
+    def _run(self, fn, *args):
+        with self._lock:
+            if self._in_flight >= self.queue_limit:
+                self._stats['rejected'] += 1
+                PASSWORD_REJECTED.inc()
+                raise PasswordServiceBusy()
+            self._in_flight += 1
+        try:
+            future = self._get_executor().submit(fn, *args)
+            return future.result(timeout=Config.PASSWORD_TIMEOUT)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+    
+    def verify(self, password, password_hash):
+        """Verifica a senha; levanta PasswordServiceBusy se a fila estiver cheia"""
+        start = time.perf_counter()
+        ok = self._run(check_password, password, password_hash)
+        elapsed = time.perf_counter() - start
+        PASSWORD_SECONDS.observe(elapsed, 'verify')
+        
+        with self._lock:
+            self._stats['verifications'] += 1
+            if not ok:
+                self._stats['failures'] += 1
+            self._stats['seconds_total'] += elapsed
+            self._stats['seconds_max'] = max(self._stats['seconds_max'], elapsed)
+            self._latencies.append(elapsed)
+        
+        return ok
+    
+    def hash(self, password):
+        """Gera o hash da senha com o custo atual (BCRYPT_ROUNDS)"""
+        with PASSWORD_SECONDS.time('hash'):
+            password_hash = self._run(hash_password, password, Config.BCRYPT_ROUNDS)
+        with self._lock:
+            self._stats['hashes'] += 1
+        return password_hash
+    
+    def needs_rehash(self, password_hash):
+        """Indica se o hash foi gerado com custo menor que BCRYPT_ROUNDS"""
+        return hash_rounds(password_hash) < Config.BCRYPT_ROUNDS
+    
+    def stats(self):
+        """Contadores e latência das verificações (em segundos)"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = self._in_flight
+            latencies = sorted(self._latencies)
+        
+        stats['workers'] = self.workers
+        stats['queue_limit'] = self.queue_limit
+        if latencies:
+            stats['seconds_p50'] = latencies[len(latencies) // 2]
+            stats['seconds_p99'] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        return stats
+    
+    def _after_fork(self):
+        # O pool de processos do pai não pode ser usado no filho
+        self._executor = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+    
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+# Serviço compartilhado pelo processo
+password_service = PasswordService()
+os.register_at_fork(after_in_child=password_service._after_fork)
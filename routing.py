@@ -0,0 +1,92 @@
+import threading
+import time
+import logging
+from config import Config
+from database import get_db_connection, bump_version, get_version
+
+logger = logging.getLogger(__name__)
+
+ROUTING_VERSION_KEY = 'routing'
+
+class RoutingIndex:
+    """
+    Índice em memória de roteamento de emails: domínio -> domain_id e
+    endereço -> user_id.
+
+    É carregado uma vez e recarregado quando invalidado. Alterações feitas em
+    outros processos (painel, CLI) são percebidas pelo contador de versão
+    `routing` da tabela meta, consultado no máximo a cada
+    ROUTING_REFRESH_INTERVAL segundos.
+    """
+
+    def __init__(self, refresh_interval=None):
+        self.refresh_interval = (Config.ROUTING_REFRESH_INTERVAL
+                                 if refresh_interval is None else refresh_interval)
+        self._domains = {}
+        self._users = {}
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Carrega (ou recarrega) o índice a partir do banco"""
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        version = get_version(cursor, ROUTING_VERSION_KEY)
+
+        cursor.execute('SELECT id, domain_name FROM domains')
+        domains = {row['domain_name'].lower(): row['id'] for row in cursor.fetchall()}
+
+        cursor.execute('SELECT id, email FROM users')
+        users = {row['email'].lower(): row['id'] for row in cursor.fetchall()}
+
+        conn.close()
+
+        with self._lock:
+            self._domains = domains
+            self._users = users
+            self._version = version
+            self._checked_at = time.monotonic()
+
+        logger.info(f"Índice de roteamento carregado: {len(domains)} domínios, {len(users)} usuários")
+
+    def invalidate(self):
+        """Descarta o índice; ele será recarregado na próxima consulta"""
+        with self._lock:
+            self._version = None
+
+    def _ensure_fresh(self):
+        if self._version is None:
+            self.load()
+            return
+
+        now = time.monotonic()
+        if now - self._checked_at < self.refresh_interval:
+            return
+
+        conn = get_db_connection()
+        version = get_version(conn.cursor(), ROUTING_VERSION_KEY)
+        conn.close()
+
+        if version != self._version:
+            self.load()
+        else:
+            self._checked_at = now
+
+    def lookup_domain(self, domain):
+        """Retorna o domain_id do domínio ou None"""
+        self._ensure_fresh()
+        return self._domains.get(domain.lower())
+
+    def lookup_user(self, address):
+        """Retorna o user_id do endereço ou None"""
+        self._ensure_fresh()
+        return self._users.get(address.lower())
+
+# Índice compartilhado pelo processo
+routing_index = RoutingIndex()
+
+def bump_routing_version(cursor):
+    """Registra, na transação corrente, que domínios ou usuários mudaram"""
+    bump_version(cursor, ROUTING_VERSION_KEY)
@@ -3,7 +3,6 @@ import subprocess
 import sys
 import time
 import threading
-import asyncio
 import logging
 
 # Configurar logging
@@ -13,28 +12,30 @@ logger = logging.getLogger(__name__)
 def run_flask():
     """Executa o servidor Flask"""
     try:
-        logger.info("🌐 Iniciando painel web na porta 5000...")
-        subprocess.run([sys.executable, 'app.py'])
+        from config import Config
+        logger.info(f"🌐 Iniciando painel web na porta {Config.WEB_PORT}...")
+        # Servidor prefork em processo próprio (web_server.py)
+        subprocess.run([sys.executable, 'web_server.py'])
     except KeyboardInterrupt:
         logger.info("Parando servidor web...")
     except Exception as e:
         logger.error(f"Erro no servidor Flask: {str(e)}")
 
-def run_email_server():
+def run_email_server(ready):
     """Executa servidor de email em uma thread separada"""
     try:
         # Importar aqui para evitar problemas de importação circular
         from email_handler import start_email_server
-        start_email_server()
+        start_email_server(ready)
     except Exception as e:
         logger.error(f"Erro no servidor de email: {str(e)}")
 
-def check_port_25():
-    """Verifica se podemos acessar a porta 25"""
+def check_smtp_port(port):
+    """Verifica se podemos acessar a porta do SMTP"""
     import socket
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     try:
-        sock.bind(('0.0.0.0', 25))
+        sock.bind(('0.0.0.0', port))
         sock.close()
         return True
     except OSError:
@@ -46,21 +47,46 @@ def main():
     print("🚀 Iniciando Painel de Controle do Servidor")
     print("=" * 60)
     
-    # Verificar porta 25
-    if not check_port_25():
-        logger.error("❌ Porta 25 não disponível. Execute como root ou configure permissões.")
-        logger.error("   sudo setcap 'cap_net_bind_service=+ep' $(which python3)")
+    from config import Config
+    
+    # Verificar a porta do SMTP. Os shards (SO_REUSEPORT) e o runtime
+    # unificado abrem a porta eles mesmos e informam a falha ao iniciar
+    if Config.SMTP_SHARDS <= 1 and Config.RUNTIME != 'unified':
+        if not check_smtp_port(Config.SMTP_PORT):
+            logger.error(f"❌ Porta {Config.SMTP_PORT} não disponível. Execute como root ou configure permissões.")
+            logger.error("   sudo setcap 'cap_net_bind_service=+ep' $(which python3)")
+            return
+        
+        logger.info(f"✅ Porta {Config.SMTP_PORT} disponível")
+    
+    if Config.RUNTIME == 'unified':
+        # SMTP, painel e fila de envio em um único processo (runtime.py)
+        from runtime import UnifiedRuntime
+        logger.info("🧩 Runtime unificado: SMTP e painel web no mesmo processo")
+        UnifiedRuntime().run()
         return
     
-    logger.info("✅ Porta 25 disponível")
+    # Preparar o banco antes de iniciar os serviços
+    from database import init_db
+    init_db()
     
     # Iniciar servidor de email em thread separada
     logger.info("📧 Iniciando servidor de email...")
-    email_thread = threading.Thread(target=run_email_server, daemon=True, name="EmailServer")
+    smtp_ready = threading.Event()
+    email_thread = threading.Thread(target=run_email_server, args=(smtp_ready,), daemon=True, name="EmailServer")
     email_thread.start()
     
-    # Aguardar inicialização
-    time.sleep(3)
+    # Iniciar workers da fila de envio
+    from delivery import DeliveryWorkerPool
+    delivery_pool = DeliveryWorkerPool()
+    delivery_pool.start()
+    
+    # Aguardar o SMTP escutar (ou a thread terminar com erro)
+    deadline = time.monotonic() + Config.SMTP_STARTUP_TIMEOUT
+    while not smtp_ready.wait(0.05):
+        if not email_thread.is_alive() or time.monotonic() >= deadline:
+            logger.error("❌ Servidor de email não iniciou; seguindo com o painel web")
+            break
     
     # Iniciar servidor Flask
     logger.info("🌐 Iniciando painel web...")
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+import sys
+import time
+import signal
+import logging
+import threading
+from werkzeug.serving import ThreadedWSGIServer
+from config import Config
+from health import health
+
+logger = logging.getLogger(__name__)
+
+class RuntimeWSGIServer(ThreadedWSGIServer):
+    """
+    Servidor HTTP do runtime unificado: uma thread por requisição (os
+    streams de /api/events inclusive). Conta as requisições em andamento
+    para que o encerramento espere por elas.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.active = 0
+        self._idle = threading.Condition()
+
+    def process_request(self, request, client_address):
+        # Contada antes de a thread existir, para wait_idle() não perdê-la
+        with self._idle:
+            self.active += 1
+        try:
+            super().process_request(request, client_address)
+        except Exception:
+            self._finished()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self._finished()
+
+    def _finished(self):
+        with self._idle:
+            self.active -= 1
+            self._idle.notify_all()
+
+    def wait_idle(self, timeout):
+        """Aguarda as requisições em andamento; False se o prazo acabar"""
+        with self._idle:
+            return self._idle.wait_for(lambda: self.active == 0, timeout)
+
+class UnifiedRuntime:
+    """
+    SMTP, painel web e fila de envio em um único processo (RUNTIME=unified).
+
+    Os dois lados compartilham o pool de conexões, o índice de roteamento,
+    os caches de permissões e de respostas, o barramento de eventos e as
+    métricas: um domínio criado pelo painel é roteado pelo SMTP na hora, e
+    os emails gravados pelo EmailWriter acordam os streams de /api/events
+    sem esperar o polling. O banco é preparado uma única vez.
+
+    O HTTP é atendido por threads (RuntimeWSGIServer), não pelos workers
+    prefork de web_server.py, que dividiriam esse estado entre processos.
+    Em SIGTERM/SIGINT, /readyz passa a responder 503, os dois listeners
+    param de aceitar conexões, as requisições e mensagens em andamento
+    terminam (até WEB_GRACEFUL_TIMEOUT segundos) e o EmailWriter grava o que
+    estiver na fila antes de o processo sair.
+    """
+
+    def __init__(self, host=None, web_port=None, smtp_host='0.0.0.0', smtp_port=None):
+        self.host = host or Config.WEB_HOST
+        self.web_port = web_port or Config.WEB_PORT
+        self.smtp_host = smtp_host
+        self.smtp_port = smtp_port or Config.SMTP_PORT
+        self.ready = threading.Event()
+        self.writer = None
+        self.handler = None
+        self.controller = None
+        self.delivery = None
+        self.http = None
+        self._http_thread = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        """Inicia os componentes; retorna com os dois listeners aceitando conexões"""
+        # O app prepara o banco (init_db) para os dois lados
+        from app import app
+        from routing import routing_index
+        from metrics import registry
+        from email_writer import EmailWriter
+        from email_handler import EmailHandler
+        from smtp_admission import AdmissionController
+        from delivery import DeliveryWorkerPool
+
+        if Config.SMTP_SHARDS > 1:
+            logger.warning("SMTP_SHARDS é ignorado no runtime unificado")
+
+        routing_index.load()
+        registry.start_dumper('unified')
+
+        self.writer = EmailWriter()
+        self.writer.start()
+        self.handler = EmailHandler(self.writer)
+        self.controller = AdmissionController(self.handler, hostname=self.smtp_host, port=self.smtp_port)
+        self.controller.start()
+        logger.info(f"✅ Servidor de email iniciado na porta {self.smtp_port}")
+
+        self.delivery = DeliveryWorkerPool()
+        self.delivery.start()
+
+        self.http = RuntimeWSGIServer(self.host, self.web_port, app)
+        self._http_thread = threading.Thread(target=self.http.serve_forever, daemon=True,
+                                             name="WebServer")
+        self._http_thread.start()
+        logger.info(f"🌐 Painel web em http://{self.host}:{self.web_port}")
+
+        health.register('smtp', self._check_smtp)
+        health.register('http', self._check_http)
+        health.register('delivery', self._check_delivery)
+        self.ready.set()
+
+    def run(self):
+        """Executa até SIGTERM/SIGINT e encerra de forma ordenada"""
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+
+        try:
+            self.start()
+            # Espera com prazo: os sinais só são tratados entre as esperas
+            while not self._stopping.wait(1.0):
+                pass
+        finally:
+            self.stop()
+
+    def _handle_stop(self, signum, frame):
+        self._stopping.set()
+
+    def stop(self, timeout=None):
+        """Encerramento ordenado (ver a descrição da classe)"""
+        from events import event_bus
+        from passwords import password_service
+        from metrics import registry
+
+        timeout = Config.WEB_GRACEFUL_TIMEOUT if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        remaining = lambda: max(0.0, deadline - time.monotonic())
+
+        health.draining = True
+        self._stopping.set()
+        logger.info("🛑 Encerrando o runtime...")
+
+        # Parar de aceitar conexões nos dois listeners
+        if self._http_thread is not None:
+            self.http.shutdown()
+        if self.controller is not None and self.controller.server is not None:
+            self.controller.loop.call_soon_threadsafe(self.controller.server.close)
+
+        # Streams de /api/events: o navegador reconecta em outra instância
+        event_bus.close(timeout=1)
+
+        # Requisições e mensagens já recebidas terminam dentro do prazo
+        if self.http is not None and not self.http.wait_idle(remaining()):
+            logger.warning(f"{self.http.active} requisições HTTP não terminaram a tempo")
+        while self.handler is not None and self.handler.in_flight and remaining():
+            time.sleep(0.05)
+        if self.controller is not None:
+            self.controller.stop()
+
+        if self.delivery is not None:
+            self.delivery.stop(remaining())
+        if self.writer is not None:
+            self.writer.stop()
+        password_service.shutdown()
+        registry.stop_dumper()
+
+        for name in ('smtp', 'http', 'delivery'):
+            health.unregister(name)
+        self.ready.clear()
+        logger.info("✅ Runtime encerrado")
+
+    def _check_smtp(self):
+        server = self.controller.server
+        listening = server is not None and server.is_serving()
+        return listening, dict(
+            self.handler.stats,
+            port=self.smtp_port,
+            connections=self.handler.admission.connections,
+            in_flight=self.handler.in_flight,
+            writer_pending=self.writer.pending,
+        )
+
+    def _check_http(self):
+        return self._http_thread.is_alive(), {'port': self.web_port, 'active': self.http.active}
+
+    def _check_delivery(self):
+        alive = self.delivery.alive()
+        return alive == self.delivery.workers, {'workers': alive}
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    UnifiedRuntime().run()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from config import Config
+from smtp_spool import SpoolingSMTP, SpoolingController
+from metrics import SMTP_REFUSED
+
+logger = logging.getLogger(__name__)
+
+class RateLimiter:
+    """
+    Token buckets por chave (IP, remetente): cada chave acumula `rate`
+    fichas por segundo até `burst` e cada mensagem gasta uma. As chaves
+    ficam em um LRU de até `max_keys`; uma chave descartada volta com o
+    balde cheio. rate 0 desliga o limite.
+    """
+
+    def __init__(self, rate, burst, max_keys=None):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys or Config.SMTP_ADMISSION_MAX_KEYS
+        self._buckets = OrderedDict()  # chave -> [fichas, instante]
+
+    def allow(self, key, now=None):
+        if not self.rate:
+            return True
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now]
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+    def __len__(self):
+        return len(self._buckets)
+
+class AdmissionControl:
+    """
+    Controle de admissão da recepção SMTP de um processo: limita as conexões
+    simultâneas (no total e por IP), a taxa de mensagens por IP e por
+    remetente, e recusa com 421 enquanto a fila do EmailWriter passar de
+    SMTP_WRITER_MAX_PENDING gravações. Um cliente que inunda o servidor é
+    contido no MAIL FROM, antes de enviar o corpo. Cada recusa espera
+    SMTP_REFUSAL_DELAY segundos (tarpit) para não virar um laço de comandos
+    ou de reconexões.
+
+    Usado apenas pelo event loop do Controller, sem locks. Com SMTP_SHARDS
+    os limites valem por shard.
+    """
+
+    def __init__(self, writer=None):
+        self.writer = writer
+        self.max_connections = Config.SMTP_MAX_CONNECTIONS
+        self.max_per_peer = Config.SMTP_MAX_CONNECTIONS_PER_IP
+        self.writer_limit = Config.SMTP_WRITER_MAX_PENDING
+        self.refusal_delay = Config.SMTP_REFUSAL_DELAY
+        self.peers = RateLimiter(Config.SMTP_PEER_RATE, Config.SMTP_PEER_BURST)
+        self.senders = RateLimiter(Config.SMTP_SENDER_RATE, Config.SMTP_SENDER_BURST)
+        self.connections = 0
+        # Só IPs com conexões abertas: limitado por max_connections
+        self._peer_connections = {}
+
+    def saturated(self):
+        """True se a fila de gravação passou do limite"""
+        return self.writer is not None and self.writer.pending >= self.writer_limit
+
+    def open(self, peer):
+        """Registra uma conexão de `peer`; retorna a resposta de recusa ou None"""
+        if self.saturated():
+            return self._refuse('busy', '421 4.3.2 Serviço ocupado, tente mais tarde')
+        if self.max_connections and self.connections >= self.max_connections:
+            return self._refuse('connections', '421 4.7.0 Muitas conexões, tente mais tarde')
+        count = self._peer_connections.get(peer, 0)
+        if self.max_per_peer and count >= self.max_per_peer:
+            return self._refuse('peer_connections', '421 4.7.0 Muitas conexões deste endereço')
+        self.connections += 1
+        self._peer_connections[peer] = count + 1
+        return None
+
+    def close(self, peer):
+        """Libera uma conexão registrada por open()"""
+        self.connections -= 1
+        count = self._peer_connections.get(peer, 0) - 1
+        if count > 0:
+            self._peer_connections[peer] = count
+        else:
+            self._peer_connections.pop(peer, None)
+
+    def admit_message(self, peer, sender):
+        """Verifica uma nova transação (MAIL FROM); retorna a resposta de recusa ou None"""
+        if self.saturated():
+            return self._refuse('busy', '421 4.3.2 Serviço ocupado, tente mais tarde')
+        if not self.peers.allow(peer):
+            return self._refuse('peer_rate', '451 4.7.1 Muitas mensagens deste endereço, tente mais tarde')
+        # Remetente nulo (<>, bounces) fica só com o limite do IP
+        if sender and not self.senders.allow(sender.lower()):
+            return self._refuse('sender_rate', '451 4.7.1 Muitas mensagens deste remetente, tente mais tarde')
+        return None
+
+    def _refuse(self, reason, response):
+        SMTP_REFUSED.inc(reason)
+        logger.debug(f"Recusado ({reason}): {response}")
+        return response
+
+class AdmissionSMTP(SpoolingSMTP):
+    """
+    Sessão que passa pelo AdmissionControl do handler (atributo
+    `admission`) ao conectar: acima dos limites de conexões, responde 421 no
+    lugar da saudação (após SMTP_REFUSAL_DELAY) e fecha. A taxa de mensagens é verificada pelo
+    handle_MAIL do handler.
+    """
+
+    async def _handle_client(self):
+        admission = getattr(self.event_handler, 'admission', None)
+        if admission is None:
+            return await super()._handle_client()
+
+        peer = self.session.peer[0] if isinstance(self.session.peer, tuple) else self.session.peer
+        refusal = admission.open(peer)
+        if refusal is not None:
+            try:
+                # A conexão recusada não ocupa vaga; o atraso só segura quem reconecta em laço
+                await asyncio.sleep(admission.refusal_delay)
+                await self.push(refusal)
+            finally:
+                if self.transport is not None:
+                    self.transport.close()
+            return
+
+        try:
+            await super()._handle_client()
+        finally:
+            admission.close(peer)
+
+class AdmissionController(SpoolingController):
+    """SpoolingController cujas sessões passam pelo controle de admissão"""
+
+    def factory(self):
+        return AdmissionSMTP(self.handler, **self.SMTP_kwargs)
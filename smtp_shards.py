@@ -0,0 +1,118 @@
+import multiprocessing
+import signal
+import threading
+import logging
+from config import Config
+from metrics import SMTP_SHARD_RESTARTS
+
+logger = logging.getLogger(__name__)
+
+def run_shard(index, listening, host, port):
+    """
+    Processo de um shard: event loop, EmailHandler e EmailWriter próprios,
+    escutando a porta compartilhada com SO_REUSEPORT.
+    """
+    from email_handler import EmailHandler, ReusePortController
+    from email_writer import EmailWriter
+    from routing import routing_index
+    from metrics import registry
+    
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    
+    routing_index.load()
+    # Cada shard grava o próprio snapshot; /metrics soma todos
+    registry.start_dumper(f'smtp-{index}')
+    
+    writer = EmailWriter()
+    writer.start()
+    
+    handler = EmailHandler(writer)
+    controller = ReusePortController(handler, hostname=host, port=port)
+    controller.start()
+    # Avisa o supervisor que a porta está escutando
+    listening.set()
+    
+    try:
+        # Espera com prazo: o SIGTERM só é tratado entre as esperas
+        while not stopping.wait(1.0):
+            pass
+    finally:
+        controller.stop()
+        writer.stop()
+        registry.stop_dumper()
+
+class ShardSupervisor:
+    """
+    Recepção SMTP em vários processos.
+    
+    Cada shard é um processo com event loop, EmailHandler e EmailWriter
+    próprios; todos escutam a mesma porta com SO_REUSEPORT e o kernel
+    distribui as conexões, de modo que o parsing MIME e a gravação deixam de
+    disputar um único núcleo e um único GIL. O supervisor reinicia shards que
+    caírem (smtp_shard_restarts_total); as métricas de cada shard chegam a
+    /metrics pelo snapshot que ele grava (ver metrics.py).
+    """
+    
+    def __init__(self, shards=None, host='0.0.0.0', port=None):
+        self.shards = shards or Config.SMTP_SHARDS
+        self.host = host
+        self.port = port or Config.SMTP_PORT
+        # spawn: os shards não herdam threads nem conexões do processo pai
+        self._context = multiprocessing.get_context('spawn')
+        # Sinalizado por cada shard quando começa a escutar
+        self._listening = self._context.Event()
+        self._processes = {}
+        self._stopping = threading.Event()
+    
+    def _spawn(self, index):
+        process = self._context.Process(
+            target=run_shard,
+            args=(index, self._listening, self.host, self.port),
+            name=f"SMTPShard-{index}",
+            daemon=True
+        )
+        process.start()
+        self._processes[index] = process
+    
+    def run(self, ready=None):
+        """
+        Inicia os shards e os supervisiona até stop(). `ready` é sinalizado
+        quando o primeiro shard está escutando.
+        """
+        for index in range(self.shards):
+            self._spawn(index)
+        
+        logger.info(f"✅ Servidor de email iniciado na porta {self.port} com {self.shards} shards")
+        
+        try:
+            # Aguardar o primeiro shard escutar (ver run_shard)
+            while ready is not None and not self._stopping.is_set():
+                if self._listening.wait(0.05):
+                    ready.set()
+                    break
+                if not any(process.is_alive() for process in self._processes.values()):
+                    break
+            
+            while not self._stopping.wait(Config.SMTP_RESTART_DELAY):
+                for index, process in list(self._processes.items()):
+                    if process.is_alive():
+                        continue
+                    logger.warning(f"Shard SMTP {index} terminou (código {process.exitcode}); reiniciando")
+                    SMTP_SHARD_RESTARTS.inc()
+                    self._spawn(index)
+        finally:
+            self._shutdown()
+    
+    def stop(self):
+        self._stopping.set()
+    
+    def _shutdown(self):
+        for process in self._processes.values():
+            process.terminate()
+        for process in self._processes.values():
+            process.join(Config.SMTP_GRACEFUL_TIMEOUT)
+            if process.is_alive():
+                process.kill()
+        logger.info("Servidor de email parado")
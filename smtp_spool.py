@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+import tempfile
+import logging
+from email.feedparser import BytesFeedParser
+from email.policy import compat32
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import SMTP, MISSING, _DataState, syntax
+from config import Config
+from mail_parser import message_fields
+
+logger = logging.getLogger(__name__)
+
+class MessageSpool:
+    """
+    Conteúdo de um DATA recebido em fluxo.
+    
+    As linhas vão para um SpooledTemporaryFile (em memória até
+    SMTP_SPOOL_THRESHOLD bytes, depois em disco), o SHA-256 é calculado à
+    medida que chegam e só os primeiros SMTP_PARSE_BYTES alimentam o parser:
+    cabeçalhos e texto saem da mesma passada, sem montar a mensagem inteira
+    na memória. Um anexo depois desse limite não entra na busca.
+    """
+    
+    def __init__(self, threshold=None, parse_limit=None):
+        self.file = tempfile.SpooledTemporaryFile(
+            max_size=threshold or Config.SMTP_SPOOL_THRESHOLD,
+            dir=Config.SMTP_SPOOL_DIR
+        )
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._parser = BytesFeedParser(policy=compat32)
+        self._parse_left = parse_limit or Config.SMTP_PARSE_BYTES
+        self._fields = None
+    
+    def write(self, data):
+        self.file.write(data)
+        self.size += len(data)
+        self._hash.update(data)
+        if self._parse_left > 0:
+            self._parser.feed(data[:self._parse_left])
+            self._parse_left -= len(data)
+    
+    def __len__(self):
+        return self.size
+    
+    @property
+    def digest(self):
+        return self._hash.hexdigest()
+    
+    def parsed(self):
+        """Campos de parse_message() (assunto, texto e HEADER_COLUMNS)"""
+        if self._fields is None:
+            self._fields = message_fields(self._parser.close(), self.size)
+            self._parser = None
+        return self._fields
+    
+    def chunks(self, size=64 * 1024):
+        """Conteúdo em blocos de `size` bytes, do início"""
+        self.file.seek(0)
+        while True:
+            chunk = self.file.read(size)
+            if not chunk:
+                return
+            yield chunk
+    
+    def getvalue(self):
+        """Conteúdo completo (bytes); evite em mensagens grandes"""
+        self.file.seek(0)
+        return self.file.read()
+    
+    def close(self):
+        self.file.close()
+
+class SpoolingSMTP(SMTP):
+    """
+    Sessão SMTP que grava o DATA em um MessageSpool linha a linha em vez de
+    acumular a mensagem em memória. envelope.content passa a ser o spool.
+    
+    O limite data_size_limit (SIZE no EHLO) é aplicado já no MAIL FROM
+    quando o cliente declara SIZE=; durante o DATA, o que passar do limite é
+    descartado à medida que chega e a resposta é 552. Segue o smtp_DATA do
+    aiosmtpd, que não oferece um gancho para o armazenamento das linhas, e
+    usa seus internos (_DataState, _reader, _set_post_data_state): a versão
+    do aiosmtpd está fixada em requirements.txt.
+    """
+    
+    @syntax('DATA')
+    async def smtp_DATA(self, arg):
+        if await self.check_helo_needed():
+            return
+        if await self.check_auth_needed('DATA'):
+            return
+        assert self.envelope is not None
+        if not self.envelope.rcpt_tos:
+            await self.push('503 Error: need RCPT command')
+            return
+        if arg:
+            await self.push('501 Syntax: DATA')
+            return
+        
+        await self.push('354 End data with <CR><LF>.<CR><LF>')
+        spool = MessageSpool()
+        limit = self.data_size_limit
+        num_bytes = 0
+        line_fragments = []
+        state = _DataState.NOMINAL
+        while self.transport is not None:
+            try:
+                line = await self._reader.readuntil(b'\r\n')
+            except asyncio.CancelledError:
+                logger.info('Conexão perdida durante o DATA')
+                spool.close()
+                self._writer.close()
+                raise
+            except asyncio.LimitOverrunError as e:
+                # Linha maior que o limite do StreamReader: descartar
+                if state == _DataState.NOMINAL:
+                    state = _DataState.TOO_LONG
+                line = await self._reader.read(e.consumed)
+            # Um ponto sozinho na linha encerra o DATA
+            if not line_fragments and line == b'.\r\n':
+                break
+            num_bytes += len(line)
+            if state == _DataState.NOMINAL and limit and num_bytes > limit:
+                # Continuar lendo até o fim, sem guardar (RFC 5321 4.2.5)
+                state = _DataState.TOO_MUCH
+            line_fragments.append(line)
+            if line.endswith(b'\r\n'):
+                if state == _DataState.NOMINAL:
+                    line = b''.join(line_fragments)
+                    if len(line) > self.line_length_limit:
+                        state = _DataState.TOO_LONG
+                    else:
+                        # Transparência do ponto (RFC 5321 4.5.2)
+                        spool.write(line[1:] if line.startswith(b'.') else line)
+                line_fragments.clear()
+        
+        if state != _DataState.NOMINAL:
+            spool.close()
+            if state == _DataState.TOO_LONG:
+                await self.push('500 Line too long (see RFC5321 4.5.3.1.6)')
+            else:
+                logger.warning(f"Mensagem recusada: mais de {limit} bytes")
+                await self.push('552 Error: Too much mail data')
+            self._set_post_data_state()
+            return
+        
+        self.envelope.content = spool
+        status = await self._call_handler_hook('DATA')
+        # Se a sessão for cancelada durante o hook o spool não é fechado: o
+        # writer pode ainda estar lendo; o arquivo some quando for coletado
+        spool.close()
+        self._set_post_data_state()
+        await self.push('250 OK' if status is MISSING else status)
+
+class SpoolingController(Controller):
+    """Controller cujas sessões são SpoolingSMTP, limitadas a SMTP_MAX_MESSAGE_SIZE"""
+    
+    def __init__(self, handler, *args, **kwargs):
+        kwargs.setdefault('data_size_limit', Config.SMTP_MAX_MESSAGE_SIZE)
+        super().__init__(handler, *args, **kwargs)
+    
+    def factory(self):
+        return SpoolingSMTP(self.handler, **self.SMTP_kwargs)
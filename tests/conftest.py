@@ -0,0 +1,29 @@
+import os
+import sys
+import socket
+import tempfile
+import pytest
+
+# A Config lê o ambiente na importação: o banco e as métricas dos testes
+# ficam em um diretório temporário antes de qualquer módulo do painel
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix='binpanel-tests-')
+os.environ.update(
+    DB_PATH=os.path.join(WORKDIR, 'binpanel.db'),
+    METRICS_DIR=os.path.join(WORKDIR, 'metrics'),
+    BCRYPT_ROUNDS='4',
+    SMTP_REFUSAL_DELAY='0',
+)
+sys.path.insert(0, ROOT)
+
+@pytest.fixture
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+@pytest.fixture(scope='session', autouse=True)
+def database():
+    """Banco dos testes com o esquema e os dados iniciais"""
+    from database import init_db
+    init_db()
@@ -0,0 +1,46 @@
+import pytest
+from database import get_db_connection, store_blob, blob_digest
+from smtp_spool import MessageSpool
+
+class StaleLookup:
+    """
+    Cursor cuja consulta de existência do blob não o encontra, como quando
+    outro processo grava o mesmo corpo entre o SELECT e o INSERT
+    """
+    
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._stale = False
+    
+    def execute(self, sql, parameters=()):
+        self._stale = sql.startswith('SELECT 1 FROM blobs')
+        return self._cursor.execute(sql, parameters)
+    
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return None if self._stale else row
+    
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+def spool(data):
+    content = MessageSpool()
+    content.write(data)
+    return content
+
+@pytest.mark.parametrize('make_body', [bytes, spool], ids=['bytes', 'spool'])
+def test_concurrent_writer_already_stored_the_blob(make_body):
+    data = f'corpo repetido {make_body.__name__}'.encode()
+    conn = get_db_connection()
+    try:
+        store_blob(conn.cursor(), data)
+        conn.commit()
+        
+        digest = store_blob(StaleLookup(conn.cursor()), make_body(data))
+        conn.commit()
+        
+        assert digest == blob_digest(data)
+        rows = conn.execute('SELECT data FROM blobs WHERE hash = ?', (digest,)).fetchall()
+        assert [bytes(row[0]) for row in rows] == [data]
+    finally:
+        conn.close()
@@ -0,0 +1,26 @@
+import os
+import sys
+import sqlite3
+import subprocess
+from conftest import ROOT
+from database import MIGRATIONS
+
+def run_cli(db_path, *args):
+    env = dict(os.environ, DB_PATH=db_path)
+    return subprocess.run([sys.executable, os.path.join(ROOT, 'cli.py'), *args],
+                          cwd=ROOT, env=env, capture_output=True, text=True)
+
+def test_cli_migrates_before_writing(tmp_path):
+    # Banco sem esquema (ou de antes das migrações): o CLI o atualiza antes
+    # de gravar, sem depender de o servidor ter iniciado uma vez
+    db_path = str(tmp_path / 'antigo.db')
+    sqlite3.connect(db_path).close()
+    
+    result = run_cli(db_path, 'create-domain', '--domain', 'cli.test', '--company', 'CLI',
+                     '--admin-email', 'admin@cli.test', '--admin-password', 'senha')
+    
+    assert result.returncode == 0, result.stderr
+    conn = sqlite3.connect(db_path)
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == MIGRATIONS[-1][0]
+    assert conn.execute("SELECT COUNT(*) FROM domains WHERE domain_name = 'cli.test'").fetchone()[0] == 1
+    conn.close()
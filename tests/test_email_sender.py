@@ -0,0 +1,61 @@
+import pytest
+from aiosmtpd.controller import Controller
+from email_sender import EmailSender
+from database import get_db_connection
+
+class Relay:
+    """Relay SMTP que recusa os destinatários de recusado.test"""
+    
+    def __init__(self):
+        self.delivered = []
+    
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.endswith('@recusado.test'):
+            return '550 Destinatário recusado'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+    
+    async def handle_DATA(self, server, session, envelope):
+        self.delivered.extend(envelope.rcpt_tos)
+        return '250 OK'
+
+@pytest.fixture
+def sender(free_port):
+    conn = get_db_connection()
+    conn.execute("INSERT OR IGNORE INTO domains (domain_name) VALUES ('envio.test')")
+    conn.commit()
+    conn.close()
+    
+    relay = Relay()
+    controller = Controller(relay, hostname='127.0.0.1', port=free_port)
+    controller.start()
+    sender = EmailSender()
+    sender.host, sender.port = '127.0.0.1', free_port
+    sender.bulk_connections = 2
+    yield sender, relay
+    controller.stop()
+
+def test_bulk_results_follow_recipient_order(sender):
+    sender, relay = sender
+    recipients = ['a@destino.test', 'x@recusado.test', 'b@destino.test', 'a@destino.test']
+    
+    results = sender.send_bulk_emails('envio@envio.test', recipients, 'Aviso', 'corpo')
+    
+    assert isinstance(results, list)
+    assert [result['recipient'] for result in results] == recipients
+    assert [result['success'] for result in results] == [True, False, True, True]
+    assert 'error' in results[1]
+    assert sorted(relay.delivered) == sorted(['a@destino.test', 'b@destino.test', 'a@destino.test'])
+    
+    conn = get_db_connection()
+    stored = conn.execute("SELECT recipient FROM emails WHERE subject = 'Aviso' AND status = 'sent'").fetchall()
+    conn.close()
+    assert sorted(row[0] for row in stored) == sorted(relay.delivered)
+
+def test_bulk_unauthorized_sender(sender):
+    sender, relay = sender
+    
+    results = sender.send_bulk_emails('x@desconhecido.test', ['a@destino.test'], 'Aviso', 'corpo')
+    
+    assert results == [{'recipient': 'a@destino.test', 'success': False}]
+    assert relay.delivered == []
@@ -0,0 +1,108 @@
+import asyncio
+import pytest
+import email_writer
+from aiosmtpd.smtp import Envelope
+from email_writer import EmailWriter
+from email_handler import EmailHandler
+from database import get_db_connection
+from routing import routing_index
+
+@pytest.fixture(scope='module')
+def domain_id():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO domains (domain_name) VALUES ('lote.test')")
+    domain_id = cursor.lastrowid
+    cursor.execute('''
+    INSERT INTO users (username, email, password_hash, domain_id) VALUES ('caixa', 'caixa@lote.test', 'x', ?)
+    ''', (domain_id,))
+    conn.commit()
+    conn.close()
+    routing_index.load()
+    return domain_id
+
+@pytest.fixture
+def writer(monkeypatch):
+    """EmailWriter com uma janela longa; registra o tamanho de cada lote gravado"""
+    writer = EmailWriter(batch_size=64, flush_interval_ms=200, lanes=1)
+    writer.flushed = []
+    flush = writer._flush
+    
+    def recording_flush(conn, batch):
+        writer.flushed.append(sum(len(rows) for rows, _, _ in batch))
+        flush(conn, batch)
+    
+    monkeypatch.setattr(writer, '_flush', recording_flush)
+    writer.start()
+    yield writer
+    writer.stop()
+
+def row(domain_id, subject):
+    return ('a@remoto.test', 'caixa@lote.test', subject, f'Subject: {subject}\r\n\r\ncorpo',
+            domain_id, 'received', 'corpo', {}, None)
+
+def stored(subject_prefix):
+    conn = get_db_connection()
+    count = conn.execute('SELECT COUNT(*) FROM emails WHERE subject LIKE ?',
+                         (subject_prefix + '%',)).fetchone()[0]
+    conn.close()
+    return count
+
+def test_concurrent_writes_share_one_commit(writer, domain_id):
+    async def main():
+        return await asyncio.gather(*(writer.write([row(domain_id, f'lote-a {i}')] * (i + 1))
+                                      for i in range(5)))
+    
+    assert asyncio.run(main()) == [1, 2, 3, 4, 5]
+    assert writer.flushed == [15]
+    assert stored('lote-a') == 15
+
+def test_batch_size_caps_a_commit(writer, domain_id):
+    writer.batch_size = 4
+    
+    async def main():
+        return await asyncio.gather(*(writer.write([row(domain_id, f'lote-b {i}')]) for i in range(10)))
+    
+    assert asyncio.run(main()) == [1] * 10
+    assert sum(writer.flushed) == 10
+    assert max(writer.flushed) <= 4
+    assert stored('lote-b') == 10
+
+def test_rows_are_committed_before_the_write_returns(writer, domain_id):
+    async def main():
+        await writer.write([row(domain_id, 'lote-c')])
+        # Outra conexão já enxerga a linha
+        return stored('lote-c')
+    
+    assert asyncio.run(main()) == 1
+
+def test_failed_flush_answers_451_to_every_session(writer, domain_id, monkeypatch):
+    insert_email = email_writer.insert_email
+    
+    def failing_insert(cursor, sender, recipient, subject, *args, **kwargs):
+        if subject == 'lote-d falha':
+            raise RuntimeError('disco cheio')
+        return insert_email(cursor, sender, recipient, subject, *args, **kwargs)
+    
+    monkeypatch.setattr(email_writer, 'insert_email', failing_insert)
+    handler = EmailHandler(writer)
+    
+    def envelope(subject):
+        envelope = Envelope()
+        envelope.mail_from = 'a@remoto.test'
+        envelope.rcpt_tos = ['caixa@lote.test']
+        envelope.content = f'Subject: {subject}\r\n\r\ncorpo\r\n'.encode()
+        return envelope
+    
+    async def main():
+        subjects = ['lote-d 1', 'lote-d falha', 'lote-d 2']
+        return await asyncio.gather(*(handler.handle_DATA(None, None, envelope(subject))
+                                      for subject in subjects))
+    
+    responses = asyncio.run(main())
+    
+    # As três sessões caíram no mesmo lote, desfeito inteiro
+    assert writer.flushed == [3]
+    assert all(response.startswith('451 ') for response in responses)
+    assert stored('lote-d') == 0
+    assert handler.stats['errors'] == 3
@@ -0,0 +1,41 @@
+import pytest
+from flask_jwt_extended import decode_token
+from app import app
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+@pytest.fixture
+def access_token(client):
+    response = client.post('/api/login', json={'username': 'superadmin', 'password': 'admin123'})
+    return response.get_json()['access_token']
+
+@pytest.fixture
+def events_token(client, access_token):
+    response = client.post('/api/events/token', headers={'Authorization': f'Bearer {access_token}'})
+    assert response.status_code == 200
+    return response.get_json()['token']
+
+def test_events_token_is_short_lived(events_token):
+    with app.app_context():
+        claims = decode_token(events_token)
+    assert claims['scope'] == 'events'
+    assert claims['exp'] - claims['iat'] == 60
+
+def test_stream_opens_with_events_token(client, events_token):
+    response = client.get(f'/api/events?jwt={events_token}', buffered=False)
+    try:
+        assert response.status_code == 200
+        assert response.mimetype == 'text/event-stream'
+        assert next(response.response).startswith(b'retry:')
+    finally:
+        response.close()
+
+def test_access_token_cannot_open_stream(client, access_token):
+    assert client.get(f'/api/events?jwt={access_token}').status_code == 403
+    assert client.get('/api/events', headers={'Authorization': f'Bearer {access_token}'}).status_code == 403
+
+def test_events_token_only_opens_stream(client, events_token):
+    response = client.get('/api/domains', headers={'Authorization': f'Bearer {events_token}'})
+    assert response.status_code == 403
@@ -0,0 +1,73 @@
+import pytest
+import mail_shards
+from mail_shards import ShardRouter, migrate_domain, prune_control_mail
+from database import get_db_connection, insert_email, read_body
+
+@pytest.fixture
+def router(tmp_path, monkeypatch):
+    router = ShardRouter(str(tmp_path / 'shards'))
+    monkeypatch.setattr(mail_shards, 'shard_router', router)
+    yield router
+    router.close_all()
+
+@pytest.fixture
+def domain():
+    """Domínio com três emails no banco principal; devolve (domain_id, ids)"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO domains (domain_name) VALUES ('migrar.test')")
+    domain_id = cursor.lastrowid
+    ids = [insert_email(cursor, 'a@remoto.test', 'b@migrar.test', f'Fatura {i}', f'valor {i} reais',
+                        domain_id, 'received') for i in range(3)]
+    conn.commit()
+    conn.close()
+    yield domain_id, ids
+    
+    conn = get_db_connection()
+    conn.execute('DELETE FROM emails WHERE domain_id = ?', (domain_id,))
+    conn.execute('DELETE FROM domains WHERE id = ?', (domain_id,))
+    conn.commit()
+    conn.close()
+
+def test_migrate_domain_moves_emails(router, domain):
+    domain_id, ids = domain
+    
+    assert migrate_domain(domain_id) == 3
+    
+    control = get_db_connection()
+    assert control.execute('SELECT COUNT(*) FROM emails WHERE domain_id = ?', (domain_id,)).fetchone()[0] == 0
+    control.close()
+    
+    assert router.domains() == [domain_id]
+    conn = router.connection(domain_id)
+    emails = conn.execute('SELECT * FROM emails ORDER BY id').fetchall()
+    # Os ids são preservados (fila de envio e eventos os referenciam)
+    assert [email['id'] for email in emails] == ids
+    assert read_body(conn, emails[1]) == b'valor 1 reais'
+    matches = conn.execute("SELECT rowid FROM emails_fts WHERE emails_fts MATCH 'fatura'").fetchall()
+    assert sorted(row[0] for row in matches) == ids
+    conn.close()
+
+def test_migrate_domain_is_repeatable(router, domain):
+    domain_id, ids = domain
+    migrate_domain(domain_id)
+    
+    assert migrate_domain(domain_id) == 0
+    
+    conn = router.connection(domain_id)
+    assert conn.execute('SELECT COUNT(*) FROM emails').fetchone()[0] == len(ids)
+    conn.close()
+
+def test_prune_control_mail(router, domain):
+    domain_id, _ = domain
+    migrate_domain(domain_id)
+    
+    prune_control_mail()
+    
+    control = get_db_connection()
+    orphans = control.execute('''
+    SELECT COUNT(*) FROM blobs WHERE hash NOT IN (SELECT body_hash FROM emails WHERE body_hash IS NOT NULL)
+    ''').fetchone()[0]
+    assert orphans == 0
+    assert control.execute("SELECT COUNT(*) FROM emails_fts WHERE emails_fts MATCH 'fatura'").fetchone()[0] == 0
+    control.close()
@@ -0,0 +1,76 @@
+import os
+from database import ConnectionPool, MIGRATIONS, MAIL_MIGRATIONS, run_migrations, read_body
+
+def open_db(tmp_path, name='schema.db'):
+    return ConnectionPool(os.path.join(str(tmp_path), name)).acquire()
+
+def user_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def test_versions_are_sequential():
+    for migrations in (MIGRATIONS, MAIL_MIGRATIONS):
+        assert [version for version, _, _ in migrations] == list(range(1, len(migrations) + 1))
+
+def test_fresh_database_reaches_latest_version(tmp_path):
+    conn = open_db(tmp_path)
+    run_migrations(conn)
+    
+    assert user_version(conn) == MIGRATIONS[-1][0]
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert {'emails', 'blobs', 'emails_fts', 'events', 'meta', 'outbound_queue'} <= tables
+    conn.close()
+
+def test_migrations_are_idempotent(tmp_path):
+    conn = open_db(tmp_path)
+    run_migrations(conn)
+    schema = conn.execute('SELECT name, sql FROM sqlite_master ORDER BY name').fetchall()
+    
+    run_migrations(conn)
+    
+    assert user_version(conn) == MIGRATIONS[-1][0]
+    assert conn.execute('SELECT name, sql FROM sqlite_master ORDER BY name').fetchall() == schema
+    conn.close()
+
+def test_upgrade_moves_existing_bodies(tmp_path):
+    # Banco parado na migração 6: corpo em emails.body, sem cabeçalhos
+    conn = open_db(tmp_path)
+    run_migrations(conn, MIGRATIONS[:6])
+    assert user_version(conn) == 6
+    
+    source = 'From: a@remoto.test\r\nSubject: Relatório\r\n\r\nconteúdo migrado\r\n'
+    conn.execute("INSERT INTO domains (domain_name) VALUES ('antigo.test')")
+    conn.execute('''
+    INSERT INTO emails (sender, recipient, subject, body, domain_id, status)
+    VALUES ('a@remoto.test', 'b@antigo.test', 'Relatório', ?, 1, 'received')
+    ''', (source,))
+    conn.execute("INSERT INTO emails_fts (emails_fts) VALUES ('rebuild')")
+    conn.commit()
+    
+    run_migrations(conn)
+    
+    assert user_version(conn) == MIGRATIONS[-1][0]
+    email = conn.execute('SELECT * FROM emails').fetchone()
+    assert email['body'] is None
+    assert email['body_hash'] is not None
+    assert email['from_header'] == 'a@remoto.test'
+    assert 'conteúdo migrado' in email['snippet']
+    assert read_body(conn, email) == source.encode('utf-8')
+    
+    # O índice reconstruído lê o corpo do blob (fonte da migração 9)
+    conn.execute("INSERT INTO emails_fts (emails_fts) VALUES ('rebuild')")
+    matches = conn.execute("SELECT rowid FROM emails_fts WHERE emails_fts MATCH 'migrado'").fetchall()
+    assert [row[0] for row in matches] == [email['id']]
+    conn.close()
+
+def test_mail_migrations(tmp_path):
+    conn = open_db(tmp_path, 'domain_1.db')
+    run_migrations(conn, MAIL_MIGRATIONS)
+    
+    assert user_version(conn) == MAIL_MIGRATIONS[-1][0]
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(emails)')]
+    control = open_db(tmp_path)
+    run_migrations(control)
+    # migrate_domain copia com INSERT ... SELECT *: mesmas colunas, na mesma ordem
+    assert columns == [row[1] for row in control.execute('PRAGMA table_info(emails)')]
+    conn.close()
+    control.close()
@@ -0,0 +1,110 @@
+import json
+import itertools
+import pytest
+from app import app, encode_cursor, decode_cursor
+from database import get_db_connection, insert_email
+from passwords import hash_password
+
+_names = itertools.count(1)
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+@pytest.fixture
+def mailbox(client):
+    """Domínio com um usuário e cinco emails no mesmo segundo; devolve (headers, ids)"""
+    number = next(_names)
+    name = f'pagina{number}.test'
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('INSERT INTO domains (domain_name) VALUES (?)', (name,))
+    domain_id = cursor.lastrowid
+    cursor.execute('''
+    INSERT INTO users (username, email, password_hash, domain_id) VALUES (?, ?, ?, ?)
+    ''', (f'leitor{number}', f'leitor@{name}', hash_password('senha'), domain_id))
+    ids = [insert_email(cursor, 'a@remoto.test', f'leitor@{name}', f'Email {i}', f'corpo {i}',
+                        domain_id, 'received') for i in range(5)]
+    cursor.execute("UPDATE emails SET received_at = '2024-05-01 12:00:00' WHERE domain_id = ?",
+                   (domain_id,))
+    conn.commit()
+    conn.close()
+    
+    response = client.post('/api/login', json={'username': f'leitor{number}@{name}', 'password': 'senha'})
+    token = response.get_json()['access_token']
+    return {'Authorization': f'Bearer {token}'}, ids
+
+def test_cursor_round_trip():
+    cursor = encode_cursor(('2024-05-01 12:00:00', 42))
+    assert decode_cursor(cursor, str, int) == ['2024-05-01 12:00:00', 42]
+    assert decode_cursor(None, str, int) is None
+    assert decode_cursor('', int) is None
+
+@pytest.mark.parametrize('values, types', [
+    ([1], (str, int)),
+    (['a', 'b'], (str, int)),
+    (['a', True], (str, int)),
+    ([None, 1], (str, int)),
+    ([1, 2], (int,)),
+])
+def test_cursor_shape_is_checked(values, types):
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor(values), *types)
+
+@pytest.mark.parametrize('cursor', ['%%%', 'Zm9v', 'e30'])
+def test_cursor_garbage(cursor):
+    # Não é base64, não é JSON ("foo"), não é uma lista ({})
+    with pytest.raises(ValueError):
+        decode_cursor(cursor, int)
+
+def test_email_pages_cover_every_email_once(client, mailbox):
+    headers, ids = mailbox
+    seen = []
+    cursor = None
+    while True:
+        url = '/api/emails?limit=2' + (f'&cursor={cursor}' if cursor else '')
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200
+        page = json.loads(response.get_data())
+        assert len(page['items']) <= 2
+        seen.extend(item['id'] for item in page['items'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    
+    # Mesmo received_at: o id desempata, do mais novo para o mais antigo
+    assert seen == sorted(ids, reverse=True)
+
+@pytest.mark.parametrize('cursor', [
+    encode_cursor([1]),
+    encode_cursor(['2024-05-01 12:00:00', '7']),
+    encode_cursor([None, 7]),
+    'não-é-base64',
+])
+def test_email_page_rejects_bad_cursor(client, mailbox, cursor):
+    headers, _ = mailbox
+    response = client.get(f'/api/emails?cursor={cursor}', headers=headers)
+    assert response.status_code == 400
+
+@pytest.mark.parametrize('limit', ['0', '-1', 'dez'])
+def test_email_page_rejects_bad_limit(client, mailbox, limit):
+    headers, _ = mailbox
+    assert client.get(f'/api/emails?limit={limit}', headers=headers).status_code == 400
+
+def test_dashboard_totals_are_not_page_sizes(client, mailbox):
+    headers, _ = mailbox
+    domain_id = json.loads(client.get('/api/domains', headers=headers).get_data())['items'][0]['id']
+    conn = get_db_connection()
+    conn.executemany('INSERT INTO users (username, email, password_hash, domain_id) VALUES (?, ?, ?, ?)',
+                     [(f'extra{domain_id}-{i}', f'extra{i}@d{domain_id}.test', 'x', domain_id)
+                      for i in range(60)])
+    conn.commit()
+    conn.close()
+    
+    users = json.loads(client.get('/api/users', headers=headers).get_data())
+    stats = client.get('/api/stats', headers=headers).get_json()
+    
+    assert len(users['items']) == 50
+    assert stats['user_count'] == 61
+    assert stats['domain_count'] == 1
+    assert stats['emails_today'] >= 0
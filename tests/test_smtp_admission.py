@@ -0,0 +1,103 @@
+import smtplib
+import pytest
+from smtp_admission import RateLimiter, AdmissionControl, AdmissionController
+
+class FakeWriter:
+    def __init__(self, pending=0):
+        self.pending = pending
+
+@pytest.fixture
+def admission():
+    control = AdmissionControl(FakeWriter())
+    control.max_connections = 3
+    control.max_per_peer = 2
+    control.writer_limit = 10
+    control.refusal_delay = 0
+    control.peers = RateLimiter(1, 2)
+    control.senders = RateLimiter(1, 2)
+    return control
+
+def test_rate_limiter_bucket():
+    limiter = RateLimiter(rate=1, burst=2)
+    
+    assert limiter.allow('ip', now=0)
+    assert limiter.allow('ip', now=0)
+    assert not limiter.allow('ip', now=0)
+    # Uma ficha por segundo, até o burst
+    assert limiter.allow('ip', now=1)
+    assert not limiter.allow('ip', now=1)
+    assert limiter.allow('outro', now=1)
+
+def test_rate_limiter_disabled():
+    limiter = RateLimiter(rate=0, burst=0)
+    assert all(limiter.allow('ip') for _ in range(100))
+    assert len(limiter) == 0
+
+def test_rate_limiter_evicts_oldest_key():
+    limiter = RateLimiter(rate=1, burst=1, max_keys=2)
+    
+    for key in ('a', 'b', 'c'):
+        assert limiter.allow(key, now=0)
+    
+    assert len(limiter) == 2
+    # "a" saiu do LRU e volta com o balde cheio
+    assert limiter.allow('a', now=0)
+    assert not limiter.allow('c', now=0)
+
+def test_connections_per_peer(admission):
+    assert admission.open('10.0.0.1') is None
+    assert admission.open('10.0.0.1') is None
+    assert admission.open('10.0.0.1').startswith('421 ')
+    assert admission.open('10.0.0.2') is None
+    
+    admission.close('10.0.0.1')
+    assert admission.open('10.0.0.1') is None
+
+def test_total_connections(admission):
+    for peer in ('10.0.0.1', '10.0.0.2', '10.0.0.3'):
+        assert admission.open(peer) is None
+    
+    assert admission.open('10.0.0.4').startswith('421 ')
+    assert admission.connections == 3
+
+def test_busy_writer(admission):
+    admission.writer.pending = admission.writer_limit
+    
+    assert admission.open('10.0.0.1').startswith('421 4.3.2')
+    assert admission.admit_message('10.0.0.1', 'a@remoto.test').startswith('421 4.3.2')
+    assert admission.connections == 0
+
+def test_message_rates(admission):
+    assert admission.admit_message('10.0.0.1', 'a@remoto.test') is None
+    assert admission.admit_message('10.0.0.2', 'A@Remoto.test') is None
+    # O remetente é comparado sem diferenciar maiúsculas
+    assert admission.admit_message('10.0.0.3', 'a@remoto.test').startswith('451 ')
+    
+    assert admission.admit_message('10.0.0.1', 'b@remoto.test') is None
+    assert admission.admit_message('10.0.0.1', 'c@remoto.test').startswith('451 ')
+
+def test_null_sender_only_counts_peer(admission):
+    assert admission.admit_message('10.0.0.1', '') is None
+    assert admission.admit_message('10.0.0.1', '') is None
+    assert admission.admit_message('10.0.0.1', '').startswith('451 ')
+    assert len(admission.senders) == 0
+
+class AdmissionHandler:
+    def __init__(self, admission):
+        self.admission = admission
+    
+    async def handle_DATA(self, server, session, envelope):
+        return '250 OK'
+
+def test_connection_refused_before_greeting(admission, free_port):
+    admission.max_per_peer = 1
+    controller = AdmissionController(AdmissionHandler(admission), hostname='127.0.0.1', port=free_port)
+    controller.start()
+    try:
+        with smtplib.SMTP('127.0.0.1', free_port) as first:
+            assert first.noop()[0] == 250
+            with pytest.raises(smtplib.SMTPConnectError) as refused:
+                smtplib.SMTP('127.0.0.1', free_port)
+            assert refused.value.smtp_code == 421
+    finally:
+        controller.stop()
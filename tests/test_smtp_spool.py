@@ -0,0 +1,64 @@
+import smtplib
+import pytest
+from smtp_spool import SpoolingController
+
+class RecordingHandler:
+    """Guarda o conteúdo de cada DATA recebido"""
+    
+    def __init__(self):
+        self.messages = []
+    
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((envelope.mail_from, list(envelope.rcpt_tos),
+                              envelope.content.getvalue(), envelope.content.parsed()))
+        return '250 OK'
+
+@pytest.fixture
+def smtp_server(free_port):
+    handler = RecordingHandler()
+    controller = SpoolingController(handler, hostname='127.0.0.1', port=free_port,
+                                    data_size_limit=1024)
+    controller.start()
+    yield handler, free_port
+    controller.stop()
+
+def test_data_session_is_spooled(smtp_server):
+    handler, port = smtp_server
+    message = b'Subject: Ola\r\n\r\nprimeira linha\r\n.linha com ponto\r\n'
+    
+    with smtplib.SMTP('127.0.0.1', port) as client:
+        assert client.sendmail('a@remoto.test', ['b@local.test'], message) == {}
+    
+    [(mail_from, rcpt_tos, content, fields)] = handler.messages
+    assert mail_from == 'a@remoto.test'
+    assert rcpt_tos == ['b@local.test']
+    # A transparência do ponto é desfeita na gravação
+    assert content == message
+    assert fields['subject'] == 'Ola'
+
+def test_data_over_limit_is_refused(smtp_server):
+    handler, port = smtp_server
+    
+    with smtplib.SMTP('127.0.0.1', port) as client:
+        client.ehlo()
+        client.mail('a@remoto.test')
+        client.rcpt('b@local.test')
+        code, _ = client.data(b'Subject: grande\r\n\r\n' + (b'x' * 70 + b'\r\n') * 30)
+    
+    assert code == 552
+    assert handler.messages == []
+
+def test_data_requires_recipient(smtp_server):
+    _, port = smtp_server
+    
+    with smtplib.SMTP('127.0.0.1', port) as client:
+        client.ehlo()
+        client.mail('a@remoto.test')
+        assert client.docmd('DATA')[0] == 503
+
+def test_help_data(smtp_server):
+    _, port = smtp_server
+    
+    with smtplib.SMTP('127.0.0.1', port) as client:
+        client.ehlo()
+        assert client.docmd('HELP', 'DATA') == (250, b'Syntax: DATA')
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import random
+import signal
+import socket
+import logging
+import threading
+from werkzeug.serving import BaseWSGIServer
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Requisições de longa duração (Server-Sent Events), atendidas em threads
+STREAM_PREFIX = b'GET /api/events'
+
+class WorkerWSGIServer(BaseWSGIServer):
+    """
+    Servidor HTTP de um worker: uma requisição por vez, exceto os streams
+    de STREAM_PREFIX, que ficariam abertos indefinidamente e prenderiam o
+    worker; cada um ganha uma thread. O início da requisição é lido com
+    MSG_PEEK, sem consumi-lo.
+    
+    O socket de escuta é compartilhado pelos workers e fica não bloqueante:
+    quando outro worker aceita a conexão que acordou o select(), o accept()
+    falha com BlockingIOError e o worker volta ao select() em vez de ficar
+    preso no accept(), onde não perceberia o SIGTERM.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.socket.setblocking(False)
+        self.streams = set()
+        self.handled = 0
+    
+    def process_request(self, request, client_address):
+        self.handled += 1
+        try:
+            head = request.recv(len(STREAM_PREFIX), socket.MSG_PEEK | socket.MSG_WAITALL)
+        except OSError:
+            head = b''
+        if not head.startswith(STREAM_PREFIX):
+            super().process_request(request, client_address)
+            return
+        
+        thread = threading.Thread(target=self._process_stream, args=(request, client_address),
+                                  daemon=True, name="WebStream")
+        self.streams.add(thread)
+        thread.start()
+    
+    def _process_stream(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.streams.discard(threading.current_thread())
+
+class PreforkServer:
+    """
+    Servidor HTTP de produção para o painel.
+    
+    O processo mestre abre um único socket de escuta e cria `workers`
+    processos filhos que aceitam conexões nele. Cada worker atende uma
+    requisição por vez (os streams de /api/events ganham threads, ver
+    WorkerWSGIServer) e é reciclado após WEB_MAX_REQUESTS requisições (com
+    um pouco de variação para que não reiniciem todos juntos). Em SIGTERM ou
+    SIGINT o mestre para de criar workers, pede que terminem a requisição em
+    andamento e espera até WEB_GRACEFUL_TIMEOUT segundos antes de forçar.
+    """
+    
+    def __init__(self, app, host=None, port=None, workers=None, max_requests=None):
+        self.app = app
+        self.host = host or Config.WEB_HOST
+        self.port = port or Config.WEB_PORT
+        self.workers = workers or Config.WEB_WORKERS
+        self.max_requests = max_requests or Config.WEB_MAX_REQUESTS
+        self.socket = None
+        self._children = {}
+        self._stopping = False
+    
+    def run(self):
+        """Executa o mestre até receber SIGTERM/SIGINT"""
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.host, self.port))
+        self.socket.listen(Config.WEB_BACKLOG)
+        self.socket.set_inheritable(True)
+        
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        
+        logger.info(f"🌐 Painel web em http://{self.host}:{self.port} com {self.workers} workers")
+        
+        for _ in range(self.workers):
+            self._spawn()
+        
+        while not self._stopping:
+            self._reap()
+            while len(self._children) < self.workers and not self._stopping:
+                self._spawn()
+            time.sleep(0.5)
+        
+        self._shutdown()
+    
+    def _handle_stop(self, signum, frame):
+        self._stopping = True
+    
+    def _spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self._worker()
+            except Exception as e:
+                logger.error(f"Erro no worker web: {str(e)}")
+                code = 1
+            finally:
+                # os._exit não roda os atexit: o pool do bcrypt criado pelo
+                # worker ficaria órfão, um conjunto por reciclagem
+                from passwords import password_service
+                password_service.shutdown()
+                os._exit(code)
+        self._children[pid] = time.monotonic()
+    
+    def _reap(self):
+        """Remove workers que terminaram (reciclados ou com falha)"""
+        while self._children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self._children.clear()
+                return
+            if pid == 0:
+                return
+            self._children.pop(pid, None)
+            if os.waitstatus_to_exitcode(status) != 0 and not self._stopping:
+                logger.warning(f"Worker web {pid} terminou com status {os.waitstatus_to_exitcode(status)}")
+    
+    def _shutdown(self):
+        logger.info("🛑 Encerrando workers web...")
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        
+        deadline = time.monotonic() + Config.WEB_GRACEFUL_TIMEOUT
+        while self._children and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        
+        for pid in list(self._children):
+            logger.warning(f"Worker web {pid} não terminou a tempo; forçando")
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        while self._children:
+            self._reap()
+            time.sleep(0.1)
+        
+        self.socket.close()
+    
+    def _worker(self):
+        from metrics import registry
+        from events import event_bus
+        
+        stopping = False
+        
+        def handle_stop(signum, frame):
+            nonlocal stopping
+            stopping = True
+        
+        signal.signal(signal.SIGTERM, handle_stop)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        
+        server = WorkerWSGIServer(self.host, self.port, self.app, fd=self.socket.fileno())
+        # Acordar periodicamente para perceber o pedido de parada
+        server.timeout = 1.0
+        
+        registry.start_dumper('web')
+        
+        limit = self.max_requests + random.randint(0, Config.WEB_MAX_REQUESTS_JITTER)
+        while not stopping and server.handled < limit:
+            server.handle_request()
+        
+        server.socket.close()
+        
+        # Encerrar os streams abertos; o navegador reconecta em outro worker
+        event_bus.close(timeout=1)
+        for thread in list(server.streams):
+            thread.join(1)
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    
+    # Importar o app uma vez no mestre: os workers herdam tudo pronto
+    from app import app
+    PreforkServer(app).run()
+
+if __name__ == '__main__':
+    sys.exit(main())